@@ -1,15 +1,24 @@
-from flask import Flask
+from flask import Flask, request
 from flask_cors import CORS
-from extensions import db, limiter, migrate
+from extensions import db, limiter, migrate, balance_cache, deposit_guard, event_broker, leaderboard, pricing, read_router
 from routes.wallet import wallet_bp
 from routes.user import user_bp
 from routes.deposit import deposit_bp
 from routes.withdraw import withdraw_bp
 from routes.bottle_detection import bottle_detection_bp 
+from routes.analytics import analytics_bp
+from routes.leaderboard import leaderboard_bp
+from monitoring.queries import init_query_stats, endpoint_query_stats
+from monitoring.profiler import Profile, ProfilerBusy, background_result, start_background
+from monitoring.tracing import find_trace, init_tracing, recent_traces
+from auth.ops import ops_required
+from monitoring.metrics import init_metrics, render_metrics
+from commands import register_commands
 from sqlalchemy import text
 from config import Config
 import os
 import logging
+import threading
 import firebase_admin
 from firebase_admin import credentials
 
@@ -49,9 +58,18 @@ def create_app():
     app.logger.info(f"Stripe Key configured: {bool(os.getenv('STRIPE_SECRET_KEY'))}")
     
     # Initialize extensions
+    init_metrics(app)       # before db/limiter: sets pool class and on_breach hook
+    read_router.init_app(app)   # before db: adds the replica bind
     db.init_app(app)
     limiter.init_app(app)
     migrate.init_app(app, db)
+    balance_cache.init_app(app)
+    deposit_guard.init_app(app)
+    event_broker.init_app(app)
+    leaderboard.init_app(app)
+    pricing.init_app(app)
+    init_query_stats(app)
+    init_tracing(app)
     
     # Handle database setup more gracefully
     with app.app_context():
@@ -86,15 +104,39 @@ def create_app():
     app.register_blueprint(deposit_bp)
     app.register_blueprint(withdraw_bp)
     app.register_blueprint(bottle_detection_bp)
+    app.register_blueprint(analytics_bp)
+    app.register_blueprint(leaderboard_bp)
+    register_commands(app)
+    
+    # Local single-process setups can run the payout workers inside the app;
+    # production runs `flask payouts work` as its own process.
+    if app.config.get('PAYOUT_INPROCESS_WORKERS'):
+        from services.payouts import PayoutWorkerPool
+        app.extensions['payout_workers'] = PayoutWorkerPool(app).start()
+        app.logger.info("In-process payout workers started")
     
     @app.route('/health')
     def health_check():
-        """Health check endpoint"""
+        """Health check endpoint; unhealthy while deposits are priced from built-in defaults"""
+        pricing.snapshot()      # loads the table on a worker that hasn't priced anything yet
+        if pricing.fallback:
+            return {
+                'status': 'unhealthy',
+                'pricing': 'fallback',
+                'environment': app.config.get('FLASK_ENV', 'production')
+            }, 503
         return {
             'status': 'healthy',
             'environment': app.config.get('FLASK_ENV', 'production')
         }, 200
     
+    @app.route('/metrics')
+    @limiter.exempt
+    def metrics():
+        """Prometheus scrape endpoint (aggregated across gunicorn workers)"""
+        body, content_type = render_metrics()
+        return body, 200, {'Content-Type': content_type}
+    
     @app.route('/debug/config')
     def debug_config():
         """Debug endpoint to check configuration"""
@@ -107,6 +149,66 @@ def create_app():
             'firebase_initialized': bool(firebase_admin._apps)
         }, 200
     
+    @app.route('/debug/queries')
+    @ops_required
+    def debug_queries():
+        """Per-endpoint SQL statement counts and DB time for this worker"""
+        return {
+            'slow_query_threshold_ms': app.config.get('SLOW_QUERY_THRESHOLD_MS'),
+            'endpoints': endpoint_query_stats()
+        }, 200
+    
+    @app.route('/debug/profile', methods=['GET', 'POST'])
+    @ops_required
+    def debug_profile():
+        """Sample this worker's stacks; GET waits and returns collapsed stacks, POST runs in the background"""
+        seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), app.config['PROFILER_MAX_SECONDS'])
+        interval_ms = max(request.args.get('interval_ms', app.config['PROFILER_INTERVAL_MS'], type=float), 1)
+        try:
+            if request.method == 'POST':
+                # Sync workers serve one request at a time: return now so this one keeps taking traffic
+                profile = start_background(app.config, seconds, interval_ms)
+                return {'id': profile.id, 'seconds': seconds, 'status_url': f'/debug/profile/{profile.id}'}, 202
+            profile = Profile(seconds, interval_ms, exclude=[threading.get_ident()]).start().wait()
+        except ProfilerBusy as e:
+            return {'error': f'Profile {e} is already running in this worker'}, 409
+        return profile.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8',
+                                          'X-Profile-Samples': str(profile.samples)}
+    
+    @app.route('/debug/profile/<profile_id>')
+    @ops_required
+    def debug_profile_result(profile_id):
+        """Collapsed stacks of a background profile started by any worker on this host"""
+        status, collapsed = background_result(app.config, profile_id)
+        if status is None:
+            return {'error': 'Unknown profile'}, 404
+        if status == 'running':
+            return {'id': profile_id, 'status': 'running'}, 202, {'Retry-After': '1'}
+        return collapsed, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    
+    @app.route('/debug/traces')
+    @ops_required
+    def debug_traces():
+        """Recent traced requests and payout jobs on this worker (TRACING_ENABLED)"""
+        limit = min(max(request.args.get('limit', 20, type=int), 1), app.config['TRACING_BUFFER_SIZE'])
+        return {
+            'enabled': app.config['TRACING_ENABLED'],
+            'sample_rate': app.config['TRACING_SAMPLE_RATE'],
+            'traces': [
+                {k: t[k] for k in ('id', 'name', 'started_at', 'duration_ms', 'attrs')} | {'spans': len(t['spans'])}
+                for t in recent_traces()[:limit]
+            ]
+        }, 200
+    
+    @app.route('/debug/traces/<trace_id>')
+    @ops_required
+    def debug_trace(trace_id):
+        """One trace with its spans, if this worker recorded it"""
+        trace = find_trace(trace_id)
+        if trace is None:
+            return {'error': 'Unknown trace (traces are kept per worker)'}, 404
+        return trace, 200
+    
     @app.route('/')
     def index():
         """Root endpoint"""
@@ -116,6 +218,7 @@ def create_app():
             'status': 'running',
             'endpoints': {
                 'health': '/health',
+                'metrics': '/metrics',
                 'debug': '/debug/config',
                 'wallet': '/wallet',
                 'deposit': '/deposit',
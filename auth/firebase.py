@@ -3,9 +3,13 @@ from functools import wraps
 from flask import request, jsonify, current_app, g
 import firebase_admin
 from firebase_admin import credentials, auth
-from models import User
-from extensions import db
-import json, os, secrets, string
+from models import User, Wallet
+from extensions import db, user_limit, kiosk_fleet_limit
+from auth.kiosk_session import load_session
+from auth.principal import insert_ignore, invalidate_principal, load_principal
+from monitoring import tracing
+from monitoring.metrics import AUTH_ATTEMPTS
+import json, logging, os, secrets, string
 
 # ───────────────────────── Firebase bootstrap ─────────────────────────
 try:
@@ -16,6 +20,12 @@ except ValueError:                       # first run
     firebase_admin.initialize_app(cred)
 
 # ────────────────────────── helpers ───────────────────────────────────
+SECRET_HEADERS = {"authorization", "x-kiosk-session", "idempotency-key", "x-ops-token"}
+
+def redacted_headers() -> dict:
+    """Request headers safe to log: bearer tokens and replayable keys masked."""
+    return {k: ("<redacted>" if k.lower() in SECRET_HEADERS else v) for k, v in request.headers.items()}
+
 def generate_kiosk_id() -> str:
     """Generate a unique 8-character alphanumeric kiosk ID."""
     while True:
@@ -23,48 +33,85 @@ def generate_kiosk_id() -> str:
         if not User.query.filter_by(kiosk_id=kiosk_id).first():
             return kiosk_id
 
+def provision_user(firebase_uid, email):
+    """Create user + wallet atomically; concurrent first requests converge on one row."""
+    insert_ignore(User, "firebase_uid", firebase_uid=firebase_uid, email=email, kiosk_id=generate_kiosk_id())
+    user_id = db.session.query(User.id).filter_by(firebase_uid=firebase_uid).scalar()
+    insert_ignore(Wallet, "user_id", user_id=user_id)
+    db.session.commit()
+    return load_principal("firebase_uid", firebase_uid, use_cache=False)
+
+def ensure_kiosk_id(principal):
+    """Backfill a kiosk ID for users created before they were assigned at sign-up."""
+    if principal.kiosk_id:
+        return principal
+    kiosk_id = generate_kiosk_id()
+    User.query.filter_by(id=principal.user_id).update({"kiosk_id": kiosk_id})
+    db.session.commit()
+    invalidate_principal(principal)
+    principal.kiosk_id = kiosk_id
+    return principal
+
+def kiosk_session_auth(limited_view, args, kwargs):
+    """Authenticate from an `X-Kiosk-Session` token (no DB query); None if there isn't one."""
+    token = request.headers.get("X-Kiosk-Session")
+    if not token:
+        return None
+    user, outcome = load_session(token)
+    AUTH_ATTEMPTS.labels("kiosk_session", outcome).inc()
+    if not user:
+        return jsonify(error="Invalid or expired kiosk session"), 401
+    g.current_user = user
+    g.auth_path = "kiosk_session"
+    return limited_view(user, *args, **kwargs)
+
 # ────────────────────────── main decorator ────────────────────────────
 def firebase_required(view):
-    """Accept   ① dev bypass   ② kiosk-ID   ③ Firebase Bearer token."""
+    """Accept   ① dev bypass   ② kiosk session / kiosk-ID   ③ Firebase Bearer token."""
+    limited_view = tracing.ends("auth", kiosk_fleet_limit(user_limit(view)))   # checked after g.current_user is set
+
     @wraps(view)
     def wrapped(*args, **kwargs):
-        current_app.logger.info("=== Auth Debug ===")
-        current_app.logger.info(f"{request.method} {request.url}")
-        current_app.logger.info(f"Headers: {dict(request.headers)}")
+        tracing.begin("auth")
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug(f"Auth {request.method} {request.path} headers={redacted_headers()}")
 
         # ---------- 1) dev bypass ------------------------------------------------
         test_hdr   = request.headers.get("X-Test-User-Email")
         test_email = os.getenv("TEST_USER_EMAIL")
         if test_hdr and test_email and test_hdr == test_email:
-            user = User.query.filter_by(email=test_hdr).first()
+            user = load_principal("email", test_hdr)
             if not user:
-                user = User(
-                    firebase_uid=f"test-{test_hdr}",
-                    email=test_hdr,
-                    kiosk_id=generate_kiosk_id(),
-                )
-                db.session.add(user)
-                db.session.commit()
+                user = provision_user(f"test-{test_hdr}", test_hdr)
+                AUTH_ATTEMPTS.labels("test_bypass", "created").inc()
             else:
-                if not user.kiosk_id:
-                    user.kiosk_id = generate_kiosk_id()
-                    db.session.commit()
+                user = ensure_kiosk_id(user)
+                AUTH_ATTEMPTS.labels("test_bypass", "ok").inc()
             g.current_user = user
-            return view(user, *args, **kwargs)
+            g.auth_path = "test_bypass"
+            return limited_view(user, *args, **kwargs)
+
+        # ---------- 2) kiosk session token, else kiosk-ID -----------------------
+        response = kiosk_session_auth(limited_view, args, kwargs)
+        if response is not None:
+            return response
 
-        # ---------- 2) kiosk-ID --------------------------------------------------
         raw_json = request.get_json(silent=True)  # never raises
         kiosk_id = request.headers.get("X-Kiosk-User-ID") or (raw_json or {}).get("kiosk_id")
         if kiosk_id:
-            user = User.query.filter_by(kiosk_id=kiosk_id.upper()).first()
+            user = load_principal("kiosk_id", kiosk_id.upper())
             if not user:
+                AUTH_ATTEMPTS.labels("kiosk", "invalid").inc()
                 return jsonify(error="Invalid kiosk ID"), 401
+            AUTH_ATTEMPTS.labels("kiosk", "ok").inc()
             g.current_user = user
-            return view(user, *args, **kwargs)
+            g.auth_path = "kiosk"
+            return limited_view(user, *args, **kwargs)
 
         # ---------- 3) Firebase Bearer token ------------------------------------
         auth_header = request.headers.get("Authorization", "")
         if not auth_header.startswith("Bearer "):
+            AUTH_ATTEMPTS.labels("none", "missing").inc()
             return jsonify(
                 error="Authorization required. Use Bearer token, "
                       "X-Kiosk-User-ID header, or kiosk_id in body"
@@ -75,43 +122,55 @@ def firebase_required(view):
             decoded = auth.verify_id_token(id_token)
         except Exception as e:  # noqa: BLE001
             current_app.logger.warning(f"Token verify failed: {e}")
+            AUTH_ATTEMPTS.labels("firebase", "invalid").inc()
             return jsonify(error="Invalid or expired token"), 401
 
         uid   = decoded["uid"]
         email = decoded.get("email")
         if not email:
+            AUTH_ATTEMPTS.labels("firebase", "invalid").inc()
             return jsonify(error="Email claim missing"), 401
 
-        user = User.query.filter_by(firebase_uid=uid).first()
+        user = load_principal("firebase_uid", uid)
         if not user:
-            user = User(firebase_uid=uid, email=email, kiosk_id=generate_kiosk_id())
-            db.session.add(user)
-            db.session.commit()
+            user = provision_user(uid, email)
+            AUTH_ATTEMPTS.labels("firebase", "created").inc()
         else:
-            if not user.kiosk_id:
-                user.kiosk_id = generate_kiosk_id()
-                db.session.commit()
+            user = ensure_kiosk_id(user)
+            AUTH_ATTEMPTS.labels("firebase", "ok").inc()
 
         g.current_user = user
-        return view(user, *args, **kwargs)
+        g.auth_path = "firebase"
+        return limited_view(user, *args, **kwargs)
 
     return wrapped
 
 # ───────────────────── kiosk-only decorator ───────────────────────────
 def kiosk_only(view):
-    """Endpoint accessible **only** with a kiosk ID."""
+    """Endpoint accessible **only** with a kiosk session token or kiosk ID."""
+    limited_view = tracing.ends("auth", kiosk_fleet_limit(user_limit(view)))
+
     @wraps(view)
     def wrapped(*args, **kwargs):
+        tracing.begin("auth")
+        response = kiosk_session_auth(limited_view, args, kwargs)
+        if response is not None:
+            return response
+
         raw_json = request.get_json(silent=True)
         kiosk_id = request.headers.get("X-Kiosk-User-ID") or (raw_json or {}).get("kiosk_id")
         if not kiosk_id:
+            AUTH_ATTEMPTS.labels("kiosk_only", "missing").inc()
             return jsonify(error="Kiosk ID required"), 401
 
-        user = User.query.filter_by(kiosk_id=kiosk_id.upper()).first()
+        user = load_principal("kiosk_id", kiosk_id.upper())
         if not user:
+            AUTH_ATTEMPTS.labels("kiosk_only", "invalid").inc()
             return jsonify(error="Invalid kiosk ID"), 401
+        AUTH_ATTEMPTS.labels("kiosk_only", "ok").inc()
 
         g.current_user = user
-        return view(user, *args, **kwargs)
+        g.auth_path = "kiosk_only"
+        return limited_view(user, *args, **kwargs)
 
     return wrapped
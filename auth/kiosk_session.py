@@ -0,0 +1,55 @@
+# auth/kiosk_session.py
+"""Stateless kiosk session tokens: kiosk auth with an HMAC check instead of a query.
+
+POST /validate-kiosk-id with ``"issue_session": true`` returns a short-lived
+token carrying the caller's principal (user, wallet, kiosk ID, email). Sent
+back as ``X-Kiosk-Session``, it is verified in constant time against
+SECRET_KEY (HMAC-SHA1 via itsdangerous, salted for this use), so the auth
+decorators never touch the database.
+
+Key rotation: tokens are signed with SECRET_KEY and accepted under any key in
+SECRET_KEY_FALLBACKS too. Deploy the new SECRET_KEY with the old one in the
+fallbacks; drop it after KIOSK_SESSION_TTL_SECONDS, when its last token has
+expired. Dropping a key revokes every token signed with it.
+
+Tokens are not revoked when a kiosk ID changes; keep the TTL short.
+"""
+import uuid
+from functools import lru_cache
+
+from flask import current_app
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from auth.principal import AuthPrincipal
+
+SALT = "kiosk-session"
+
+
+@lru_cache(maxsize=4)
+def _serializer(keys):
+    return URLSafeTimedSerializer(list(keys), salt=SALT)     # signs with the last key, verifies with all
+
+
+def serializer():
+    config = current_app.config
+    return _serializer((*config.get("SECRET_KEY_FALLBACKS", ()), config["SECRET_KEY"]))
+
+
+def issue_session(principal):
+    """``(token, ttl_seconds)`` for ``principal``."""
+    payload = [str(principal.user_id), str(principal.wallet_id), principal.kiosk_id, principal.email]
+    return serializer().dumps(payload), current_app.config.get("KIOSK_SESSION_TTL_SECONDS", 900)
+
+
+def load_session(token):
+    """``(principal, outcome)`` from a token; principal is None unless the outcome is ``ok``."""
+    try:
+        user_id, wallet_id, kiosk_id, email = serializer().loads(
+            token, max_age=current_app.config.get("KIOSK_SESSION_TTL_SECONDS", 900)
+        )
+        principal = AuthPrincipal(uuid.UUID(user_id), email, kiosk_id, uuid.UUID(wallet_id))
+    except SignatureExpired:
+        return None, "expired"
+    except (BadSignature, TypeError, ValueError):
+        return None, "invalid"
+    return principal, "ok"
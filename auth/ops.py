@@ -0,0 +1,34 @@
+# auth/ops.py
+"""Operator endpoints (analytics exports, diagnostics): a shared token, not a user.
+
+Requests carry OPS_API_TOKEN in `X-Ops-Token`. With no token configured the
+endpoints answer 404, so a deployment that never set one doesn't expose them.
+"""
+import hmac
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+
+from monitoring.metrics import AUTH_ATTEMPTS
+
+
+def ops_token_valid():
+    """Whether the request carries the configured ops token (False when none is configured)."""
+    expected = current_app.config.get("OPS_API_TOKEN")
+    supplied = request.headers.get("X-Ops-Token", "")
+    return bool(expected) and hmac.compare_digest(supplied.encode(), expected.encode())
+
+
+def ops_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_app.config.get("OPS_API_TOKEN"):
+            return jsonify(error="Not found"), 404
+        if not ops_token_valid():
+            AUTH_ATTEMPTS.labels("ops_token", "invalid").inc()
+            return jsonify(error="Invalid ops token"), 401
+        AUTH_ATTEMPTS.labels("ops_token", "ok").inc()
+        g.auth_path = "ops_token"
+        return view(*args, **kwargs)
+
+    return wrapped
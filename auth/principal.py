@@ -0,0 +1,115 @@
+# auth/principal.py
+"""What the auth decorators hand to views: ids and contact fields, not an ORM User.
+
+`load_principal()` resolves one with a single column-only query (users outer
+join wallets) and keeps it in a small per-process TTL cache, so repeat callers
+are authenticated without touching the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from extensions import db
+from models import User, Wallet
+
+
+class AuthPrincipal:
+    """The authenticated caller."""
+    __slots__ = ("user_id", "email", "kiosk_id", "wallet_id")
+
+    def __init__(self, user_id, email, kiosk_id, wallet_id):
+        self.user_id = user_id
+        self.email = email
+        self.kiosk_id = kiosk_id
+        self.wallet_id = wallet_id
+
+    @property
+    def id(self):
+        """Alias so code written against `User` (``current_user.id``) keeps working."""
+        return self.user_id
+
+    def __repr__(self):
+        return f"<AuthPrincipal {self.user_id} {self.email}>"
+
+
+# ────────────────────────── cache ─────────────────────────────────────
+_cache = OrderedDict()          # (field, value) → (expires_at, principal)
+_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _lock:
+        hit = _cache.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def _cache_put(key, principal):
+    ttl = current_app.config.get("AUTH_PRINCIPAL_CACHE_TTL_SECONDS", 60)
+    if ttl <= 0:
+        return
+    with _lock:
+        _cache[key] = (time.monotonic() + ttl, principal)
+        _cache.move_to_end(key)
+        while len(_cache) > current_app.config.get("AUTH_PRINCIPAL_CACHE_MAX_ENTRIES", 50000):
+            _cache.popitem(last=False)
+
+
+def invalidate_principal(principal):
+    """Drop every cached lookup that resolves to ``principal``'s user."""
+    with _lock:
+        for key in [k for k, (_, p) in _cache.items() if p.user_id == principal.user_id]:
+            del _cache[key]
+
+
+# ────────────────────────── lookup ────────────────────────────────────
+def insert_ignore(model, conflict_column, **values):
+    """INSERT … ON CONFLICT (conflict_column) DO NOTHING, for Postgres and SQLite; returns rows inserted.
+
+    ``conflict_column`` may be a tuple for a composite key.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upsert not supported on {dialect}")
+    columns = [conflict_column] if isinstance(conflict_column, str) else list(conflict_column)
+    stmt = insert(model.__table__).values(**values).on_conflict_do_nothing(index_elements=columns)
+    return db.session.execute(stmt).rowcount
+
+
+def _query(field, value):
+    return (
+        db.session.query(User.id, User.email, User.kiosk_id, Wallet.id)
+        .outerjoin(Wallet, Wallet.user_id == User.id)
+        .filter(getattr(User, field) == value)
+        .first()
+    )
+
+
+def load_principal(field, value, use_cache=True):
+    """Principal for the user whose ``field`` equals ``value``, or None."""
+    key = (field, value)
+    if use_cache:
+        principal = _cache_get(key)
+        if principal is not None:
+            return principal
+
+    row = _query(field, value)
+    if row is None:
+        return None
+    if row[3] is None:
+        # Users created before wallets were provisioned eagerly and not yet
+        # backfilled by migration b7f2c0d4e816.
+        insert_ignore(Wallet, "user_id", user_id=row[0])
+        db.session.commit()
+        row = _query(field, value)
+
+    principal = AuthPrincipal(*row)
+    _cache_put(key, principal)
+    return principal
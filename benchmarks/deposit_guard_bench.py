@@ -0,0 +1,137 @@
+# benchmarks/deposit_guard_bench.py
+"""Cost of the deposit velocity checks (services/deposit_guard.py) on the deposit path.
+
+    python -m benchmarks.deposit_guard_bench
+    python -m benchmarks.deposit_guard_bench -n 200000 --keys 1,1000,100000 --threads 4
+    python -m benchmarks.deposit_guard_bench --redis redis://localhost:6379/0
+
+Part one calls `DepositGuard.screen` directly at a high deposit rate, spread
+over --keys distinct users (each on one of keys/10 kiosk devices), with the
+default rules, from --threads threads sharing one guard (with as many keys
+as calls, every call meets a new user and allocates its windows). With --redis the
+sync thread runs against that server meanwhile. Part two posts real
+/deposit/kiosk requests with the guard off and on, so the overhead can be
+read against the whole request. Limits are raised so nothing is held and
+every call does the full check.
+"""
+import argparse
+import os
+import threading
+import time
+
+from benchmarks.harness import bootstrap_app, compare, print_table, summarize, write_results
+
+KIOSK_EMAIL = "guard-bench@example.com"
+
+
+def make_guard(redis_url=None, sync_seconds=1.0):
+    import redis
+
+    from services.deposit_guard import DEFAULT_RULES, DepositGuard, parse_rules
+
+    guard = DepositGuard()
+    guard.enabled = True
+    guard.set_rules(parse_rules([{**rule, **{k: 10**15 for k in rule if k.startswith("max_")}} for rule in DEFAULT_RULES]))
+    guard.sync_seconds = sync_seconds
+    if redis_url:
+        guard._redis = redis.Redis.from_url(redis_url, socket_connect_timeout=0.05, socket_timeout=0.05)
+    return guard
+
+
+def screen_cost(guard, keys, iterations, threads):
+    """Per-call latencies (s) of ``screen`` and the wall time for all threads."""
+    users = [f"user-{i}" for i in range(keys)]
+    devices = [f"KSK-{i:04d}" for i in range(max(1, keys // 10))]
+    per_thread = iterations // threads
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(offset):
+        clock = time.perf_counter
+        screen = guard.screen
+        local = []
+        barrier.wait()
+        for i in range(offset, offset + per_thread):
+            user = users[i % keys]
+            device = devices[i % len(devices)]
+            t0 = clock()
+            screen(user, device, 12, 120)
+            local.append(clock() - t0)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=worker, args=(n * per_thread,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in pool:
+        t.join()
+    return latencies, time.perf_counter() - started
+
+
+def request_cost(app, enabled, iterations):
+    from extensions import deposit_guard
+
+    client = app.test_client()
+    kiosk_id = client.get("/user/kiosk-id", headers={"X-Test-User-Email": KIOSK_EMAIL}).get_json()["kiosk_id"]
+    headers = {"X-Kiosk-User-ID": kiosk_id, "X-Kiosk-Device-ID": "KSK-0001"}
+    deposit_guard.enabled = enabled
+    deposit_guard.set_rules(make_guard().rules)
+    for _ in range(20):                                                   # warm-up
+        client.post("/deposit/kiosk", json={"material": "aluminum", "units": 2}, headers=headers)
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        r = client.post("/deposit/kiosk", json={"material": "aluminum", "units": 2}, headers=headers)
+        latencies.append(time.perf_counter() - t0)
+        errors += r.status_code != 201
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=100000, help="screen() calls per case")
+    parser.add_argument("--keys", default="1,1000,100000", help="comma-separated distinct users per case")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--redis", metavar="URL", help="sync to this Redis while measuring")
+    parser.add_argument("--requests", type=int, default=500, help="/deposit/kiosk calls per case (0 skips)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/deposit-guard-<ts>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to diff against")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for keys in (int(k) for k in args.keys.split(",")):
+        guard = make_guard(args.redis)
+        latencies, elapsed = screen_cost(guard, keys, args.iterations, args.threads)
+        summary = summarize(latencies, elapsed)
+        summary["mean_us"] = round(sum(latencies) / len(latencies) * 1e6, 2)
+        summary["p99_us"] = round(sorted(latencies)[int(len(latencies) * 0.99)] * 1e6, 2)
+        results[f"screen/{keys}-keys"] = summary
+
+    print(f"{'case':<24}{'calls':>10}{'mean µs':>10}{'p99 µs':>10}{'calls/s':>12}")
+    for case, r in results.items():
+        print(f"{case:<24}{r['requests']:>10}{r['mean_us']:>10}{r['p99_us']:>10}{r['throughput_rps']:>12}")
+
+    if args.requests:
+        sqlite_file = os.path.abspath("bench.db")
+        if os.path.exists(sqlite_file):
+            os.remove(sqlite_file)
+        app = bootstrap_app(None, KIOSK_EMAIL)
+        for label, enabled in (("off", False), ("on", True)):
+            results[f"deposit_kiosk/guard-{label}"] = request_cost(app, enabled, args.requests)
+        print()
+        print_table({k: v for k, v in results.items() if k.startswith("deposit_kiosk")})
+        os.remove(sqlite_file)
+
+    params = {"iterations": args.iterations, "threads": args.threads, "redis": bool(args.redis)}
+    path = write_results("deposit-guard", results, params, args.output)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
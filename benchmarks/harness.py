@@ -0,0 +1,166 @@
+# benchmarks/harness.py
+"""Shared plumbing for the benchmark scripts: app bootstrap, timing, JSON results."""
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+BENCH_USER_EMAIL = "bench@example.com"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+# ───────────────────────── app bootstrap ──────────────────────────────
+def bootstrap_app(database_url=None, test_email=BENCH_USER_EMAIL, rate_limits=False, deposit_guard=False):
+    """Import the real app against a local database with Firebase stubbed out.
+
+    Auth goes through the ``X-Test-User-Email`` dev bypass, so the Firebase SDK
+    only has to be initialised – no service account or network is needed.
+    """
+    os.environ["DATABASE_URL"] = database_url or "sqlite:///" + os.path.abspath("bench.db")
+    os.environ["TEST_USER_EMAIL"] = test_email
+    os.environ.pop("STRIPE_SECRET_KEY", None)        # withdrawals run in stub mode
+
+    import firebase_admin
+    from firebase_admin import credentials
+
+    class _BenchCredential(credentials.Base):
+        def get_credential(self):
+            return None
+
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app(_BenchCredential(), {"projectId": "benchmark"})
+
+    from app import app
+    from extensions import deposit_guard as guard, limiter
+
+    limiter.enabled = rate_limits
+    guard.enabled = deposit_guard          # bench users deposit far faster than the velocity rules allow
+    return app
+
+
+# ───────────────────────── query counting ─────────────────────────────
+class QueryCounter:
+    """Counts statements sent to the engine while attached."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._engine = engine
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def reset(self):
+        count, self.count = self.count, 0
+        return count
+
+    def close(self):
+        from sqlalchemy import event
+
+        event.remove(self._engine, "before_cursor_execute", self._on_execute)
+
+
+# ───────────────────────── statistics ─────────────────────────────────
+def percentile(sorted_values, pct):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies_s, elapsed_s, errors=0, queries=None):
+    """Turn raw per-request latencies (seconds) into the reported stats."""
+    ordered = sorted(latencies_s)
+    n = len(ordered)
+    summary = {
+        "requests": n,
+        "errors": errors,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "mean_ms": round(sum(ordered) / n * 1000, 3) if n else 0.0,
+        "throughput_rps": round(n / elapsed_s, 1) if elapsed_s else 0.0,
+    }
+    if queries is not None:
+        summary["queries_per_request"] = round(queries / n, 2) if n else 0.0
+    return summary
+
+
+def timed(fn, iterations):
+    """Call ``fn`` ``iterations`` times; return (latencies, elapsed, errors)."""
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        ok = fn()
+        latencies.append(time.perf_counter() - t0)
+        if ok is False:
+            errors += 1
+    return latencies, time.perf_counter() - start, errors
+
+
+# ───────────────────────── results I/O ────────────────────────────────
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:  # noqa: BLE001
+        return None
+
+
+def write_results(name, results, params=None, path=None):
+    """Save a run as JSON next to the other runs and return the file path."""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(RESULTS_DIR, f"{name}-{stamp}.json")
+    payload = {
+        "benchmark": name,
+        "created_at": datetime.utcnow().isoformat(),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": params or {},
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare(baseline_path, results):
+    """Print per-case deltas of ``results`` against a saved run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    print(f"\nCompared with {baseline_path}:")
+    for case, stats in results.items():
+        old = baseline.get(case)
+        if not old:
+            print(f"  {case:<24} (new)")
+            continue
+        parts = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "queries_per_request", "bytes", "encode_us", "decode_us", "mean_us", "p99_us"):
+            if key in stats and key in old and old[key]:
+                delta = (stats[key] - old[key]) / old[key] * 100
+                parts.append(f"{key} {old[key]} → {stats[key]} ({delta:+.1f}%)")
+        print(f"  {case:<24} " + "; ".join(parts))
+
+
+def print_table(results):
+    """Print a fixed-width summary of ``results``."""
+    print(f"{'case':<24}{'n':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'q/req':>7}")
+    for case, s in results.items():
+        print(
+            f"{case:<24}{s['requests']:>7}{s['errors']:>5}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+            f"{s['p99_ms']:>10}{s['throughput_rps']:>10}{s.get('queries_per_request', ''):>7}"
+        )
@@ -0,0 +1,131 @@
+# benchmarks/inference_bench.py
+"""Bottle detection latency and throughput per inference backend, CPU only.
+
+    python -m benchmarks.inference_bench                                 # OpenCV, workers = CPUs
+    python -m benchmarks.inference_bench --onnx yolo_files/yolov4.onnx --onnx yolo_files/yolov4.int8.onnx
+    python -m benchmarks.inference_bench --workers 4 -n 30 --compare benchmarks/results/inference-….json
+
+Every backend runs in --workers processes at once, the way gunicorn workers
+share a box, each calling the real `detect_bottles_yolo` on a synthetic
+photo (or --image). It runs twice per backend: "untuned" gives every worker a thread pool
+as wide as the machine (the old default), "tuned" uses the per-worker share
+that services/inference.py picks. With --profile, every backend also runs
+with that camera profile (services/preprocessing.py: ROI crop + letterboxed
+input size) next to the whole-frame 608×608 default; pass a real kiosk photo
+with --image to check the bottle count holds. Reports p50/p95/p99 per
+detection, total detections per second and the bottles found. Needs the
+model files in --model-dir.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+from benchmarks.harness import compare, print_table, summarize, write_results
+
+
+def _worker(config, model_dir, profile, iterations, image, barrier, results):
+    from routes import bottle_detection
+    from services.inference import create_backend
+    from services.preprocessing import DEFAULT_PROFILE, parse_profile
+
+    profile = parse_profile(profile, DEFAULT_PROFILE) if profile else DEFAULT_PROFILE
+    with open(os.path.join(model_dir, "coco.names")) as f:
+        bottle_detection.yolo_classes = [line.strip() for line in f]
+    bottle_detection.yolo_net = create_backend(config, model_dir)
+    _, bottles, _ = bottle_detection.detect_bottles_yolo(image, profile)   # warm-up: allocations, lazy init
+    barrier.wait()
+
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        bottle_detection.detect_bottles_yolo(image, profile)
+        latencies.append(time.perf_counter() - started)
+    results.put((latencies, bottles))
+
+
+def run(config, model_dir, profile, workers, iterations, image):
+    """Run ``workers`` processes concurrently; returns (latencies, elapsed, bottles)."""
+    ctx = multiprocessing.get_context("spawn")           # no cv2 thread pool inherited from the parent
+    barrier = ctx.Barrier(workers + 1)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker, args=(config, model_dir, profile, iterations, image, barrier, results))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    barrier.wait()
+    started = time.perf_counter()
+    latencies = []
+    for _ in procs:
+        worker_latencies, bottles = results.get()
+        latencies.extend(worker_latencies)
+    elapsed = time.perf_counter() - started
+    for p in procs:
+        p.join()
+    return latencies, elapsed, bottles
+
+
+def backends(args):
+    """``{name: config}`` for every backend under test."""
+    cases = {}
+    for backend in args.opencv_backends.split(","):
+        cases[f"opencv-{backend}"] = {
+            "DETECTION_BACKEND": "opencv",
+            "DETECTION_OPENCV_BACKEND": backend,
+            "DETECTION_OPENCV_TARGET": "cpu",
+        }
+    for path in args.onnx:
+        name = os.path.splitext(os.path.basename(path))[0]
+        cases[f"onnx-{name}"] = {"DETECTION_BACKEND": "onnxruntime", "DETECTION_ONNX_MODEL": path}
+    return cases
+
+
+def main(argv=None):
+    from benchmarks.api_bench import synthetic_bin_photo
+    from services.inference import available_cpus
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="detections per worker")
+    parser.add_argument("--workers", type=int, default=available_cpus(), help="concurrent worker processes")
+    parser.add_argument("--model-dir", default="yolo_files")
+    parser.add_argument("--opencv-backends", default="opencv", help="comma-separated, e.g. default,opencv,openvino")
+    parser.add_argument("--onnx", action="append", default=[], metavar="MODEL", help="ONNX model to run (repeatable)")
+    parser.add_argument("--profile", metavar="JSON", help='camera profile, e.g. \'{"roi": [0.2, 0.3, 0.5, 0.6], "input_size": 320}\'')
+    parser.add_argument("--image", help="photo to detect on (default: synthetic)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/inference-<ts>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to diff against")
+    args = parser.parse_args(argv)
+
+    cpus = available_cpus()
+    if args.image:
+        with open(args.image, "rb") as f:
+            image = f.read()
+    else:
+        image = synthetic_bin_photo()
+    profiles = {"frame": None}
+    if args.profile:
+        profiles["profile"] = json.loads(args.profile)
+    results = {}
+    for name, config in backends(args).items():
+        for policy, threads in (("untuned", cpus), ("tuned", max(1, cpus // args.workers))):
+            for label, profile in profiles.items():
+                latencies, elapsed, bottles = run({**config, "DETECTION_THREADS": threads}, args.model_dir,
+                                                  profile, args.workers, args.iterations, image)
+                key = f"{name}/{policy}" + (f"/{label}" if args.profile else "")
+                results[key] = {**summarize(latencies, elapsed), "threads": threads, "bottles": bottles}
+
+    print_table(results)
+    for key, r in results.items():
+        print(f"{key:<40} bottles: {r['bottles']}")
+    params = {"workers": args.workers, "cpus": cpus, "iterations": args.iterations, "profile": profiles.get("profile")}
+    path = write_results("inference", results, params, args.output)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
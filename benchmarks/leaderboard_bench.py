@@ -0,0 +1,135 @@
+# benchmarks/leaderboard_bench.py
+"""Leaderboard reads: GROUP BY over `transactions` per view vs. the incremental boards.
+
+    python -m benchmarks.leaderboard_bench
+    python -m benchmarks.leaderboard_bench --rows 1000000 --users 100000
+    python -m benchmarks.leaderboard_bench --redis redis://localhost:6379/0 --database-url postgresql://…
+
+Loads --rows synthetic deposits over --users users and times, for the
+all-time board: the top 10 plus one user's rank computed from the ledger on
+every view, `Leaderboard.standings` on the in-memory `RankedSet` boards, and
+with --redis on the sorted sets. It also times the per-deposit `record` call
+and the bulk rebuild. Use a scratch database: the bench users' transactions are
+replaced.
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks.harness import compare, print_table, summarize, timed, write_results
+
+BENCH_EMAIL = "leaderboard-bench@example.com"
+LOAD_CHUNK = 50_000
+
+NAIVE_SQL = """
+    SELECT user_id, SUM(units) AS units FROM transactions
+    WHERE transaction_type = 'deposit' GROUP BY user_id ORDER BY units DESC
+"""
+
+
+def load(db, users, wallet_id, rows, now):
+    from models import Transaction
+
+    rng = random.Random(42)
+    for offset in range(0, rows, LOAD_CHUNK):
+        batch = []
+        for _ in range(min(LOAD_CHUNK, rows - offset)):
+            units = rng.randint(1, 40)
+            batch.append({
+                "id": uuid.uuid4(),
+                "user_id": rng.choice(users),
+                "wallet_id": wallet_id,
+                "transaction_type": "deposit",
+                "material": "plastic",
+                "units": units,
+                "amount_cents": units * 5,
+                "created_at": now - timedelta(seconds=rng.uniform(0, 86400 * 60)),
+            })
+        db.session.execute(Transaction.__table__.insert(), batch)
+        db.session.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="default: a throwaway SQLite file")
+    parser.add_argument("--rows", type=int, default=200_000, help="synthetic deposits to load")
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--redis", metavar="URL", help="also time the Redis sorted-set boards")
+    parser.add_argument("-n", "--iterations", type=int, default=200, help="reads per case")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/leaderboard-<ts>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to diff against")
+    args = parser.parse_args(argv)
+
+    sqlite_file = None if args.database_url else os.path.abspath("bench.db")
+    if sqlite_file and os.path.exists(sqlite_file):
+        os.remove(sqlite_file)
+
+    from benchmarks.harness import bootstrap_app
+
+    app = bootstrap_app(args.database_url, BENCH_EMAIL)
+    app.test_client().get("/wallet", headers={"X-Test-User-Email": BENCH_EMAIL})    # provisions user + wallet
+
+    import redis
+    from sqlalchemy import text
+
+    from extensions import db
+    from models import Transaction, User, Wallet
+    from services.leaderboard import Leaderboard
+
+    results = {}
+    with app.app_context():
+        user = User.query.filter_by(email=BENCH_EMAIL).one()
+        wallet_id = db.session.query(Wallet.id).filter_by(user_id=user.id).scalar()
+        users = [uuid.uuid4() for _ in range(args.users - 1)] + [user.id]
+        Transaction.query.filter(Transaction.wallet_id == wallet_id).delete()
+        db.session.commit()
+        t0 = time.perf_counter()
+        load(db, users, wallet_id, args.rows, datetime.utcnow())
+        print(f"Loaded {args.rows} deposits over {args.users} users in {time.perf_counter() - t0:.1f}s")
+
+        me = str(user.id)
+
+        def naive():
+            rows = db.session.execute(text(NAIVE_SQL)).all()
+            top = rows[:10]
+            rank = next((i for i, (uid, _) in enumerate(rows, 1) if str(uuid.UUID(str(uid))) == me), None)
+            db.session.rollback()
+            return bool(top) and rank is not None
+
+        results["view/ledger-group-by"] = summarize(*timed(naive, max(1, args.iterations // 20)))
+
+        backends = [("memory", None)]
+        if args.redis:
+            backends.append(("redis", redis.Redis.from_url(args.redis)))
+        for label, client in backends:
+            board = Leaderboard()
+            board._redis = client
+            t0 = time.perf_counter()
+            board.rebuild("all")
+            results[f"rebuild/{label}"] = summarize([time.perf_counter() - t0], time.perf_counter() - t0)
+            results[f"view/{label}"] = summarize(
+                *timed(lambda: board.standings("all", user.id, 10)["rank"] is not None, args.iterations)
+            )
+            results[f"record/{label}"] = summarize(
+                *timed(lambda: board.record(random.choice(users), 5), args.iterations)
+            )
+            if client is not None:
+                client.delete("leaderboard:all", "leaderboard:all:built", f"leaderboard:{datetime.utcnow():%G-W%V}")
+
+    print()
+    print_table(results)
+    params = {k: getattr(args, k) for k in ("rows", "users", "iterations")}
+    params["redis"] = bool(args.redis)
+    path = write_results("leaderboard", results, params, args.output)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        compare(args.compare, results)
+    if sqlite_file:
+        os.remove(sqlite_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# benchmarks/payout_bench.py
+"""Drain a backlog of withdrawals: one payout each vs. aggregated per bank token.
+
+    python -m benchmarks.payout_bench                                   # SQLite, 1 thread
+    python -m benchmarks.payout_bench --database-url postgresql://… --threads 4 -n 5000 --tokens 200
+
+Runs against the local payout stub (PAYOUT_BACKEND=stub) with --stub-delay-ms
+standing in for Stripe's API latency, and reports wall time, payouts sent
+(= Stripe API calls) and withdrawals settled per second for each mode. Use
+Postgres for --threads > 1; SQLite has no row locks to keep workers apart.
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.harness import BENCH_USER_EMAIL, bootstrap_app, compare, write_results
+
+
+def seed(app, n, tokens):
+    """Reset withdrawals and insert ``n`` pending ones for the bench user, spread over ``tokens`` bank tokens."""
+    from extensions import db
+    from models import PayoutBatch, Wallet, Withdrawal
+
+    client = app.test_client()
+    client.get("/wallet", headers={"X-Test-User-Email": BENCH_USER_EMAIL})   # provisions the user
+    with app.app_context():
+        Withdrawal.query.delete()
+        PayoutBatch.query.delete()
+        wallet = Wallet.query.first()
+        created = datetime.utcnow() - timedelta(hours=1)          # already past any aggregation window
+        db.session.bulk_insert_mappings(Withdrawal, [
+            {
+                "user_id": wallet.user_id,
+                "wallet_id": wallet.id,
+                "amount_cents": 100 + i % 900,
+                "bank_token": f"btok_{random.randrange(tokens)}",
+                "status": "pending",
+                "attempts": 0,
+                "created_at": created,
+            }
+            for i in range(n)
+        ])
+        db.session.commit()
+
+
+def drain(app, threads):
+    """Run ``threads`` workers until no withdrawal is pending; returns (elapsed, payouts)."""
+    from extensions import db
+    from services import payouts
+
+    calls = []
+    stub = payouts._stub_payout
+
+    def counting_stub(amount_cents, idempotency_key, metadata=None):
+        calls.append(idempotency_key)
+        return stub(amount_cents, idempotency_key, metadata)
+
+    def worker():
+        with app.app_context():
+            while payouts.process_pending():
+                pass
+            db.session.remove()
+
+    payouts._stub_payout = counting_stub
+    try:
+        start = time.perf_counter()
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        return time.perf_counter() - start, len(calls)
+    finally:
+        payouts._stub_payout = stub
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--withdrawals", type=int, default=1000)
+    parser.add_argument("--tokens", type=int, default=50, help="distinct bank tokens in the backlog")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--stub-delay-ms", type=int, default=150, help="simulated Stripe API latency")
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/payouts-<ts>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to diff against")
+    args = parser.parse_args(argv)
+
+    sqlite_file = None
+    if not args.database_url:
+        sqlite_file = os.path.abspath("bench.db")
+        if os.path.exists(sqlite_file):
+            os.remove(sqlite_file)
+
+    random.seed(1)
+    app = bootstrap_app(args.database_url)
+    app.config.update(
+        PAYOUT_BACKEND="stub",
+        PAYOUT_STUB_DELAY_MS=args.stub_delay_ms,
+        PAYOUT_AGGREGATE_WINDOW_SECONDS=0,
+        PAYOUT_AGGREGATE_MAX_WITHDRAWALS=max(args.withdrawals, 1000),
+    )
+
+    results = {}
+    for mode, aggregate in (("single", False), ("aggregated", True)):
+        app.config["PAYOUT_AGGREGATE"] = aggregate
+        seed(app, args.withdrawals, args.tokens)
+        elapsed, payouts_sent = drain(app, args.threads)
+        results[mode] = {
+            "withdrawals": args.withdrawals,
+            "payouts": payouts_sent,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(args.withdrawals / elapsed, 1),
+        }
+
+    print(f"{'mode':<12}{'withdrawals':>13}{'payouts':>10}{'seconds':>10}{'settled/s':>11}")
+    for mode, r in results.items():
+        print(f"{mode:<12}{r['withdrawals']:>13}{r['payouts']:>10}{r['elapsed_s']:>10}{r['throughput_rps']:>11}")
+    params = {
+        "withdrawals": args.withdrawals,
+        "tokens": args.tokens,
+        "threads": args.threads,
+        "stub_delay_ms": args.stub_delay_ms,
+        "database": "sqlite" if sqlite_file else args.database_url.split(":", 1)[0],
+    }
+    path = write_results("payouts", results, params, args.output)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        compare(args.compare, results)
+
+    if sqlite_file and os.path.exists(sqlite_file):
+        os.remove(sqlite_file)
+
+
+if __name__ == "__main__":
+    main()
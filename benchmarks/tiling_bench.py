@@ -0,0 +1,118 @@
+# benchmarks/tiling_bench.py
+"""Tiled vs. single-pass bottle detection across photo sizes.
+
+    python -m benchmarks.tiling_bench                                   # 1, 3, 6 and 12 MP
+    python -m benchmarks.tiling_bench --sizes 12 --tile-size 800 --overlap 0.25 --bottles 60
+
+For each size a synthetic bin photo (4:3, --bottles bottles of a fixed pixel
+size, so they get relatively smaller as the photo grows) is detected with
+the whole frame at 608×608 and with DETECTION_TILE_* tiling. Every case runs
+in a fresh process, so the reported peak RSS belongs to that case alone.
+Reports p50/p95 latency, tiles per photo, bottles found and peak RSS. Needs
+the model files in --model-dir.
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import resource
+import time
+
+from benchmarks.harness import compare, summarize, write_results
+
+
+def _worker(config, model_dir, tiling, image, iterations, results):
+    import cv2
+    import numpy as np
+
+    from routes import bottle_detection
+    from services.inference import create_backend
+    from services.preprocessing import DEFAULT_PROFILE, Tiling, tile_frames
+
+    tiling = Tiling(**tiling) if tiling else None
+    with open(os.path.join(model_dir, "coco.names")) as f:
+        bottle_detection.yolo_classes = [line.strip() for line in f]
+    bottle_detection.yolo_net = create_backend(config, model_dir)
+    decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    frames = len(tile_frames(decoded, DEFAULT_PROFILE, bottle_detection.yolo_net.input_size, tiling))
+    del decoded
+
+    _, bottles, _ = bottle_detection.detect_bottles_yolo(image, DEFAULT_PROFILE, tiling)   # warm-up
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        bottle_detection.detect_bottles_yolo(image, DEFAULT_PROFILE, tiling)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024        # KiB on Linux
+    results.put((latencies, elapsed, bottles, frames, peak_mb))
+
+
+def run_case(config, model_dir, tiling, image, iterations):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_worker, args=(config, model_dir, tiling, image, iterations, results))
+    proc.start()
+    outcome = results.get()
+    proc.join()
+    return outcome
+
+
+def main(argv=None):
+    from benchmarks.api_bench import synthetic_bin_photo
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,3,6,12", help="comma-separated photo sizes in megapixels")
+    parser.add_argument("--bottles", type=int, default=40)
+    parser.add_argument("-n", "--iterations", type=int, default=5, help="detections per case")
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--overlap", type=float, default=0.2)
+    parser.add_argument("--max-tiles", type=int, default=48)
+    parser.add_argument("--batch", type=int, default=4, help="tiles per forward pass")
+    parser.add_argument("--model-dir", default="yolo_files")
+    parser.add_argument("--backend", default="opencv", choices=("opencv", "onnxruntime"))
+    parser.add_argument("--onnx-model", help="DETECTION_ONNX_MODEL for --backend onnxruntime")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/tiling-<ts>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to diff against")
+    args = parser.parse_args(argv)
+
+    config = {"DETECTION_BACKEND": args.backend}
+    if args.onnx_model:
+        config["DETECTION_ONNX_MODEL"] = args.onnx_model
+    tiling = {
+        "tile_size": args.tile_size,
+        "overlap": args.overlap,
+        "min_megapixels": 0,            # tile every size here, to show where it starts paying off
+        "max_tiles": args.max_tiles,
+        "batch": args.batch,
+    }
+
+    results = {}
+    for megapixels in (float(s) for s in args.sizes.split(",")):
+        height = int(math.sqrt(megapixels * 1e6 * 3 / 4))
+        width = height * 4 // 3
+        image = synthetic_bin_photo(width, height, bottles=args.bottles)
+        for mode, mode_tiling in (("single", None), ("tiled", tiling)):
+            latencies, elapsed, bottles, frames, peak_mb = run_case(
+                config, args.model_dir, mode_tiling, image, args.iterations
+            )
+            results[f"{megapixels:g}MP/{mode}"] = {
+                **summarize(latencies, elapsed),
+                "frames": frames,
+                "bottles": bottles,
+                "peak_rss_mb": round(peak_mb, 1),
+            }
+
+    print(f"{'case':<16}{'frames':>8}{'p50 ms':>10}{'p95 ms':>10}{'bottles':>9}{'peak MB':>9}")
+    for case, r in results.items():
+        print(f"{case:<16}{r['frames']:>8}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['bottles']:>9}{r['peak_rss_mb']:>9}")
+    params = {**tiling, "bottles": args.bottles, "iterations": args.iterations, "backend": args.backend}
+    path = write_results("tiling", results, params, args.output)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
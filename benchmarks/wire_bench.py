@@ -0,0 +1,119 @@
+# benchmarks/wire_bench.py
+"""Kiosk response sizes and encode/decode cost: JSON vs. MessagePack vs. CBOR.
+
+    python -m benchmarks.wire_bench
+    python -m benchmarks.wire_bench -n 20000 --compare benchmarks/results/wire-20250901T120000.json
+
+Payloads are the real bodies of /deposit/kiosk and /validate-kiosk-id (full
+and ``profile=compact``), captured through the test client, plus a
+/detect-bottles body for a synthetic photo with 12 detections. Each is
+encoded with Flask's JSON provider and with every binary encoder
+services/wire.py offers (CBOR only if ``cbor2`` is installed).
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+from benchmarks.harness import bootstrap_app, compare, write_results
+
+KIOSK_EMAIL = "kiosk-bench@example.com"
+
+
+def capture_payloads(app):
+    """``{case: payload}`` for every kiosk endpoint and profile."""
+    from benchmarks.api_bench import synthetic_bin_photo
+    from routes.bottle_detection import create_detection_visualization
+
+    client = app.test_client()
+    kiosk_id = client.get("/user/kiosk-id", headers={"X-Test-User-Email": KIOSK_EMAIL}).get_json()["kiosk_id"]
+
+    payloads = {}
+    for profile, accept in (("full", "application/json"), ("compact", "application/json; profile=compact")):
+        r = client.post(
+            "/deposit/kiosk",
+            json={"material": "plastic", "units": 12},
+            headers={"X-Kiosk-User-ID": kiosk_id, "Accept": accept},
+        )
+        payloads[f"deposit_kiosk/{profile}"] = r.get_json()
+        r = client.post("/validate-kiosk-id", json={"kiosk_id": kiosk_id}, headers={"Accept": accept})
+        payloads[f"validate/{profile}"] = r.get_json()
+
+    photo = synthetic_bin_photo()
+    detections = [
+        {"class": "bottle", "confidence": 80.0 + i, "box": [40 + 90 * i, 300, 70, 210]} for i in range(12)
+    ]
+    payloads["detect/full"] = {
+        "success": True,
+        "bottle_count": len(detections),
+        "avg_confidence": 85.5,
+        "detections": detections,
+        "timestamp": datetime.now().isoformat(),
+        "visualization": create_detection_visualization(photo, detections),
+    }
+    payloads["detect/compact"] = {"bottle_count": len(detections), "avg_confidence": 85.5}
+    return payloads
+
+
+def codecs(app):
+    """``{name: (encode, decode)}`` for JSON and each binary format."""
+    import msgpack
+
+    from services import wire
+
+    result = {"json": (app.json.dumps, json.loads)}
+    result["msgpack"] = (wire.ENCODERS[wire.MSGPACK], lambda data: msgpack.unpackb(data, raw=False))
+    if wire.CBOR in wire.ENCODERS:
+        result["cbor"] = (wire.ENCODERS[wire.CBOR], wire.cbor2.loads)
+    return result
+
+
+def per_call_us(fn, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=5000, help="encodes / decodes per payload")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/wire-<ts>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to diff against")
+    args = parser.parse_args(argv)
+
+    sqlite_file = os.path.abspath("bench.db")
+    if os.path.exists(sqlite_file):
+        os.remove(sqlite_file)
+    app = bootstrap_app(None, KIOSK_EMAIL)
+
+    payloads = capture_payloads(app)
+    results = {}
+    with app.app_context():
+        for case, payload in payloads.items():
+            # Big bodies (the detect visualization) get fewer rounds
+            iterations = max(args.iterations // 50, 20) if case == "detect/full" else args.iterations
+            for name, (encode, decode) in codecs(app).items():
+                body = encode(payload)
+                results[f"{case}/{name}"] = {
+                    "bytes": len(body),
+                    "encode_us": round(per_call_us(encode, payload, iterations), 2),
+                    "decode_us": round(per_call_us(decode, body, iterations), 2),
+                }
+
+    print(f"{'case':<30}{'bytes':>10}{'vs full json':>14}{'encode µs':>11}{'decode µs':>11}")
+    for key, r in results.items():
+        baseline = results[key.split("/", 1)[0] + "/full/json"]["bytes"]
+        print(f"{key:<30}{r['bytes']:>10}{r['bytes'] / baseline:>13.0%} {r['encode_us']:>10}{r['decode_us']:>11}")
+    path = write_results("wire", results, {"iterations": args.iterations}, args.output)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        compare(args.compare, results)
+
+    if os.path.exists(sqlite_file):
+        os.remove(sqlite_file)
+
+
+if __name__ == "__main__":
+    main()
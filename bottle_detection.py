@@ -1,41 +1,25 @@
 # bottle_detection.py
-import os, urllib.request, cv2, numpy as np
+import cv2, numpy as np
 from datetime import datetime
 import base64
 
-# ---------- 1. Model loading / caching ----------
-YOLO_DIR = "yolo_files"
-WEIGHTS = "yolov4.weights"
-CFG      = "yolov4.cfg"
-NAMES    = "coco.names"
+from config import Config
+from services.artifacts import ArtifactStore
+from services.inference import create_backend
 
-_URLS = {
-    WEIGHTS: "https://github.com/AlexeyAB/darknet/releases/download/darknet_yolo_v3_optimal/yolov4.weights",
-    CFG:     "https://raw.githubusercontent.com/AlexeyAB/darknet/master/cfg/yolov4.cfg",
-    NAMES:   "https://raw.githubusercontent.com/pjreddie/darknet/master/data/coco.names",
-}
+# ---------- 1. Model loading / caching ----------
+NAMES = "coco.names"
 
-yolo_net = None          # cv2.dnn_Net
+yolo_net = None          # services.inference backend
 yolo_classes = []
-yolo_output_layers = []
-
-def _download():
-    os.makedirs(YOLO_DIR, exist_ok=True)
-    for fname, url in _URLS.items():
-        fpath = os.path.join(YOLO_DIR, fname)
-        if not os.path.exists(fpath):
-            urllib.request.urlretrieve(url, fpath)
 
 def load_model():
-    global yolo_net, yolo_classes, yolo_output_layers
+    global yolo_net, yolo_classes
     if yolo_net is not None:
         return
-    _download()
-    w, c, n = (os.path.join(YOLO_DIR, p) for p in (WEIGHTS, CFG, NAMES))
-    yolo_net  = cv2.dnn.readNet(w, c)
-    yolo_classes = [l.strip() for l in open(n)]
-    ln = yolo_net.getLayerNames()
-    yolo_output_layers = [ln[i - 1] for i in yolo_net.getUnconnectedOutLayers()]
+    store = ArtifactStore(vars(Config))      # verified files; downloads and checksums missing ones
+    yolo_classes = [l.strip() for l in open(store.path(NAMES))]
+    yolo_net = create_backend(vars(Config), resolve=store.path)
 
 # ---------- 2. Detection routine (trimmed) ----------
 def detect(image_bytes):
@@ -44,9 +28,9 @@ def detect(image_bytes):
     if img is None:
         return [], 0
     H, W = img.shape[:2]
-    blob = cv2.dnn.blobFromImage(img, 0.00392, (608, 608), swapRB=True)
-    yolo_net.setInput(blob)
-    outs = yolo_net.forward(yolo_output_layers)
+    size = yolo_net.input_size
+    blob = cv2.dnn.blobFromImage(img, 0.00392, (size, size), swapRB=True)
+    outs = yolo_net.forward(blob)
 
     bottle_ids = [yolo_classes.index(x) for x in ("bottle",) if x in yolo_classes]
     detections = []
@@ -0,0 +1,281 @@
+# commands.py – `flask <group> <command>` maintenance and worker entry points
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+payouts_cli = AppGroup("payouts", help="Withdrawal outbox workers.")
+
+
+@payouts_cli.command("work")
+@click.option("--threads", type=int, default=None, help="Worker threads (default PAYOUT_WORKER_THREADS).")
+def payouts_work(threads):
+    """Run the payout worker pool in the foreground."""
+    from services.payouts import PayoutWorkerPool
+
+    pool = PayoutWorkerPool(current_app._get_current_object(), threads=threads).start()
+    click.echo(f"Payout workers running ({pool.threads} threads, backend={_backend()}). Ctrl+C to stop.")
+    pool.wait()
+
+
+@payouts_cli.command("run-once")
+@click.option("--batch-size", type=int, default=None)
+def payouts_run_once(batch_size):
+    """Process one batch of due withdrawals and exit."""
+    from services.payouts import process_pending
+
+    click.echo(f"Processed {process_pending(batch_size)} withdrawal(s)")
+
+
+@payouts_cli.command("resolve")
+@click.argument("payout_id", type=click.UUID)
+@click.option("--paid", "reference", metavar="STRIPE_PAYOUT_ID", help="Stripe sent it: record this payout id.")
+@click.option("--refund", is_flag=True, help="Stripe has no payout for it: fail it and credit the wallet(s).")
+@click.option("--retry", is_flag=True, help="Send it again with the same idempotency key (within 24 h).")
+def payouts_resolve(payout_id, reference, refund, retry):
+    """Settle a withdrawal or payout batch left `unknown` by an ambiguous Stripe error."""
+    from services.payouts import resolve_batch, resolve_withdrawal
+
+    if [bool(reference), refund, retry].count(True) != 1:
+        raise click.UsageError("Pass exactly one of --paid STRIPE_PAYOUT_ID, --refund, --retry")
+    action = "paid" if reference else "refund" if refund else "retry"
+    status = resolve_withdrawal(payout_id, action, reference)
+    label = "Withdrawal"
+    if status is None:
+        status, label = resolve_batch(payout_id, action, reference), "Payout batch"
+    if status is None:
+        raise click.ClickException(
+            f"{payout_id} is not an unknown withdrawal or payout batch (batch members are resolved by batch id)"
+        )
+    click.echo(f"{label} {payout_id}: {status}")
+
+
+partitions_cli = AppGroup("partitions", help="Monthly partitions of the transactions table.")
+
+
+@partitions_cli.command("maintain")
+@click.option("--months-ahead", type=int, default=None,
+              help="Partitions to keep ready (default TRANSACTION_PARTITION_MONTHS_AHEAD).")
+@click.option("--archive-after-months", type=int, default=None,
+              help="Roll older months into transactions_archive (default TRANSACTION_ARCHIVE_AFTER_MONTHS; 0 = never).")
+def partitions_maintain(months_ahead, archive_after_months):
+    """Create upcoming partitions and archive expired ones; run daily."""
+    from services.partitions import maintain
+
+    try:
+        created, archived = maintain(months_ahead, archive_after_months)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for name, moved in created:
+        click.echo(f"created {name}" + (f" ({moved} row(s) moved from default)" if moved else ""))
+    for name, moved in archived:
+        click.echo(f"archived {name} ({moved} row(s))")
+    if not created and not archived:
+        click.echo("partitions up to date")
+
+
+ledger_cli = AppGroup("ledger", help="Wallet balance reconciliation.")
+
+
+@ledger_cli.command("reconcile")
+@click.option("--full", is_flag=True, help="Recompute every wallet instead of events since the last run.")
+@click.option("--repair", is_flag=True, help="Correct drifted balances to the ledger expectation.")
+def ledger_reconcile(full, repair):
+    """Check wallet balances against transactions and withdrawals; run hourly."""
+    from services.reconciliation import reconcile
+
+    result = reconcile(full=full, repair=repair)
+    mode = "full" if result["full"] else f"since {result['since']:%Y-%m-%d %H:%M:%S}"
+    click.echo(f"Checked {result['wallets_checked']} wallet(s) ({mode}, up to {result['until']:%Y-%m-%d %H:%M:%S})")
+    for d in result["discrepancies"]:
+        click.echo(
+            f"  wallet {d['wallet_id']} user {d['user_id']}: balance {d['balance_cents']}, "
+            f"expected {d['expected_cents'] + d['after_delta']} ({d['drift_cents']:+d})"
+        )
+    if result["discrepancies"]:
+        click.echo(f"{len(result['discrepancies'])} discrepancy(ies), {result['repaired']} repaired")
+        if not repair:
+            raise SystemExit(1)
+
+
+rollups_cli = AppGroup("rollups", help="Daily per-kiosk deposit rollups (kiosk_daily_rollups).")
+
+
+@rollups_cli.command("run")
+@click.option("--full", is_flag=True, help="Rebuild every day still in transactions instead of new deposits only.")
+def rollups_run(full):
+    """Fold deposits since the last run into the daily rollups; run every few minutes."""
+    from services.rollups import roll_up
+
+    result = roll_up(full=full)
+    mode = "full" if result["full"] else f"since {result['since']:%Y-%m-%d %H:%M:%S}"
+    click.echo(f"Updated {result['groups']} rollup row(s) ({mode}, up to {result['until']:%Y-%m-%d %H:%M:%S})")
+
+
+leaderboard_cli = AppGroup("leaderboard", help="Recycler leaderboards (services/leaderboard.py).")
+
+
+@leaderboard_cli.command("rebuild")
+@click.option("--weeks", default=1, show_default=True, help="Weekly boards to rebuild, counting back from this week.")
+def leaderboard_rebuild(weeks):
+    """Recompute the all-time and weekly boards from the ledger; run nightly to repair missed increments."""
+    from datetime import datetime, timedelta
+
+    from extensions import leaderboard
+    from services.leaderboard import period_of
+
+    now = datetime.utcnow()
+    for period in ["all"] + [period_of("week", now - timedelta(weeks=n)) for n in range(weeks)]:
+        click.echo(f"{period}: {leaderboard.rebuild(period)} user(s)")
+
+
+idempotency_cli = AppGroup("idempotency", help="Stored Idempotency-Key responses (idempotency_keys).")
+
+
+@idempotency_cli.command("purge")
+def idempotency_purge():
+    """Delete keys past IDEMPOTENCY_TTL_SECONDS; run daily."""
+    from services.idempotency import purge_expired
+
+    click.echo(f"Purged {purge_expired()} expired key(s)")
+
+
+pricing_cli = AppGroup("pricing", help="Material rates (material_rates table).")
+
+
+@pricing_cli.command("list")
+@click.option("--all", "show_all", is_flag=True, help="Include expired and future rates.")
+def pricing_list(show_all):
+    """Show rates, most specific first."""
+    from datetime import datetime
+
+    from models import MaterialRate
+
+    now = datetime.utcnow()
+    rates = MaterialRate.query.order_by(
+        MaterialRate.material, MaterialRate.kiosk_fleet, MaterialRate.region, MaterialRate.effective_from.desc()
+    ).all()
+    for r in rates:
+        live = r.effective_from <= now and (r.effective_to is None or now < r.effective_to)
+        if live or show_all:
+            click.echo(
+                f"v{r.id:<5} {r.material:<12} {r.rate_cents:>4}¢  region={r.region or '*'} fleet={r.kiosk_fleet or '*'}"
+                f"  from {r.effective_from:%Y-%m-%d %H:%M}" + (f" to {r.effective_to:%Y-%m-%d %H:%M}" if r.effective_to else "")
+            )
+
+
+@pricing_cli.command("set-rate")
+@click.argument("material")
+@click.argument("rate_cents", type=int)
+@click.option("--region", default=None)
+@click.option("--fleet", default=None, help="Kiosk fleet (X-Kiosk-Fleet).")
+@click.option("--effective-from", type=click.DateTime(), default=None, help="UTC; default now.")
+@click.option("--effective-to", type=click.DateTime(), default=None, help="UTC; default open-ended.")
+def pricing_set_rate(material, rate_cents, region, fleet, effective_from, effective_to):
+    """Add a rate row; running workers pick it up within PRICING_REFRESH_SECONDS."""
+    from datetime import datetime
+
+    from extensions import db
+    from models import MaterialRate
+
+    if rate_cents < 0:
+        raise click.BadParameter("must not be negative", param_hint="RATE_CENTS")
+    rate = MaterialRate(
+        material=material.strip().lower(),
+        region=region.strip().lower() if region else None,
+        kiosk_fleet=fleet.strip().lower() if fleet else None,
+        rate_cents=rate_cents,
+        effective_from=effective_from or datetime.utcnow(),
+        effective_to=effective_to,
+    )
+    db.session.add(rate)
+    db.session.commit()
+    click.echo(f"Added rate version {rate.id}")
+
+
+detection_cli = AppGroup("detection", help="Bottle detection model.")
+
+
+@detection_cli.command("quantize")
+@click.argument("src", type=click.Path(exists=True, dir_okay=False))
+@click.argument("dst", type=click.Path(dir_okay=False))
+@click.option("--calibration-dir", type=click.Path(exists=True, file_okay=False), default=None,
+              help="Sample kiosk photos for static (activation) quantization; omit for weights-only.")
+@click.option("--limit", type=int, default=200, help="Calibration images to use.")
+def detection_quantize(src, dst, calibration_dir, limit):
+    """Write an INT8 copy of the ONNX model SRC to DST (for DETECTION_BACKEND=onnxruntime)."""
+    import os
+
+    from services.inference import quantize_model
+
+    images = []
+    if calibration_dir:
+        images = sorted(
+            os.path.join(calibration_dir, f) for f in os.listdir(calibration_dir)
+            if f.lower().endswith((".jpg", ".jpeg", ".png"))
+        )[:limit]
+        if not images:
+            raise click.ClickException(f"No .jpg/.png images in {calibration_dir}")
+    mode = quantize_model(src, dst, images)
+    click.echo(f"Wrote {dst} ({mode} INT8, {len(images)} calibration images)")
+
+
+@detection_cli.command("fetch")
+@click.argument("names", nargs=-1)
+@click.option("--dir", "directory", type=click.Path(file_okay=False), default=None,
+              help="Download into this directory instead of MODEL_CACHE_DIR.")
+@click.option("--write-manifest", type=click.Path(dir_okay=False), default=None,
+              help="Write the names, URLs and sha256s fetched to this MODEL_MANIFEST_FILE.")
+def detection_fetch(names, directory, write_manifest):
+    """Download and verify model files (default: every file in the manifest)."""
+    import json
+
+    from flask import current_app
+
+    from services.artifacts import ArtifactError, fetch
+
+    try:
+        fetched = fetch(current_app.config, names, directory)
+    except ArtifactError as e:
+        raise click.ClickException(str(e))
+    for entry in fetched.values():
+        click.echo(f"{entry['path']}  {entry['sha256']}")
+    if write_manifest:
+        with open(write_manifest, "w") as f:
+            json.dump({name: {"url": e["url"], "sha256": e["sha256"]} for name, e in fetched.items()}, f, indent=2)
+        click.echo(f"Wrote {write_manifest}")
+
+
+@detection_cli.command("verify")
+def detection_verify():
+    """Check the local model files against the manifest without downloading anything."""
+    from flask import current_app
+
+    from services.artifacts import ArtifactError, ArtifactStore
+
+    store = ArtifactStore(dict(current_app.config, MODEL_OFFLINE=True))
+    failed = 0
+    for name in store.manifest:
+        try:
+            click.echo(f"ok       {store.path(name)}")
+        except ArtifactError as e:
+            failed += 1
+            click.echo(f"missing  {e}")
+    if failed:
+        raise click.ClickException(f"{failed} model file(s) missing or corrupt")
+
+
+def _backend():
+    from services.payouts import payout_backend
+
+    return payout_backend()
+
+
+def register_commands(app):
+    app.cli.add_command(payouts_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(leaderboard_cli)
+    app.cli.add_command(idempotency_cli)
+    app.cli.add_command(pricing_cli)
+    app.cli.add_command(detection_cli)
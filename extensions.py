@@ -1,11 +1,37 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from ratelimit import (
+    identity_key,
+    kiosk_fleet_key,
+    kiosk_fleet_quota,
+    not_fleet_kiosk_request,
+    user_rate_limit,
+)
+from services.balance_cache import BalanceCache
+from services.deposit_guard import DepositGuard
+from services.events import EventBroker
+from services.leaderboard import Leaderboard
+from services.pricing import PricingEngine
+from services.read_routing import ReadRouter, RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
-limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["1000 per hour"]
-)
\ No newline at end of file
+balance_cache = BalanceCache()
+deposit_guard = DepositGuard()
+event_broker = EventBroker()
+leaderboard = Leaderboard()
+pricing = PricingEngine()
+read_router = ReadRouter()
+
+# Storage, strategy, fallback and default limits come from the RATELIMIT_* settings in Config.
+limiter = Limiter(key_func=identity_key)
+
+# Applied by the auth decorators once the caller is known.
+user_limit = limiter.shared_limit(user_rate_limit, scope="user")
+kiosk_fleet_limit = limiter.shared_limit(
+    kiosk_fleet_quota,
+    scope="kiosk-fleet",
+    key_func=kiosk_fleet_key,
+    exempt_when=not_fleet_kiosk_request,
+)
@@ -0,0 +1,36 @@
+# gunicorn.conf.py – picked up automatically by `gunicorn app:app`
+import os
+import shutil
+
+# prometheus_client decides between in-process and mmap-backed values at import,
+# so the directory has to be in the environment before the app is loaded.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+# /wallet/stream holds a connection open per app, so workers default to gevent:
+# idle streams are greenlets, and `timeout` is a worker heartbeat rather than a
+# per-request limit. GUNICORN_WORKER_CLASS=sync pins one request per worker.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 2000))
+
+
+def on_starting(server):
+    """Start every master with an empty metrics directory."""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_fork(server, worker):
+    """Tell the worker how many siblings share the CPUs (sizes inference thread pools)."""
+    os.environ["GUNICORN_WORKERS"] = str(server.cfg.workers)
+    if server.cfg.worker_class_str == "gevent":
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()             # otherwise every query blocks all of the worker's greenlets
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that went away."""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,34 @@
+"""withdrawal outbox columns
+
+Revision ID: 9a3e51c7d2b4
+Revises: 4c80ce72f155
+Create Date: 2025-08-04 10:12:31.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3e51c7d2b4'
+down_revision = '4c80ce72f155'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('withdrawals', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_error', sa.String(length=255), nullable=True))
+        batch_op.create_index(batch_op.f('ix_withdrawals_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('withdrawals', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_withdrawals_status'))
+        batch_op.drop_column('last_error')
+        batch_op.drop_column('next_attempt_at')
+        batch_op.drop_column('claimed_at')
+        batch_op.drop_column('attempts')
@@ -0,0 +1,48 @@
+"""kiosk device / region on transactions and daily per-kiosk rollups
+
+transactions gains device_id and region, recorded from the kiosk's
+X-Kiosk-Device-ID and X-Kiosk-Region headers (NULL on older rows and app
+deposits). kiosk_daily_rollups is filled by `flask rollups run`
+(services/rollups.py); on Postgres, adding a column to the partitioned parent
+adds it to every partition.
+
+Revision ID: a8e4c2f15b97
+Revises: f7c3a9d21e48
+Create Date: 2025-09-16 14:07:52.381904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e4c2f15b97'
+down_revision = 'f7c3a9d21e48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('device_id', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('region', sa.String(length=64), nullable=True))
+
+    op.create_table('kiosk_daily_rollups',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('device_id', sa.String(length=64), nullable=False),
+    sa.Column('region', sa.String(length=64), nullable=False),
+    sa.Column('material', sa.String(length=50), nullable=False),
+    sa.Column('deposits', sa.Integer(), nullable=False),
+    sa.Column('units', sa.BigInteger(), nullable=False),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'device_id', 'region', 'material')
+    )
+
+
+def downgrade():
+    op.drop_table('kiosk_daily_rollups')
+
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.drop_column('region')
+        batch_op.drop_column('device_id')
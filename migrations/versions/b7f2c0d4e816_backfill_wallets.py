@@ -0,0 +1,57 @@
+"""backfill a wallet for every user
+
+Wallets are now created together with their user in auth.firebase.provision_user,
+so request paths no longer get-or-create them. This one-shot backfill covers
+users created before that change.
+
+Revision ID: b7f2c0d4e816
+Revises: 9a3e51c7d2b4
+Create Date: 2025-08-06 14:03:52.906114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import uuid
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f2c0d4e816'
+down_revision = '9a3e51c7d2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("""
+            INSERT INTO wallets (id, user_id, balance_cents, created_at, updated_at)
+            SELECT gen_random_uuid(), u.id, 0, now(), now()
+            FROM users u
+            LEFT JOIN wallets w ON w.user_id = u.id
+            WHERE w.id IS NULL
+            ON CONFLICT (user_id) DO NOTHING
+        """)
+        return
+
+    missing = bind.execute(sa.text(
+        "SELECT u.id FROM users u LEFT JOIN wallets w ON w.user_id = u.id WHERE w.id IS NULL"
+    )).scalars().all()
+    wallets = sa.table(
+        'wallets',
+        sa.column('id', sa.Uuid()),
+        sa.column('user_id', sa.Uuid()),
+        sa.column('balance_cents', sa.Integer()),
+        sa.column('created_at', sa.DateTime()),
+        sa.column('updated_at', sa.DateTime()),
+    )
+    now = sa.func.now()
+    for user_id in missing:
+        op.execute(wallets.insert().values(
+            id=uuid.uuid4(), user_id=user_id, balance_cents=0, created_at=now, updated_at=now
+        ))
+
+
+def downgrade():
+    # Data-only backfill; the wallets stay.
+    pass
@@ -0,0 +1,104 @@
+"""partition transactions by month on created_at
+
+Postgres: rebuilds `transactions` as a RANGE-partitioned table with one
+partition per month from the oldest row through TRANSACTION_PARTITION_MONTHS_AHEAD
+(default 3) months ahead, plus a default partition, and copies the rows over.
+The primary key becomes (id, created_at) because Postgres requires the
+partition key in it. Later months are created by `flask partitions maintain`.
+The copy holds an exclusive lock on the old table; run it in a maintenance window.
+
+Other dialects only get the (user_id, created_at) history index.
+
+Revision ID: c41d8e2a6f93
+Revises: b7f2c0d4e816
+Create Date: 2025-08-12 09:41:17.530281
+
+"""
+import os
+from datetime import date, datetime
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d8e2a6f93'
+down_revision = 'b7f2c0d4e816'
+branch_labels = None
+depends_on = None
+
+COLUMNS = "id, user_id, wallet_id, transaction_type, material, units, amount_cents, created_at"
+
+
+def _add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        op.create_index('ix_transactions_user_id_created_at', 'transactions', ['user_id', 'created_at'])
+        return
+
+    op.execute("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey")
+    op.execute("UPDATE transactions_unpartitioned SET created_at = now() WHERE created_at IS NULL")
+    op.execute("""
+        CREATE TABLE transactions (
+            id               uuid        NOT NULL,
+            user_id          uuid        NOT NULL REFERENCES users (id),
+            wallet_id        uuid        NOT NULL REFERENCES wallets (id),
+            transaction_type varchar(20) NOT NULL,
+            material         varchar(50),
+            units            integer,
+            amount_cents     integer     NOT NULL,
+            created_at       timestamp   NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE INDEX ix_transactions_user_id_created_at ON transactions (user_id, created_at)")
+    op.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+
+    oldest = None
+    if not context.is_offline_mode():     # --sql: older rows land in transactions_default
+        oldest = bind.execute(sa.text("SELECT min(created_at) FROM transactions_unpartitioned")).scalar()
+    now = datetime.utcnow()
+    month = date((oldest or now).year, (oldest or now).month, 1)
+    last = _add_months(date(now.year, now.month, 1), int(os.environ.get('TRANSACTION_PARTITION_MONTHS_AHEAD', 3)))
+    while month <= last:
+        upper = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE transactions_{month.year:04d}_{month.month:02d} PARTITION OF transactions "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+        month = upper
+
+    op.execute(f"INSERT INTO transactions ({COLUMNS}) SELECT {COLUMNS} FROM transactions_unpartitioned")
+    op.execute("DROP TABLE transactions_unpartitioned")
+    op.execute("ANALYZE transactions")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        op.drop_index('ix_transactions_user_id_created_at', table_name='transactions')
+        return
+
+    op.execute("ALTER TABLE transactions RENAME TO transactions_partitioned")
+    op.execute("ALTER TABLE transactions_partitioned RENAME CONSTRAINT transactions_pkey TO transactions_partitioned_pkey")
+    op.execute("""
+        CREATE TABLE transactions (
+            id               uuid        NOT NULL PRIMARY KEY,
+            user_id          uuid        NOT NULL REFERENCES users (id),
+            wallet_id        uuid        NOT NULL REFERENCES wallets (id),
+            transaction_type varchar(20) NOT NULL,
+            material         varchar(50),
+            units            integer,
+            amount_cents     integer     NOT NULL,
+            created_at       timestamp
+        )
+    """)
+    # Months already rolled into transactions_archive are not restored.
+    op.execute(f"INSERT INTO transactions ({COLUMNS}) SELECT {COLUMNS} FROM transactions_partitioned")
+    op.execute("DROP TABLE transactions_partitioned CASCADE")
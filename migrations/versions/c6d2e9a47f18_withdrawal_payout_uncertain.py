@@ -0,0 +1,30 @@
+"""withdrawal payout_uncertain flag
+
+Set when a payout attempt failed in a way that leaves Stripe's outcome
+unknown (connection error, timeout, 5xx). Such withdrawals are held as
+`unknown` instead of refunded once retries run out.
+
+Revision ID: c6d2e9a47f18
+Revises: b3f17d6e2c40
+Create Date: 2025-10-02 09:14:52.603118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6d2e9a47f18'
+down_revision = 'b3f17d6e2c40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('withdrawals', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('payout_uncertain', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table('withdrawals', schema=None) as batch_op:
+        batch_op.drop_column('payout_uncertain')
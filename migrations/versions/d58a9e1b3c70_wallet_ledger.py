@@ -0,0 +1,55 @@
+"""wallet ledger and reconciliation checkpoints
+
+Tables for `flask ledger reconcile` (services/reconciliation.py), plus the
+indexes its incremental scans use: created_at / processed_at on withdrawals,
+and on Postgres a BRIN index on transactions.created_at (append-only, so
+tiny and enough to skip everything before the high-water mark).
+
+Revision ID: d58a9e1b3c70
+Revises: c41d8e2a6f93
+Create Date: 2025-08-19 16:22:05.114873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd58a9e1b3c70'
+down_revision = 'c41d8e2a6f93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('wallet_ledger',
+    sa.Column('wallet_id', sa.UUID(), nullable=False),
+    sa.Column('expected_cents', sa.BigInteger(), nullable=False),
+    sa.Column('reconciled_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['wallet_id'], ['wallets.id'], ),
+    sa.PrimaryKeyConstraint('wallet_id')
+    )
+    op.create_table('ledger_checkpoints',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('high_water_mark', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    with op.batch_alter_table('withdrawals', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_withdrawals_created_at'), ['created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_withdrawals_processed_at'), ['processed_at'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE INDEX ix_transactions_created_at_brin ON transactions USING brin (created_at)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX ix_transactions_created_at_brin")
+
+    with op.batch_alter_table('withdrawals', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_withdrawals_processed_at'))
+        batch_op.drop_index(batch_op.f('ix_withdrawals_created_at'))
+
+    op.drop_table('ledger_checkpoints')
+    op.drop_table('wallet_ledger')
@@ -0,0 +1,30 @@
+"""payout batch payout_uncertain flag
+
+The PayoutBatch counterpart of c6d2e9a47f18: a batch whose payout may
+have reached Stripe is held as `unknown` (with its withdrawals) instead
+of refunded once retries run out.
+
+Revision ID: d93a1f6c52b8
+Revises: c6d2e9a47f18
+Create Date: 2025-10-02 11:40:17.218904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93a1f6c52b8'
+down_revision = 'c6d2e9a47f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payout_batches', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('payout_uncertain', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table('payout_batches', schema=None) as batch_op:
+        batch_op.drop_column('payout_uncertain')
@@ -0,0 +1,53 @@
+"""payout batches for aggregated withdrawals
+
+Revision ID: e2b6f47c9a15
+Revises: d58a9e1b3c70
+Create Date: 2025-08-26 11:07:39.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b6f47c9a15'
+down_revision = 'd58a9e1b3c70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payout_batches',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('bank_token', sa.String(length=255), nullable=False),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.Column('withdrawal_count', sa.Integer(), nullable=False),
+    sa.Column('stripe_payout_id', sa.String(length=255), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('payout_batches', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_payout_batches_status'), ['status'], unique=False)
+
+    with op.batch_alter_table('withdrawals', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('batch_id', sa.UUID(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_withdrawals_batch_id'), ['batch_id'], unique=False)
+        batch_op.create_foreign_key('fk_withdrawals_batch_id', 'payout_batches', ['batch_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('withdrawals', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_withdrawals_batch_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_withdrawals_batch_id'))
+        batch_op.drop_column('batch_id')
+
+    with op.batch_alter_table('payout_batches', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_payout_batches_status'))
+
+    op.drop_table('payout_batches')
@@ -0,0 +1,30 @@
+"""wallet version counter
+
+Bumped by every balance change (the ORM via version_id_col, the deposit
+UPDATE explicitly), so services/balance_cache.py can refuse to overwrite a
+cached balance with an older one.
+
+Revision ID: e5a8c3f07b21
+Revises: d93a1f6c52b8
+Create Date: 2025-10-06 10:03:41.552190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a8c3f07b21'
+down_revision = 'd93a1f6c52b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('wallets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('wallets', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,58 @@
+"""material rates table and transactions.rate_version
+
+Seeds the rates that used to be hardcoded in routes/deposit.py
+(plastic 5¢, aluminum 10¢) as versions 1 and 2.
+
+Revision ID: f7c3a9d21e48
+Revises: e2b6f47c9a15
+Create Date: 2025-09-02 10:18:44.670215
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7c3a9d21e48'
+down_revision = 'e2b6f47c9a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    material_rates = op.create_table('material_rates',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('material', sa.String(length=50), nullable=False),
+    sa.Column('region', sa.String(length=64), nullable=True),
+    sa.Column('kiosk_fleet', sa.String(length=64), nullable=True),
+    sa.Column('rate_cents', sa.Integer(), nullable=False),
+    sa.Column('effective_from', sa.DateTime(), nullable=False),
+    sa.Column('effective_to', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('material_rates', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_material_rates_material'), ['material'], unique=False)
+
+    epoch = datetime(2000, 1, 1)
+    op.bulk_insert(material_rates, [
+        {'material': 'plastic', 'rate_cents': 5, 'effective_from': epoch, 'created_at': epoch},
+        {'material': 'aluminum', 'rate_cents': 10, 'effective_from': epoch, 'created_at': epoch},
+    ])
+
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rate_version', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_transactions_rate_version', 'material_rates', ['rate_version'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_transactions_rate_version', type_='foreignkey')
+        batch_op.drop_column('rate_version')
+
+    with op.batch_alter_table('material_rates', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_material_rates_material'))
+
+    op.drop_table('material_rates')
@@ -3,6 +3,15 @@ from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from datetime import datetime
 
+class Compactable:
+    """`to_dict(compact=True)` keeps only COMPACT_FIELDS, the kiosk wire profile (services/wire.py)."""
+    COMPACT_FIELDS = ()
+    
+    @classmethod
+    def compact(cls, data):
+        """Compact form of an existing `to_dict()` result."""
+        return {k: data[k] for k in cls.COMPACT_FIELDS}
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -15,28 +24,44 @@ class User(db.Model):
     
     # Relationships
     wallet = db.relationship('Wallet', backref='user', uselist=False, cascade='all, delete-orphan')
-    transactions = db.relationship('Transaction', backref='user', cascade='all, delete-orphan')
-    withdrawals = db.relationship('Withdrawal', backref='user', cascade='all, delete-orphan')
+    transactions = db.relationship('Transaction', backref='user', cascade='all, delete-orphan', lazy='dynamic')
+    withdrawals = db.relationship('Withdrawal', backref='user', cascade='all, delete-orphan', lazy='dynamic')
 
-class Wallet(db.Model):
+class Wallet(Compactable, db.Model):
     __tablename__ = 'wallets'
+    COMPACT_FIELDS = ('balance_cents',)
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False, unique=True)
     balance_cents = db.Column(db.Integer, default=0, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, server_default='1')  # +1 per balance change (balance cache)
     
-    def to_dict(self):
-        return {
-            'id': str(self.id),
-            'balance_cents': self.balance_cents,
-            'balance_dollars': self.balance_cents / 100,
-            'updated_at': self.updated_at.isoformat()
+    __mapper_args__ = {'version_id_col': version}
+    
+    @staticmethod
+    def serialize(id, balance_cents, updated_at, compact=False):
+        """`to_dict()` from bare column values (e.g. an UPDATE … RETURNING row)."""
+        data = {
+            'id': str(id),
+            'balance_cents': balance_cents,
+            'balance_dollars': balance_cents / 100,
+            'updated_at': updated_at.isoformat()
         }
+        return Wallet.compact(data) if compact else data
+    
+    def to_dict(self, compact=False):
+        return Wallet.serialize(self.id, self.balance_cents, self.updated_at, compact)
 
-class Transaction(db.Model):
+class Transaction(Compactable, db.Model):
     __tablename__ = 'transactions'
+    COMPACT_FIELDS = ('id', 'units', 'amount_cents')
+    # Range-partitioned by month on created_at in Postgres (services/partitions.py),
+    # which requires the partition key in the primary key.
+    __table_args__ = (
+        db.Index('ix_transactions_user_id_created_at', 'user_id', 'created_at'),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
@@ -45,38 +70,138 @@ class Transaction(db.Model):
     material = db.Column(db.String(50), nullable=True)  # 'plastic', 'aluminum'
     units = db.Column(db.Integer, nullable=True)
     amount_cents = db.Column(db.Integer, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    rate_version = db.Column(db.Integer, db.ForeignKey('material_rates.id'), nullable=True)  # rate row applied
+    device_id = db.Column(db.String(64), nullable=True)   # X-Kiosk-Device-ID of the kiosk camera
+    region = db.Column(db.String(64), nullable=True)      # X-Kiosk-Region of the kiosk
+    created_at = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
     
-    def to_dict(self):
-        return {
+    def to_dict(self, compact=False):
+        data = {
             'id': str(self.id),
             'transaction_type': self.transaction_type,
             'material': self.material,
             'units': self.units,
             'amount_cents': self.amount_cents,
             'amount_dollars': self.amount_cents / 100,
+            'rate_version': self.rate_version,
             'created_at': self.created_at.isoformat()
         }
+        return self.compact(data) if compact else data
 
-class Withdrawal(db.Model):
+class Withdrawal(Compactable, db.Model):
     __tablename__ = 'withdrawals'
+    COMPACT_FIELDS = ('id', 'amount_cents', 'status')
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
     wallet_id = db.Column(UUID(as_uuid=True), db.ForeignKey('wallets.id'), nullable=False)
     amount_cents = db.Column(db.Integer, nullable=False)
     bank_token = db.Column(db.String(255), nullable=False)
-    stripe_payment_intent_id = db.Column(db.String(255), nullable=True)
-    status = db.Column(db.String(20), default='pending')  # 'pending', 'completed', 'failed'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    processed_at = db.Column(db.DateTime, nullable=True)
+    stripe_payment_intent_id = db.Column(db.String(255), nullable=True)  # payout reference
+    status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'processing', 'completed', 'failed', 'unknown'
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    claimed_at = db.Column(db.DateTime, nullable=True)       # payout worker lease
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # retry backoff
+    last_error = db.Column(db.String(255), nullable=True)
+    payout_uncertain = db.Column(db.Boolean, default=False, nullable=False, server_default=db.false())  # a send may have reached Stripe
+    batch_id = db.Column(UUID(as_uuid=True), db.ForeignKey('payout_batches.id'), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    processed_at = db.Column(db.DateTime, nullable=True, index=True)
     
-    def to_dict(self):
-        return {
+    def to_dict(self, compact=False):
+        data = {
             'id': str(self.id),
             'amount_cents': self.amount_cents,
             'amount_dollars': self.amount_cents / 100,
             'status': self.status,
+            'batch_id': str(self.batch_id) if self.batch_id else None,
             'created_at': self.created_at.isoformat(),
             'processed_at': self.processed_at.isoformat() if self.processed_at else None
-        }
\ No newline at end of file
+        }
+        return self.compact(data) if compact else data
+
+class PayoutBatch(db.Model):
+    """One aggregated payout covering every withdrawal linked to it (PAYOUT_AGGREGATE mode)."""
+    __tablename__ = 'payout_batches'
+    
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    bank_token = db.Column(db.String(255), nullable=False)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
+    withdrawal_count = db.Column(db.Integer, nullable=False)
+    stripe_payout_id = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'processing', 'completed', 'failed', 'unknown'
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(255), nullable=True)
+    payout_uncertain = db.Column(db.Boolean, default=False, nullable=False, server_default=db.false())
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    
+    withdrawals = db.relationship('Withdrawal', backref='batch', lazy='dynamic')
+
+class MaterialRate(db.Model):
+    """Cents per unit of a material; region / kiosk_fleet NULL means "any" (services/pricing.py)."""
+    __tablename__ = 'material_rates'
+    
+    id = db.Column(db.Integer, primary_key=True)        # doubles as the rate version
+    material = db.Column(db.String(50), nullable=False, index=True)
+    region = db.Column(db.String(64), nullable=True)
+    kiosk_fleet = db.Column(db.String(64), nullable=True)
+    rate_cents = db.Column(db.Integer, nullable=False)
+    effective_from = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    effective_to = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'version': self.id,
+            'material': self.material,
+            'region': self.region,
+            'kiosk_fleet': self.kiosk_fleet,
+            'rate_cents': self.rate_cents,
+            'effective_from': self.effective_from.isoformat(),
+            'effective_to': self.effective_to.isoformat() if self.effective_to else None
+        }
+
+class WalletLedger(db.Model):
+    """Expected balance per wallet as of the reconciliation high-water mark."""
+    __tablename__ = 'wallet_ledger'
+    
+    wallet_id = db.Column(UUID(as_uuid=True), db.ForeignKey('wallets.id'), primary_key=True)
+    expected_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class KioskDailyRollup(db.Model):
+    """Deposits per day, kiosk device, region and material (services/rollups.py); '' = unknown."""
+    __tablename__ = 'kiosk_daily_rollups'
+    
+    day = db.Column(db.Date, primary_key=True)
+    device_id = db.Column(db.String(64), primary_key=True, default='')
+    region = db.Column(db.String(64), primary_key=True, default='')
+    material = db.Column(db.String(50), primary_key=True, default='')
+    deposits = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.BigInteger, nullable=False, default=0)
+    amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class IdempotencyKey(db.Model):
+    """First response to a request sent with an `Idempotency-Key` (services/idempotency.py)."""
+    __tablename__ = 'idempotency_keys'
+    
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)   # sha256 of method, path and body
+    status_code = db.Column(db.Integer, nullable=True)        # NULL while the first request is in flight
+    content_type = db.Column(db.String(128), nullable=True)
+    response_body = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class LedgerCheckpoint(db.Model):
+    """High-water mark of an incremental job (services/reconciliation.py, services/rollups.py)."""
+    __tablename__ = 'ledger_checkpoints'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    high_water_mark = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,170 @@
+# monitoring/metrics.py
+"""Prometheus metrics for HTTP, DB pool, auth, rate limiting and YOLO inference.
+
+Under gunicorn, ``PROMETHEUS_MULTIPROC_DIR`` (set in gunicorn.conf.py) switches
+prometheus_client to its mmap-backed multiprocess values so ``/metrics`` on
+any worker reports the totals of all of them.
+"""
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy.pool import QueuePool
+
+# ────────────────────────── metric definitions ────────────────────────
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by blueprint and route",
+    ["blueprint", "route", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Responses by route and status", ["blueprint", "route", "method", "status"]
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements issued per request",
+    ["blueprint", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50),
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled DB connection",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_connections_checked_out", "Connections currently checked out", multiprocess_mode="livesum"
+)
+DB_READ_ROUTING = Counter(
+    "db_read_routing_total", "Replica-eligible requests by where they were served", ["target"]
+)
+AUTH_ATTEMPTS = Counter(
+    "auth_attempts_total", "Auth decorator outcomes by path", ["path", "outcome"]
+)
+RATELIMIT_REJECTIONS = Counter(
+    "ratelimit_rejections_total", "Requests rejected by Flask-Limiter", ["route", "limit"]
+)
+DEPOSIT_ANOMALIES = Counter(
+    "deposit_anomalies_total", "Deposits breaking a velocity rule (services/deposit_guard.py)", ["rule", "action"]
+)
+IDEMPOTENCY_REQUESTS = Counter(
+    "idempotency_requests_total", "Requests with an Idempotency-Key by outcome (services/idempotency.py)", ["outcome"]
+)
+WALLET_STREAM_SUBSCRIBERS = Gauge(
+    "wallet_stream_subscribers", "Open /wallet/stream connections", multiprocess_mode="livesum"
+)
+WALLET_STREAM_DROPPED = Counter(
+    "wallet_stream_dropped_events_total", "Events dropped from a slow /wallet/stream client's full queue"
+)
+PRICING_FALLBACK = Gauge(
+    "pricing_fallback_active",
+    "1 while a worker prices deposits from DEFAULT_RATES because material_rates never loaded",
+    multiprocess_mode="livemax",
+)
+YOLO_MODEL_LOAD = Histogram(
+    "yolo_model_load_seconds", "YOLO model load time per worker", buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+YOLO_INFERENCE = Histogram(
+    "yolo_inference_seconds",
+    "Bottle detection latency (decode + forward + postprocess)",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16),
+)
+YOLO_INFLIGHT = Gauge(
+    "yolo_inflight_requests", "Detections running or waiting for the model", multiprocess_mode="livesum"
+)
+
+
+# ────────────────────────── DB pool ───────────────────────────────────
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_POOL_CHECKED_OUT.inc()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    DB_POOL_CHECKED_OUT.dec()
+
+
+# ────────────────────────── request hooks ─────────────────────────────
+def _start_timer():
+    if "request_started_at" not in g:
+        g.request_started_at = time.perf_counter()
+
+
+def _route_labels():
+    rule = request.url_rule
+    return request.blueprint or "app", rule.rule if rule is not None else "<unmatched>"
+
+
+def _observe(response):
+    started = g.get("request_started_at")
+    if started is None:
+        return response
+    blueprint, route = _route_labels()
+    HTTP_REQUEST_DURATION.labels(blueprint, route, request.method).observe(time.perf_counter() - started)
+    HTTP_REQUESTS.labels(blueprint, route, request.method, str(response.status_code)).inc()
+    DB_QUERIES_PER_REQUEST.labels(blueprint, route).observe(g.get("db_query_count", 0))
+    return response
+
+
+def on_rate_limit_breach(request_limit):
+    """Flask-Limiter ``on_breach`` callback."""
+    RATELIMIT_REJECTIONS.labels(_route_labels()[1], str(request_limit.limit)).inc()
+
+
+# ────────────────────────── public API ────────────────────────────────
+def configure_engine_options(app):
+    """Swap in the timed pool for server databases (SQLite uses its own pools)."""
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI") or ""
+    if uri.startswith("sqlite"):
+        return
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    options.setdefault("poolclass", TimedQueuePool)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def init_metrics(app):
+    """Register request, pool and limiter hooks. Call before ``db.init_app``."""
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+
+    from sqlalchemy import event
+    from sqlalchemy.pool import Pool
+
+    configure_engine_options(app)
+    app.config.setdefault("RATELIMIT_ON_BREACH_CALLBACK", on_rate_limit_breach)
+    if not event.contains(Pool, "checkout", _on_checkout):
+        event.listen(Pool, "checkout", _on_checkout)
+        event.listen(Pool, "checkin", _on_checkin)
+
+    app.before_request(_start_timer)
+    app.after_request(_observe)
+
+
+def render_metrics():
+    """Body and content type for ``/metrics``, aggregated across workers when multiprocess."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    from prometheus_client import REGISTRY
+
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
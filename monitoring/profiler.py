@@ -0,0 +1,156 @@
+# monitoring/profiler.py
+"""On-demand wall-clock sampling profiler for a live worker (GET/POST /debug/profile).
+
+A sampler thread reads every thread's stack with ``sys._current_frames()``
+each PROFILER_INTERVAL_MS for the requested number of seconds (capped at
+PROFILER_MAX_SECONDS) and counts identical stacks. Nothing is hooked into the
+interpreter, so the requests being profiled pay only for the GIL the sampler
+briefly takes; when no profile is running there is no cost at all. The
+result is collapsed-stack text (``thread;module:func;module:func count`` per
+line), which flamegraph.pl, speedscope and inferno read as is.
+
+Under gevent the sampler is a real OS thread (all greenlets share the main
+thread, whose stack is whichever greenlet is running), so it keeps sampling
+while a greenlet hogs the CPU. One profile runs per worker at a time.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+try:
+    from gevent import monkey
+except ImportError:          # gevent is only needed for GUNICORN_WORKER_CLASS=gevent
+    monkey = None
+
+STALE_GRACE_SECONDS = 30
+
+
+def _original(module, name):
+    """``module.name`` as it was before gevent's monkey patching."""
+    if monkey is not None and monkey.is_module_patched(module):
+        return monkey.get_original(module, name)
+    return getattr(__import__(module), name)
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profile is already running in this worker."""
+
+
+# ────────────────────────── sampler ───────────────────────────────────
+class Profile:
+    """One sampling run; ``collapsed()`` renders it once ``done`` is set."""
+
+    _active = None
+    _lock = threading.Lock()
+
+    def __init__(self, seconds, interval_ms, exclude=()):
+        self.id = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self.seconds = seconds
+        self.interval = interval_ms / 1000
+        self.exclude = set(exclude)
+        self.samples = 0
+        self.stacks = Counter()
+        self.done = False
+        self._names = {}     # code object → "module:qualname"
+        self._on_done = None
+
+    def start(self, on_done=None):
+        with Profile._lock:
+            if Profile._active is not None:
+                raise ProfilerBusy(Profile._active.id)
+            Profile._active = self
+        self._on_done = on_done
+        _original("_thread", "start_new_thread")(self._run, ())
+        return self
+
+    def wait(self):
+        """Block until finished; yields to other greenlets under gevent."""
+        while not self.done:
+            time.sleep(0.05)
+        return self
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+        return name
+
+    def _run(self):
+        sleep, own = _original("time", "sleep"), _original("_thread", "get_ident")()
+        skip = self.exclude | {own}
+        deadline = time.perf_counter() + self.seconds
+        try:
+            while time.perf_counter() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident in skip:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(self._frame_name(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+                    self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+                sleep(self.interval)
+        finally:
+            with Profile._lock:
+                Profile._active = None
+            self.done = True
+            if self._on_done is not None:
+                self._on_done(self)
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+# ────────────────────────── background results ────────────────────────
+def profile_dir(config):
+    path = config.get("PROFILER_DIR") or os.path.join(tempfile.gettempdir(), "recycletek-profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def start_background(config, seconds, interval_ms):
+    """Start a profile whose result lands in PROFILER_DIR, readable from any worker on the host."""
+    directory = profile_dir(config)
+
+    def write(profile):
+        target = os.path.join(directory, f"{profile.id}.folded")
+        with open(f"{target}.tmp", "w") as f:
+            f.write(profile.collapsed())
+        os.replace(f"{target}.tmp", target)
+        os.remove(os.path.join(directory, f"{profile.id}.running"))
+
+    profile = Profile(seconds, interval_ms)
+    with open(os.path.join(directory, f"{profile.id}.running"), "w") as f:
+        f.write(str(time.time() + seconds))
+    try:
+        return profile.start(on_done=write)
+    except ProfilerBusy:
+        os.remove(os.path.join(directory, f"{profile.id}.running"))
+        raise
+
+
+def background_result(config, profile_id):
+    """("done", text), ("running", None) or (None, None) for an unknown or abandoned id."""
+    if not profile_id.replace("-", "").isalnum():
+        return None, None
+    directory = profile_dir(config)
+    try:
+        with open(os.path.join(directory, f"{profile_id}.folded")) as f:
+            return "done", f.read()
+    except FileNotFoundError:
+        pass
+    try:
+        with open(os.path.join(directory, f"{profile_id}.running")) as f:
+            ends_at = float(f.read() or 0)
+    except (FileNotFoundError, ValueError):
+        return None, None
+    # A worker that died mid-profile leaves its marker behind
+    return ("running", None) if time.time() < ends_at + STALE_GRACE_SECONDS else (None, None)
@@ -0,0 +1,103 @@
+# monitoring/queries.py
+"""Per-request SQL statement counting, slow-query logging and Server-Timing."""
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_lock = threading.Lock()
+_endpoint_stats = {}        # endpoint → {"requests", "queries", "db_ms", "max_queries"}
+
+
+# ────────────────────────── engine hooks ──────────────────────────────
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+    if not has_request_context():
+        return
+
+    g.db_query_count = g.get("db_query_count", 0) + 1
+    g.db_time_ms = g.get("db_time_ms", 0.0) + elapsed_ms
+
+    threshold = current_app.config.get("SLOW_QUERY_THRESHOLD_MS")
+    if threshold is not None and elapsed_ms >= threshold:
+        current_app.logger.warning(
+            f"Slow query ({elapsed_ms:.1f} ms) on {request.method} {request.endpoint}: "
+            f"{' '.join(statement.split())[:500]}"
+        )
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+# ────────────────────────── request hooks ─────────────────────────────
+def _start_timer():
+    g.request_started_at = time.perf_counter()
+
+
+def _record(response):
+    queries = g.get("db_query_count", 0)
+    db_ms = g.get("db_time_ms", 0.0)
+    started = g.get("request_started_at")
+    total_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+
+    response.headers.add(
+        "Server-Timing", f'db;dur={db_ms:.2f};desc="{queries} queries", app;dur={total_ms:.2f}'
+    )
+
+    endpoint = request.endpoint or "<unmatched>"
+    with _lock:
+        stats = _endpoint_stats.setdefault(
+            endpoint, {"requests": 0, "queries": 0, "db_ms": 0.0, "max_queries": 0}
+        )
+        stats["requests"] += 1
+        stats["queries"] += queries
+        stats["db_ms"] += db_ms
+        stats["max_queries"] = max(stats["max_queries"], queries)
+    return response
+
+
+# ────────────────────────── public API ────────────────────────────────
+def endpoint_query_stats():
+    """Aggregated query counts and DB time per endpoint since worker start."""
+    with _lock:
+        snapshot = {k: dict(v) for k, v in _endpoint_stats.items()}
+    return {
+        endpoint: {
+            "requests": s["requests"],
+            "total_queries": s["queries"],
+            "avg_queries": round(s["queries"] / s["requests"], 2),
+            "max_queries": s["max_queries"],
+            "total_db_ms": round(s["db_ms"], 2),
+            "avg_db_ms": round(s["db_ms"] / s["requests"], 3),
+        }
+        for endpoint, s in sorted(snapshot.items())
+    }
+
+
+def reset_query_stats():
+    with _lock:
+        _endpoint_stats.clear()
+
+
+def init_query_stats(app):
+    """Register the SQLAlchemy and request hooks; no-op when QUERY_STATS_ENABLED is off."""
+    if not app.config.get("QUERY_STATS_ENABLED", True):
+        return
+
+    # Listening on the Engine class covers every engine / bind the app creates.
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+    app.before_request(_start_timer)
+    app.after_request(_record)
@@ -0,0 +1,250 @@
+# monitoring/tracing.py
+"""Opt-in per-request tracing: timed spans around auth, SQL, Stripe and YOLO stages.
+
+Off unless TRACING_ENABLED. When off nothing is registered and ``span()``
+returns a shared no-op after one flag check. When on, a request is traced if
+it sends `X-Trace-Request: 1` together with a valid `X-Ops-Token`, or if it is
+picked by TRACING_SAMPLE_RATE; payout jobs are picked by the same rate. A
+traced response carries `X-Trace-Id` and a Server-Timing entry per span name;
+the finished trace is logged as one JSON line and kept in a per-worker ring
+buffer of TRACING_BUFFER_SIZE served by GET /debug/traces.
+
+    with span("stripe.payout", amount_cents=amount):
+        ...
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from auth.ops import ops_token_valid
+
+_enabled = False
+_current = ContextVar("trace", default=None)
+_lock = threading.Lock()
+_finished = deque(maxlen=200)
+
+
+# ────────────────────────── traces and spans ──────────────────────────
+class Trace:
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.utcnow()
+        self.t0 = time.perf_counter()
+        self.spans = []          # finished, as dicts
+        self.open = []           # stack of running _Span
+
+    def finish(self):
+        while self.open:
+            self.open[-1].finish()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat() + "Z",
+            "duration_ms": round((time.perf_counter() - self.t0) * 1000, 3),
+            "attrs": self.attrs,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "start", "depth")
+
+    def __init__(self, trace, name, attrs):
+        self.trace, self.name, self.attrs = trace, name, attrs
+        self.start = self.depth = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.depth = len(self.trace.open)
+        self.trace.open.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.finish()
+        return False
+
+    def finish(self):
+        if self not in self.trace.open:
+            return
+        # Closing a span closes anything still open inside it
+        while self.trace.open.pop() is not self:
+            pass
+        end = time.perf_counter()
+        self.trace.spans.append({
+            "name": self.name,
+            "start_ms": round((self.start - self.trace.t0) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "depth": self.depth,
+            "attrs": self.attrs,
+        })
+
+
+class _NoopSpan:
+    __slots__ = ()
+    attrs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def finish(self):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+# ────────────────────────── public API ────────────────────────────────
+def span(name, **attrs):
+    """Context manager timing ``name`` in the current trace; a no-op when not tracing."""
+    if not _enabled:
+        return _NOOP
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name, attrs)
+
+
+def begin(name, **attrs):
+    """Open a span that is closed by ``ends(name, ...)`` or when the trace finishes."""
+    return span(name, **attrs).__enter__()
+
+
+def ends(name, fn):
+    """Wrap ``fn`` so calling it closes the innermost open span called ``name``."""
+
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        if _enabled:
+            trace = _current.get()
+            if trace is not None:
+                for open_span in reversed(trace.open):
+                    if open_span.name == name:
+                        open_span.finish()
+                        break
+        return fn(*args, **kwargs)
+
+    return wrapped
+
+
+class job:
+    """Root trace around work outside a request (payout jobs), picked by TRACING_SAMPLE_RATE."""
+
+    def __init__(self, name, **attrs):
+        self.name, self.attrs = name, attrs
+        self.trace = self.token = None
+
+    def __enter__(self):
+        if _enabled and _current.get() is None and random.random() < current_app.config["TRACING_SAMPLE_RATE"]:
+            self.trace = Trace(self.name, **self.attrs)
+            self.token = _current.set(self.trace)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            if exc_type is not None:
+                self.trace.attrs["error"] = exc_type.__name__
+            _current.reset(self.token)
+            _keep(self.trace.finish())
+        return False
+
+
+def recent_traces():
+    with _lock:
+        return list(reversed(_finished))
+
+
+def find_trace(trace_id):
+    with _lock:
+        return next((t for t in _finished if t["id"] == trace_id), None)
+
+
+def _keep(record):
+    with _lock:
+        _finished.append(record)
+    current_app.logger.info(f"Trace {json.dumps(record, default=str)}")
+
+
+# ────────────────────────── engine hooks ──────────────────────────────
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    db_span = span("db", sql=" ".join(statement.split())[:200])
+    conn.info.setdefault("trace_spans", []).append(db_span.__enter__())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["trace_spans"].pop().finish()
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("trace_spans"):
+        conn.info["trace_spans"].pop().__exit__(type(exception_context.original_exception), None, None)
+
+
+# ────────────────────────── request hooks ─────────────────────────────
+def _requested():
+    return request.headers.get("X-Trace-Request") == "1" and ops_token_valid()
+
+
+def _start_trace():
+    if _requested() or random.random() < current_app.config["TRACING_SAMPLE_RATE"]:
+        trace = Trace(f"{request.method} {request.path}", endpoint=request.endpoint)
+        g.trace_token = _current.set(trace)
+
+
+def _finish_trace(response):
+    trace = _current.get()
+    if trace is None or "trace_token" not in g:
+        return response
+    trace.attrs.update(status=response.status_code, auth_path=g.get("auth_path"))
+    record = trace.finish()
+    totals = {}
+    for s in record["spans"]:
+        if s["name"] != "db":        # monitoring/queries.py already reports DB time
+            totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration_ms"]
+    response.headers["X-Trace-Id"] = trace.id
+    response.headers.add("Server-Timing", ", ".join(
+        [f'trace;desc="{trace.id}"'] + [f"{name};dur={ms:.2f}" for name, ms in totals.items()]
+    ))
+    _keep(record)
+    return response
+
+
+def _end_trace(exc):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        _current.reset(token)
+
+
+def init_tracing(app):
+    """Register the request and SQLAlchemy hooks; no-op when TRACING_ENABLED is off."""
+    global _enabled, _finished
+    if not app.config.get("TRACING_ENABLED"):
+        return
+    _finished = deque(_finished, maxlen=app.config["TRACING_BUFFER_SIZE"])
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+    app.before_request(_start_trace)
+    app.after_request(_finish_trace)
+    app.teardown_request(_end_trace)
+    _enabled = True
@@ -0,0 +1,47 @@
+# ratelimit.py – key functions and dynamic quotas for Flask-Limiter
+"""Rate limits are keyed on who is calling, not where from.
+
+Authenticated routes are limited inside `firebase_required` / `kiosk_only`
+(after `g.current_user` is set), so a NAT full of kiosks no longer shares one
+IP bucket. Unauthenticated routes fall back to the kiosk header or the IP.
+"""
+from flask import current_app, g, request
+from flask_limiter.util import get_remote_address
+
+KIOSK_AUTH_PATHS = ("kiosk", "kiosk_only", "kiosk_session")
+
+
+def identity_key() -> str:
+    """`user:<id>` once authenticated, else `kiosk:<id>` / `ip:<addr>`."""
+    user = g.get("current_user")
+    if user is not None:
+        return f"user:{user.id}"
+    kiosk_id = request.headers.get("X-Kiosk-User-ID")
+    if kiosk_id:
+        return f"kiosk:{kiosk_id.upper()}"
+    return f"ip:{get_remote_address()}"
+
+
+def kiosk_fleet() -> str | None:
+    """Fleet a kiosk device belongs to, from its `X-Kiosk-Fleet` header."""
+    fleet = request.headers.get("X-Kiosk-Fleet", "").strip().lower()
+    return fleet or None
+
+
+def kiosk_fleet_key() -> str:
+    return f"fleet:{kiosk_fleet()}"
+
+
+def user_rate_limit() -> str:
+    return current_app.config["RATELIMIT_USER"]
+
+
+def kiosk_fleet_quota() -> str:
+    """Per-fleet override from RATELIMIT_KIOSK_FLEET_QUOTAS, else the fleet default."""
+    quotas = current_app.config.get("RATELIMIT_KIOSK_FLEET_QUOTAS") or {}
+    return quotas.get(kiosk_fleet()) or current_app.config["RATELIMIT_KIOSK_FLEET_DEFAULT"]
+
+
+def not_fleet_kiosk_request() -> bool:
+    """Fleet quotas only apply to kiosk-authenticated requests that name a fleet."""
+    return g.get("auth_path") not in KIOSK_AUTH_PATHS or kiosk_fleet() is None
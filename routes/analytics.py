@@ -0,0 +1,65 @@
+from datetime import date
+import csv
+import io
+import json
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from auth.ops import ops_required
+from extensions import db
+from services.rollups import COLUMNS, rollup_query
+
+analytics_bp = Blueprint('analytics', __name__)
+
+def _day(name):
+    value = request.args.get(name)
+    return date.fromisoformat(value) if value else None
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+def _ndjson_lines(rows):
+    return ''.join(
+        json.dumps({**dict(zip(COLUMNS, row)), 'day': str(row[0])}, separators=(',', ':')) + '\n'
+        for row in rows
+    )
+
+@analytics_bp.route('/analytics/kiosk-rollups', methods=['GET'])
+@ops_required
+def export_kiosk_rollups():
+    """Stream daily per-kiosk deposit rollups as CSV (default) or NDJSON (?format=ndjson)
+
+    Filters: from / to (inclusive ISO dates), device_id, region, material.
+    Rows are read with a server-side cursor and sent ROLLUP_EXPORT_BATCH_ROWS
+    at a time, so an export of any size runs in constant memory.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        start, end = _day('from'), _day('to')
+    except ValueError:
+        return jsonify({'error': 'from / to must be ISO dates (YYYY-MM-DD)'}), 400
+    query = rollup_query(start, end, request.args.get('device_id'), request.args.get('region'),
+                         request.args.get('material'))
+    batch = current_app.config['ROLLUP_EXPORT_BATCH_ROWS']
+    render = _csv_lines if fmt == 'csv' else _ndjson_lines
+
+    def stream():
+        if fmt == 'csv':
+            yield ','.join(COLUMNS) + '\n'
+        # own connection: the request's session is released and not held for the whole download
+        with db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch).execute(query)
+            for rows in result.partitions():
+                yield render(rows)
+
+    db.session.close()
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(stream()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=kiosk-rollups.{fmt}',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
@@ -1,95 +1,76 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 import cv2
 import numpy as np
 import base64
 import os
-import urllib.request
+import time
 from datetime import datetime
+from monitoring.metrics import YOLO_MODEL_LOAD, YOLO_INFERENCE, YOLO_INFLIGHT
+from monitoring.tracing import span
+from ratelimit import kiosk_fleet
+from services.artifacts import ArtifactError, ArtifactStore
+from services.inference import create_backend
+from services.preprocessing import DEFAULT_PROFILE, kiosk_device, profile_for, tile_frames, tiling_from_config
+from services.wire import respond, wants_compact
 
 # Create blueprint
 bottle_detection_bp = Blueprint('bottle_detection', __name__)
 
 # Global variables for YOLO model
-yolo_net = None
+yolo_net = None          # services.inference backend
 yolo_classes = None
-yolo_output_layers = None
-
-def download_yolo_files():
-    """Download YOLO model files if they don't exist"""
-    yolo_dir = 'yolo_files'
-    if not os.path.exists(yolo_dir):
-        os.makedirs(yolo_dir)
-    
-    files_to_download = {
-        'yolov4.weights': 'https://github.com/AlexeyAB/darknet/releases/download/darknet_yolo_v3_optimal/yolov4.weights',
-        'yolov4.cfg': 'https://raw.githubusercontent.com/AlexeyAB/darknet/master/cfg/yolov4.cfg',
-        'coco.names': 'https://raw.githubusercontent.com/pjreddie/darknet/master/data/coco.names'
-    }
-    
-    for filename, url in files_to_download.items():
-        filepath = os.path.join(yolo_dir, filename)
-        if not os.path.exists(filepath):
-            print(f"Downloading {filename}...")
-            try:
-                urllib.request.urlretrieve(url, filepath)
-                print(f"✅ Downloaded {filename}")
-            except Exception as e:
-                print(f"❌ Failed to download {filename}: {e}")
-                return False
-    
-    return True
 
 def load_yolo_model():
     """Load YOLO model for object detection"""
-    global yolo_net, yolo_classes, yolo_output_layers
+    global yolo_net, yolo_classes
     
     try:
-        yolo_dir = 'yolo_files'
+        started = time.perf_counter()
+        # Verified local copies (baked dir, then cache), downloaded and checksummed if missing
+        store = ArtifactStore(current_app.config)
         
-        weights_path = os.path.join(yolo_dir, 'yolov4.weights')
-        config_path = os.path.join(yolo_dir, 'yolov4.cfg')
-        classes_path = os.path.join(yolo_dir, 'coco.names')
+        backend = create_backend(current_app.config, resolve=store.path)
         
-        if not all(os.path.exists(path) for path in [weights_path, config_path, classes_path]):
-            print("YOLO files not found. Downloading...")
-            if not download_yolo_files():
-                return False
-        
-        yolo_net = cv2.dnn.readNet(weights_path, config_path)
-        
-        with open(classes_path, 'r') as f:
+        with open(store.path('coco.names'), 'r') as f:
             yolo_classes = [line.strip() for line in f.readlines()]
         
-        layer_names = yolo_net.getLayerNames()
-        yolo_output_layers = [layer_names[i - 1] for i in yolo_net.getUnconnectedOutLayers()]
+        yolo_net = backend
         
-        print("✅ YOLO model loaded successfully!")
+        YOLO_MODEL_LOAD.observe(time.perf_counter() - started)
+        print(f"✅ YOLO model loaded successfully! ({backend.description}, {backend.threads} threads)")
         return True
         
+    except ArtifactError as e:
+        print(f"❌ YOLO model files unavailable: {e}")
+        return False
     except Exception as e:
         print(f"❌ Error loading YOLO model: {e}")
         return False
 
-def detect_bottles_yolo(image_data):
-    """Detect bottles in image using YOLO"""
-    global yolo_net, yolo_classes, yolo_output_layers
+def detect_bottles_yolo(image_data, profile=DEFAULT_PROFILE, tiling=None):
+    """Detect bottles in image using YOLO, preprocessed per the kiosk's camera ``profile``
+    
+    With ``tiling`` (services.preprocessing.Tiling), large images are also run
+    as overlapping tiles, batched through the model, and merged by one NMS.
+    """
+    global yolo_net, yolo_classes
     
     if yolo_net is None:
         return [], 0, 0.0
     
     try:
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with span("yolo.decode", bytes=len(image_data)):
+            nparr = np.frombuffer(image_data, np.uint8)
+            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
         if img is None:
             return [], 0, 0.0
         
-        height, width, channels = img.shape
-        
-        # YOLO detection
-        blob = cv2.dnn.blobFromImage(img, 0.00392, (608, 608), (0, 0, 0), True, crop=False)
-        yolo_net.setInput(blob)
-        outputs = yolo_net.forward(yolo_output_layers)
+        # The kiosk's ROI letterboxed to its input size, plus tiles of it for big photos
+        size = profile.input_size if yolo_net.dynamic_input else yolo_net.input_size
+        with span("yolo.preprocess"):
+            frames = tile_frames(img, profile, size, tiling)
+        batch = tiling.batch if tiling else 1
         
         boxes = []
         confidences = []
@@ -100,36 +81,44 @@ def detect_bottles_yolo(image_data):
         bottle_classes = ['bottle', 'cup', 'wine glass']
         bottle_class_ids = [yolo_classes.index(cls) for cls in bottle_classes if cls in yolo_classes]
         
-        for output in outputs:
-            for detection in output:
-                scores = detection[5:]
-                class_id = int(np.argmax(scores))
-                confidence = float(scores[class_id])
-                
-                if class_id in bottle_class_ids and confidence > 0.15:  # Lower threshold for better detection
-                    center_x = int(detection[0] * width)
-                    center_y = int(detection[1] * height)
-                    w = int(detection[2] * width)
-                    h = int(detection[3] * height)
-                    
-                    x = int(center_x - w / 2)
-                    y = int(center_y - h / 2)
+        for start in range(0, len(frames), batch):
+            chunk = frames[start:start + batch]
+            blob = np.concatenate([frame.blob for frame in chunk]) if len(chunk) > 1 else chunk[0].blob
+            
+            with span("yolo.forward", frames=len(chunk)):
+                outputs = yolo_net.forward(blob)
+            
+            with span("yolo.postprocess"):
+                for frame, rows in zip(chunk, outputs):
+                    scores = rows[:, 5:]
+                    row_class_ids = scores.argmax(axis=1)
+                    row_confidences = scores[np.arange(len(rows)), row_class_ids]
+                    # Lower threshold for better detection
+                    candidates = np.isin(row_class_ids, bottle_class_ids) & (row_confidences > 0.15)
                     
-                    if w > 15 and h > 15 and x >= 0 and y >= 0:
-                        boxes.append([x, y, w, h])
-                        confidences.append(confidence)
-                        class_ids.append(class_id)
+                    for detection, class_id, confidence in zip(
+                        rows[candidates], row_class_ids[candidates], row_confidences[candidates]
+                    ):
+                        class_id, confidence = int(class_id), float(confidence)
+                        # Back to original-frame pixels
+                        x, y, w, h = frame.to_frame(*detection[:4])
                         
-                        detections.append({
-                            'class': yolo_classes[class_id],
-                            'confidence': round(confidence * 100, 1),
-                            'box': [x, y, w, h]
-                        })
+                        if w > 15 and h > 15 and x >= 0 and y >= 0 and not frame.cut_by_tile_edge(x, y, w, h):
+                            boxes.append([x, y, w, h])
+                            confidences.append(confidence)
+                            class_ids.append(class_id)
+                            
+                            detections.append({
+                                'class': yolo_classes[class_id],
+                                'confidence': round(confidence * 100, 1),
+                                'box': [x, y, w, h]
+                            })
         
         # Apply NMS
         final_detections = []
         if len(boxes) > 0:
-            indexes = cv2.dnn.NMSBoxes(boxes, confidences, 0.15, 0.4)
+            with span("yolo.nms", boxes=len(boxes)):
+                indexes = cv2.dnn.NMSBoxes(boxes, confidences, 0.15, 0.4)
             if len(indexes) > 0:
                 for i in indexes.flatten():
                     final_detections.append(detections[i])
@@ -197,28 +186,36 @@ def detect_bottles():
     
     try:
         if 'image' not in request.files:
-            return jsonify({'error': 'No image uploaded'}), 400
+            return respond({'error': 'No image uploaded'}, 400)
         
         file = request.files['image']
         if file.filename == '':
-            return jsonify({'error': 'No image selected'}), 400
+            return respond({'error': 'No image selected'}, 400)
         
         # Check file size (max 10MB)
         file_size = len(file.read())
         file.seek(0)
         if file_size > 10 * 1024 * 1024:
-            return jsonify({'error': 'File too large. Maximum size is 10MB.'}), 400
+            return respond({'error': 'File too large. Maximum size is 10MB.'}, 400)
         
         image_data = file.read()
         
-        # Initialize YOLO if not loaded
-        if yolo_net is None:
-            print("Loading YOLO model...")
-            if not load_yolo_model():
-                return jsonify({'error': 'Failed to load YOLO model'}), 500
+        with YOLO_INFLIGHT.track_inprogress():
+            # Initialize YOLO if not loaded
+            if yolo_net is None:
+                print("Loading YOLO model...")
+                if not load_yolo_model():
+                    return respond({'error': 'Failed to load YOLO model'}, 500)
+            
+            # Detect bottles
+            with YOLO_INFERENCE.time():
+                profile = profile_for(current_app.config, kiosk_device(), kiosk_fleet())
+                tiling = tiling_from_config(current_app.config)
+                detections, bottle_count, avg_confidence = detect_bottles_yolo(image_data, profile, tiling)
         
-        # Detect bottles
-        detections, bottle_count, avg_confidence = detect_bottles_yolo(image_data)
+        # Kiosks only need the count; skip boxes and the base64 JPEG
+        if wants_compact():
+            return respond({'bottle_count': bottle_count, 'avg_confidence': avg_confidence})
         
         # Create visualization
         visualization = create_detection_visualization(image_data, detections)
@@ -234,11 +231,11 @@ def detect_bottles():
         if visualization:
             response_data['visualization'] = visualization
         
-        return jsonify(response_data)
+        return respond(response_data)
         
     except Exception as e:
         print(f"Error in bottle detection: {e}")
-        return jsonify({'error': f'Detection failed: {str(e)}'}), 500
+        return respond({'error': f'Detection failed: {str(e)}'}, 500)
 
 @bottle_detection_bp.route('/model-status', methods=['GET'])
 def model_status():
@@ -246,5 +243,6 @@ def model_status():
     global yolo_net
     return jsonify({
         'ready': yolo_net is not None,
+        'backend': yolo_net.description if yolo_net is not None else None,
         'message': 'YOLO model ready' if yolo_net is not None else 'YOLO model not loaded'
     })
\ No newline at end of file
@@ -1,15 +1,92 @@
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify
 from auth.firebase import firebase_required, kiosk_only
+from auth.kiosk_session import issue_session
+from auth.principal import load_principal
 from models import User, Wallet, Transaction
-from extensions import db, limiter
+from extensions import db, limiter, balance_cache, deposit_guard, event_broker, leaderboard, pricing, read_router
+from ratelimit import kiosk_fleet
+from services.preprocessing import kiosk_device
+from services.idempotency import best_effort, idempotent, mark_committed
+from services.pricing import kiosk_region
+from services.read_routing import replica_reads
+from services.wire import request_payload, respond, wants_compact
+from sqlalchemy import update
+from datetime import datetime
+from functools import partial
+import uuid
 
 deposit_bp = Blueprint("deposit", __name__)
 
-MATERIAL_RATES = {"plastic": 5, "aluminum": 10}
+def _quote(material):
+    """Rate in effect for `material` at this kiosk's region / fleet (in-memory), or None."""
+    if not material or not isinstance(material, str):
+        return None
+    return pricing.quote(material, region=kiosk_region(), fleet=kiosk_fleet())
+
+def _invalid_material():
+    materials = ' or '.join(f'"{m}"' for m in pricing.snapshot().materials)
+    return respond({'error': f'Invalid material. Must be {materials}'}, 400)
+
+def _held(current_user, units, amount_cents):
+    """429 response if a velocity rule holds this deposit (services/deposit_guard.py), else None.
+    
+    Flagged deposits go through; the guard logs and counts them.
+    """
+    verdict = deposit_guard.screen(current_user.id, kiosk_device(), units, amount_cents)
+    if verdict is None or verdict.action != 'hold':
+        return None
+    response = respond({'error': 'Deposit held for review', 'held': True, 'rule': verdict.rule}, 429)
+    response.headers['Retry-After'] = str(verdict.retry_after)
+    return response
+
+def _apply_deposit(current_user, material, units, amount_cents, rate_version):
+    """Insert the transaction and credit the wallet by id; no ORM User or Wallet is loaded.
+    
+    Records the kiosk device and region the deposit came from (for
+    services/rollups.py). Returns the transaction and new wallet as dicts,
+    after commit; nothing after the commit can raise, so a retry never
+    credits the deposit twice.
+    """
+    now = datetime.utcnow()
+    transaction = Transaction(
+        id=uuid.uuid4(),
+        user_id=current_user.id,
+        wallet_id=current_user.wallet_id,
+        transaction_type='deposit',
+        material=material,
+        units=units,
+        amount_cents=amount_cents,
+        rate_version=rate_version,
+        device_id=kiosk_device(),
+        region=kiosk_region(),
+        created_at=now
+    )
+    transaction_dict = transaction.to_dict()     # before commit expires it
+    db.session.add(transaction)
+    
+    # Atomic UPDATE … SET balance_cents = balance_cents + n RETURNING the new balance
+    balance_cents, updated_at, version = db.session.execute(
+        update(Wallet)
+        .where(Wallet.id == current_user.wallet_id)
+        .values(balance_cents=Wallet.balance_cents + amount_cents, updated_at=now, version=Wallet.version + 1)
+        .returning(Wallet.balance_cents, Wallet.updated_at, Wallet.version)
+    ).one()
+    db.session.commit()
+    mark_committed(transaction=transaction_dict, new_balance_cents=balance_cents)
+    
+    wallet_dict = Wallet.serialize(current_user.wallet_id, balance_cents, updated_at)
+    best_effort(
+        partial(read_router.note_write, current_user.id),
+        partial(balance_cache.store, current_user.id, wallet_dict, version),
+        partial(event_broker.publish_wallet_update, current_user.id, wallet_dict, 'transaction', transaction_dict),
+        partial(leaderboard.record, current_user.id, units, now),
+    )
+    return transaction_dict, wallet_dict
 
 @deposit_bp.route("/deposit", methods=["POST"])
 @firebase_required
-@limiter.limit("5 per second", key_func=lambda: f"deposit:{g.current_user.id}")
+@limiter.limit("5 per second")      # per user: keyed by ratelimit.identity_key
+@idempotent
 def create_deposit(current_user):
     """Create a deposit transaction - supports Firebase auth, test bypass, and kiosk ID"""
     data = request.get_json()
@@ -21,8 +98,9 @@ def create_deposit(current_user):
     units = data.get('units')
     
     # Validation
-    if not material or material not in MATERIAL_RATES:
-        return jsonify({'error': 'Invalid material. Must be "plastic" or "aluminum"'}), 400
+    quote = _quote(material)
+    if quote is None:
+        return _invalid_material()
     
     if not isinstance(units, int) or units <= 0:
         return jsonify({'error': 'Units must be a positive integer'}), 400
@@ -31,105 +109,81 @@ def create_deposit(current_user):
         return jsonify({'error': 'Maximum 1000 units per deposit'}), 400
     
     # Calculate amount
-    amount_cents = units * MATERIAL_RATES[material]
+    amount_cents = units * quote.rate_cents
     
-    # Get or create wallet
-    wallet = Wallet.query.filter_by(user_id=current_user.id).first()
-    if not wallet:
-        wallet = Wallet(user_id=current_user.id)
-        db.session.add(wallet)
-        db.session.flush()  # Get the wallet ID
-    
-    # Create transaction
-    transaction = Transaction(
-        user_id=current_user.id,
-        wallet_id=wallet.id,
-        transaction_type='deposit',
-        material=material,
-        units=units,
-        amount_cents=amount_cents
-    )
-    db.session.add(transaction)
-    
-    # Update wallet balance
-    wallet.balance_cents += amount_cents
+    held = _held(current_user, units, amount_cents)
+    if held is not None:
+        return held
     
     try:
-        db.session.commit()
-        return jsonify({
-            'success': True,
-            'transaction': transaction.to_dict(),
-            'new_balance_cents': wallet.balance_cents,
-            'new_balance_dollars': wallet.balance_cents / 100,
-            'user_info': {
-                'email': current_user.email,
-                'kiosk_id': current_user.kiosk_id
-            }
-        }), 201
+        transaction, wallet_dict = _apply_deposit(current_user, material, units, amount_cents, quote.rate_version)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Database error occurred'}), 500
+    
+    return jsonify({
+        'success': True,
+        'transaction': transaction,
+        'new_balance_cents': wallet_dict['balance_cents'],
+        'new_balance_dollars': wallet_dict['balance_dollars'],
+        'user_info': {
+            'email': current_user.email,
+            'kiosk_id': current_user.kiosk_id
+        }
+    }), 201
 
 @deposit_bp.route("/deposit/kiosk", methods=["POST"])
 @kiosk_only
-@limiter.limit("10 per second", key_func=lambda: f"kiosk_deposit:{g.current_user.id}")
+@limiter.limit("10 per second")     # per user behind the kiosk
+@idempotent
 def create_kiosk_deposit(current_user):
     """Create a deposit transaction - kiosk-only endpoint that only accepts kiosk ID"""
-    data = request.get_json()
+    data = request_payload()
     
     if not data:
-        return jsonify({'error': 'JSON body required'}), 400
+        return respond({'error': 'Request body required'}, 400)
     
     material = data.get('material')
     units = data.get('units')
     
     # Validation
-    if not material or material not in MATERIAL_RATES:
-        return jsonify({'error': 'Invalid material. Must be "plastic" or "aluminum"'}), 400
+    quote = _quote(material)
+    if quote is None:
+        return _invalid_material()
     
     if not isinstance(units, int) or units <= 0:
-        return jsonify({'error': 'Units must be a positive integer'}), 400
+        return respond({'error': 'Units must be a positive integer'}, 400)
     
     if units > 1000:
-        return jsonify({'error': 'Maximum 1000 units per deposit'}), 400
+        return respond({'error': 'Maximum 1000 units per deposit'}, 400)
     
     # Calculate amount
-    amount_cents = units * MATERIAL_RATES[material]
-    
-    # Get or create wallet
-    wallet = Wallet.query.filter_by(user_id=current_user.id).first()
-    if not wallet:
-        wallet = Wallet(user_id=current_user.id)
-        db.session.add(wallet)
-        db.session.flush()
-    
-    # Create transaction with kiosk flag
-    transaction = Transaction(
-        user_id=current_user.id,
-        wallet_id=wallet.id,
-        transaction_type='deposit',
-        material=material,
-        units=units,
-        amount_cents=amount_cents
-    )
-    db.session.add(transaction)
+    amount_cents = units * quote.rate_cents
     
-    # Update wallet balance
-    wallet.balance_cents += amount_cents
+    held = _held(current_user, units, amount_cents)
+    if held is not None:
+        return held
     
     try:
-        db.session.commit()
-        return jsonify({
-            'success': True,
-            'message': f'Deposit successful! ${amount_cents/100:.2f} added to account.',
-            'transaction': transaction.to_dict(),
-            'new_balance_cents': wallet.balance_cents,
-            'new_balance_dollars': wallet.balance_cents / 100,
-            'user_email': current_user.email
-        }), 201
+        transaction, wallet_dict = _apply_deposit(current_user, material, units, amount_cents, quote.rate_version)
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': 'Database error occurred'}), 500
+        return respond({'error': 'Database error occurred'}, 500)
+    
+    if wants_compact():
+        return respond({
+            'transaction': Transaction.compact(transaction),
+            'new_balance_cents': wallet_dict['balance_cents']
+        }, 201)
+    
+    return respond({
+        'success': True,
+        'message': f'Deposit successful! ${amount_cents/100:.2f} added to account.',
+        'transaction': transaction,
+        'new_balance_cents': wallet_dict['balance_cents'],
+        'new_balance_dollars': wallet_dict['balance_dollars'],
+        'user_email': current_user.email
+    }, 201)
 
 @deposit_bp.route("/user/kiosk-id", methods=["GET"])
 @firebase_required
@@ -142,32 +196,43 @@ def get_user_kiosk_id(current_user):
     }), 200
     
 @deposit_bp.route("/validate-kiosk-id", methods=["POST"])
+@replica_reads
 def validate_kiosk_id():
     """Validate if a kiosk ID exists - public endpoint for kiosk validation"""
-    data = request.get_json()
+    data = request_payload()
     
     if not data:
-        return jsonify({'error': 'JSON body required'}), 400
+        return respond({'error': 'Request body required'}, 400)
     
     kiosk_id = data.get('kiosk_id')
     
-    if not kiosk_id:
-        return jsonify({'error': 'kiosk_id is required'}), 400
+    if not kiosk_id or not isinstance(kiosk_id, str):
+        return respond({'error': 'kiosk_id is required'}, 400)
     
     if len(kiosk_id) != 8:
-        return jsonify({'error': 'kiosk_id must be 8 characters'}), 400
+        return respond({'error': 'kiosk_id must be 8 characters'}, 400)
     
     # Check if user exists with this kiosk ID
-    user = User.query.filter_by(kiosk_id=kiosk_id.upper()).first()
+    user = load_principal("kiosk_id", kiosk_id.upper())
     
     if not user:
-        return jsonify({'error': 'Invalid kiosk ID'}), 404
+        return respond({'error': 'Invalid kiosk ID'}, 404)
     
-    return jsonify({
+    # Optional stateless session: later kiosk requests send it as X-Kiosk-Session
+    session = {}
+    if data.get('issue_session') is True:
+        token, ttl = issue_session(user)
+        session = {'session_token': token, 'session_expires_in': ttl}
+    
+    if wants_compact():
+        return respond({'valid': True, 'user_email': user.email, **session}, 200)
+    
+    return respond({
         'valid': True,
         'user_email': user.email,
-        'message': f'Kiosk ID validated for {user.email}'
-    }), 200
+        'message': f'Kiosk ID validated for {user.email}',
+        **session
+    }, 200)
     """Validate if a kiosk ID exists - public endpoint for kiosk validation"""
     data = request.get_json()
     
@@ -0,0 +1,53 @@
+# routes/leaderboard.py
+import re
+import uuid
+
+from flask import Blueprint, jsonify, request
+from auth.firebase import firebase_required
+from extensions import db, leaderboard
+from models import User
+from services.leaderboard import WINDOWS, week_bounds
+from services.read_routing import replica_reads
+
+leaderboard_bp = Blueprint("leaderboard", __name__)
+
+WEEK = re.compile(r"^\d{4}-W\d{2}$")
+
+def _display_name(email):
+    """`al***@example.com`: enough to recognise yourself, not enough to contact anyone."""
+    local, _, domain = (email or "").partition("@")
+    return f"{local[:2]}***@{domain}" if domain else "***"
+
+@leaderboard_bp.route("/leaderboard")
+@firebase_required
+@replica_reads
+def get_leaderboard(current_user):
+    """Top recyclers by units, this week (default) or all-time, plus the caller's rank"""
+    window = request.args.get("window", "week")
+    if window not in WINDOWS:
+        return jsonify(error=f"window must be one of {', '.join(WINDOWS)}"), 400
+    period = request.args.get("week")
+    if period is not None:
+        try:
+            if window != "week" or not WEEK.match(period):
+                raise ValueError(period)
+            week_bounds(period)
+        except ValueError:
+            return jsonify(error="week must look like 2025-W38 (window=week only)"), 400
+        if not leaderboard.kept(period):
+            return jsonify(error="Leaderboards are only kept for recent weeks, up to the current one"), 404
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
+
+    standings = leaderboard.standings(window, current_user.id, limit, period)
+    ids = [uuid.UUID(member) for member, _ in standings["leaders"]]
+    emails = dict(db.session.query(User.id, User.email).filter(User.id.in_(ids)).all()) if ids else {}
+    return jsonify(
+        window=window,
+        period=standings["period"],
+        total=standings["total"],
+        leaders=[
+            {"rank": rank, "name": _display_name(emails.get(user_id)), "units": units, "you": user_id == current_user.id}
+            for rank, (user_id, (_, units)) in enumerate(zip(ids, standings["leaders"]), 1)
+        ],
+        me={"rank": standings["rank"], "units": standings["units"]},
+    )
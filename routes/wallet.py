@@ -1,26 +1,67 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, current_app, jsonify, request
 from auth.firebase import firebase_required
+from extensions import db, balance_cache, event_broker
 from models import Wallet
-from extensions import db
+from services.events import format_sse
+from services.partitions import history_window_start
+from services.read_routing import replica_reads
+import queue
 
 wallet_bp = Blueprint('wallet', __name__)
 
+def _cached_wallet(user):
+    """Cache entry for the user's wallet; on a miss, one primary-key lookup."""
+    cached = balance_cache.get(user.id)
+    if cached is None:
+        wallet = db.session.get(Wallet, user.wallet_id)
+        cached = balance_cache.store(user.id, wallet.to_dict(), wallet.version)
+    return cached
+
 @wallet_bp.route('/wallet', methods=['GET'])
 @firebase_required
 def get_wallet(current_user):
-    """Get current user's wallet balance"""
-    wallet = Wallet.query.filter_by(user_id=current_user.id).first()
+    """Get current user's wallet balance (cached; supports If-None-Match)"""
+    cached = _cached_wallet(current_user)
+    
+    headers = {'ETag': f'"{cached["etag"]}"', 'Cache-Control': 'private, no-cache'}
+    if request.if_none_match.contains(cached['etag']):
+        return '', 304, headers
+    
+    return jsonify(cached['wallet']), 200, headers
+
+@wallet_bp.route('/wallet/stream', methods=['GET'])
+@firebase_required
+def stream_wallet(current_user):
+    """Server-Sent Events: `balance`, `transaction` and `withdrawal` updates for the current user"""
+    user_id = current_user.id
+    snapshot = _cached_wallet(current_user)['wallet']
+    db.session.close()               # the stream itself never touches the database
+    
+    heartbeat = current_app.config['WALLET_STREAM_HEARTBEAT_SECONDS']
+    subscription = event_broker.subscribe(user_id)
     
-    if not wallet:
-        # Create wallet if it doesn't exist
-        wallet = Wallet(user_id=current_user.id)
-        db.session.add(wallet)
-        db.session.commit()
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            yield format_sse('balance', snapshot)
+            while True:
+                try:
+                    event = subscription.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event['type'], event['data'])
+        finally:
+            event_broker.unsubscribe(user_id, subscription)
     
-    return jsonify(wallet.to_dict()), 200
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',       # don't let nginx buffer the stream
+    })
 
 @wallet_bp.route('/transactions', methods=['GET'])
 @firebase_required
+@replica_reads
 def get_transactions(current_user):
     """Get user's transaction history"""
     from flask import request
@@ -28,10 +69,16 @@ def get_transactions(current_user):
     
     limit = min(int(request.args.get('limit', 50)), 100)
     
-    transactions = Transaction.query.filter_by(user_id=current_user.id)\
-        .order_by(Transaction.created_at.desc())\
-        .limit(limit)\
-        .all()
+    # Bounded by created_at so Postgres only scans the newest monthly partitions;
+    # older ones are read only when the recent window holds fewer than `limit`.
+    since = history_window_start()
+    history = Transaction.query.filter_by(user_id=current_user.id)\
+        .order_by(Transaction.created_at.desc())
+    transactions = history.filter(Transaction.created_at >= since).limit(limit).all()
+    if len(transactions) < limit:
+        transactions += history.filter(Transaction.created_at < since)\
+            .limit(limit - len(transactions))\
+            .all()
     
     return jsonify({
         'transactions': [t.to_dict() for t in transactions],
@@ -40,6 +87,7 @@ def get_transactions(current_user):
 
 @wallet_bp.route('/withdrawals', methods=['GET'])
 @firebase_required
+@replica_reads
 def get_withdrawals(current_user):
     """Get user's withdrawal history"""
     from flask import request
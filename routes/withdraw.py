@@ -1,22 +1,24 @@
 # routes/withdraw.py
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, url_for
 from auth.firebase import firebase_required
 from models import Wallet, Withdrawal
-from extensions import db
-import stripe, os
-from datetime import datetime
+from extensions import db, balance_cache, event_broker, read_router
+from services.idempotency import best_effort, idempotent, mark_committed
+from services.read_routing import replica_reads
+from functools import partial
+import uuid
 
 withdraw_bp = Blueprint("withdraw", __name__)
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 
 @withdraw_bp.route("/withdraw", methods=["POST"])
 @firebase_required
+@idempotent
 def create_withdrawal(current_user):
+    """Debit the wallet and queue a payout; workers in services/payouts.py send it."""
     data = request.get_json(silent=True) or {}
     amount_cents = data.get("amount_cents")
     bank_token   = data.get("bank_token")
 
-    # validation (unchanged) ...
     if not isinstance(amount_cents, int) or amount_cents <= 0:
         return jsonify(error="Amount must be a positive integer in cents"), 400
     if amount_cents < 100:
@@ -24,13 +26,18 @@ def create_withdrawal(current_user):
     if not bank_token or not isinstance(bank_token, str):
         return jsonify(error="Bank token required"), 400
 
-    wallet = Wallet.query.filter_by(user_id=current_user.id).first()
+    # Row lock so concurrent withdrawals can't both pass the balance check.
+    wallet = Wallet.query.filter_by(id=current_user.wallet_id).with_for_update().first()
     if not wallet:
+        db.session.rollback()
         return jsonify(error="Wallet not found"), 404
     if wallet.balance_cents < amount_cents:
+        db.session.rollback()
         return jsonify(error="Insufficient balance"), 400
 
+    withdrawal_id = uuid.uuid4()
     withdrawal = Withdrawal(
+        id=withdrawal_id,
         user_id=current_user.id,
         wallet_id=wallet.id,
         amount_cents=amount_cents,
@@ -39,76 +46,42 @@ def create_withdrawal(current_user):
     )
     db.session.add(withdrawal)
     wallet.balance_cents -= amount_cents
-    db.session.commit()            # withdrawal.id now exists
 
-    # ───────────────── Stripe Payout ─────────────────
     try:
-        if stripe.api_key and stripe.api_key.startswith("sk_"):
-            payout = stripe.Payout.create(
-                amount      = amount_cents,
-                currency    = "usd",
-                method      = "standard",          # or "instant"
-                statement_descriptor = "RECYCLETEK",
-                idempotency_key      = f"wd-{withdrawal.id}",
-            )
+        db.session.commit()            # debit + outbox row in one transaction
+    except Exception:
+        db.session.rollback()
+        return jsonify(error="Database error occurred"), 500
+    mark_committed(withdrawal_id=str(withdrawal_id),
+                   status_url=url_for("withdraw.get_withdrawal_status", withdrawal_id=withdrawal_id))
+    wallet_dict = wallet.to_dict()
+    best_effort(
+        partial(read_router.note_write, current_user.id),
+        partial(balance_cache.store, current_user.id, wallet_dict, wallet.version),
+        partial(event_broker.publish_wallet_update, current_user.id, wallet_dict, "withdrawal", withdrawal.to_dict()),
+    )
 
-            withdrawal.status = "completed"
-            
-            # Only set these fields if they exist in your model
-            if hasattr(withdrawal, 'processed_at'):
-                withdrawal.processed_at = datetime.utcnow()
-            if hasattr(withdrawal, 'stripe_reference_id'):
-                withdrawal.stripe_reference_id = payout.id
-            
-            db.session.commit()
+    status_url = url_for("withdraw.get_withdrawal_status", withdrawal_id=withdrawal.id)
+    return jsonify({
+        "success": True,
+        "withdrawal": withdrawal.to_dict(),
+        "status_url": status_url,
+        "new_balance_cents": wallet.balance_cents,
+        "new_balance_dollars": wallet.balance_cents / 100,
+    }), 202, {"Location": status_url}
 
-        else:  # stub mode
-            withdrawal.status = "completed"
-            
-            if hasattr(withdrawal, 'processed_at'):
-                withdrawal.processed_at = datetime.utcnow()
-            if hasattr(withdrawal, 'stripe_reference_id'):
-                withdrawal.stripe_reference_id = f"stub_payout_{withdrawal.id}"
-            
-            db.session.commit()
+@withdraw_bp.route("/withdrawals/<withdrawal_id>", methods=["GET"])
+@firebase_required
+@replica_reads
+def get_withdrawal_status(current_user, withdrawal_id):
+    """Poll a single withdrawal's payout status"""
+    try:
+        withdrawal_uuid = uuid.UUID(withdrawal_id)
+    except ValueError:
+        return jsonify(error="Withdrawal not found"), 404
 
-    except stripe.error.StripeError as se:
-        wallet.balance_cents += amount_cents   # undo debit
-        withdrawal.status = "failed"
-        db.session.commit()
-        current_app.logger.error(f"Stripe payout error: {se}")
-        return jsonify(error="Payout failed"), 500
-    except Exception as e:
-        # Catch any other errors (like database/attribute errors)
-        wallet.balance_cents += amount_cents   # undo debit
-        withdrawal.status = "failed"
-        db.session.commit()
-        current_app.logger.error(f"Withdrawal processing error: {e}")
-        return jsonify(error="Withdrawal processing failed"), 500
+    withdrawal = Withdrawal.query.filter_by(id=withdrawal_uuid, user_id=current_user.id).first()
+    if not withdrawal:
+        return jsonify(error="Withdrawal not found"), 404
 
-    # Safe response construction
-    try:
-        response_data = {
-            "success": True,
-            "withdrawal": {
-                "id": withdrawal.id,
-                "user_id": withdrawal.user_id,
-                "amount_cents": withdrawal.amount_cents,
-                "status": withdrawal.status,
-                "created_at": withdrawal.created_at.isoformat() if hasattr(withdrawal, 'created_at') else None,
-            },
-            "new_balance_cents": wallet.balance_cents,
-            "new_balance_dollars": wallet.balance_cents / 100,
-        }
-        
-        # Add optional fields if they exist
-        if hasattr(withdrawal, 'processed_at') and withdrawal.processed_at:
-            response_data["withdrawal"]["processed_at"] = withdrawal.processed_at.isoformat()
-        if hasattr(withdrawal, 'stripe_reference_id') and withdrawal.stripe_reference_id:
-            response_data["withdrawal"]["stripe_reference_id"] = withdrawal.stripe_reference_id
-        
-        return jsonify(response_data), 201
-        
-    except Exception as e:
-        current_app.logger.error(f"Response construction error: {e}")
-        return jsonify(error="Response construction failed"), 500
\ No newline at end of file
+    return jsonify(withdrawal.to_dict()), 200
@@ -0,0 +1,240 @@
+# services/artifacts.py
+"""Model files (YOLO weights, cfg, class names, ONNX exports), fetched once and verified.
+
+Each artifact is looked up in MODEL_BAKED_DIR (read-only, baked into the
+image) and then MODEL_CACHE_DIR, and a file is used only if its SHA-256
+matches the manifest. A missing file is streamed to ``<name>.part``, resumed
+with a Range request after an interruption, hashed on the way in and renamed
+into place only once the hash matches. A half-written or corrupt file
+therefore never carries the real name. A ``<name>.sha256`` stamp (hash, size,
+mtime) lets later boots skip re-hashing 250 MB. MODEL_OFFLINE=true never
+touches the network. A per-file lock stops workers that boot together from
+downloading twice.
+
+Entries with ``"sha256": null`` are unpinned: the first complete download is
+trusted and stamped. Pin them with ``flask detection fetch --write-manifest``.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+import requests
+
+MANIFEST = {
+    "yolov4.weights": {
+        "url": "https://github.com/AlexeyAB/darknet/releases/download/darknet_yolo_v3_optimal/yolov4.weights",
+        "sha256": None,
+    },
+    "yolov4.cfg": {
+        "url": "https://raw.githubusercontent.com/AlexeyAB/darknet/master/cfg/yolov4.cfg",
+        "sha256": None,
+    },
+    "coco.names": {
+        "url": "https://raw.githubusercontent.com/pjreddie/darknet/master/data/coco.names",
+        "sha256": None,
+    },
+}
+
+CHUNK_BYTES = 1 << 16
+
+
+class ArtifactError(Exception):
+    """An artifact is missing, corrupt or could not be downloaded."""
+
+
+def sha256_file(path):
+    """Hex SHA-256 of ``path``, and the hash object so a resumed download can continue it."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest(), digest
+
+
+def load_manifest(path=None):
+    """Built-in MANIFEST, with entries from the JSON file at ``path`` added or overriding."""
+    manifest = {name: dict(entry) for name, entry in MANIFEST.items()}
+    if path:
+        with open(path) as f:
+            for name, entry in json.load(f).items():
+                manifest[name] = {**manifest.get(name, {}), **entry}
+    return manifest
+
+
+class ArtifactStore:
+    """Resolves artifact names to verified local paths, downloading into the cache when allowed."""
+
+    def __init__(self, config):
+        self.cache_dir = config.get("MODEL_CACHE_DIR") or "yolo_files"
+        self.baked_dir = config.get("MODEL_BAKED_DIR")
+        self.offline = bool(config.get("MODEL_OFFLINE"))
+        self.timeout = float(config.get("MODEL_DOWNLOAD_TIMEOUT_SECONDS", 30))
+        self.retries = int(config.get("MODEL_DOWNLOAD_RETRIES", 5))
+        self.manifest = load_manifest(config.get("MODEL_MANIFEST_FILE"))
+        self.logger = logging.getLogger(__name__)
+
+    # ───────────────────── verification ─────────────────────
+    @staticmethod
+    def _stamp_path(path):
+        return path + ".sha256"
+
+    def _read_stamp(self, path):
+        try:
+            with open(self._stamp_path(path)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_stamp(self, path, digest):
+        st = os.stat(path)
+        stamp = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        tmp = self._stamp_path(path) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(stamp, f)
+        os.replace(tmp, self._stamp_path(path))
+
+    def checksum(self, path):
+        """SHA-256 of ``path``, from its stamp when the stamp still matches the file."""
+        stamp = self._read_stamp(path)
+        st = os.stat(path)
+        if stamp and stamp.get("size") == st.st_size and stamp.get("mtime_ns") == st.st_mtime_ns:
+            return stamp["sha256"]
+        return sha256_file(path)[0]
+
+    def verified(self, name, path, writable=True):
+        """True if ``path`` holds ``name`` intact; hashes only when the stamp doesn't match the file."""
+        if not os.path.isfile(path):
+            return False
+        expected = self.manifest.get(name, {}).get("sha256")
+        st = os.stat(path)
+        stamp = self._read_stamp(path)
+        if (
+            stamp
+            and stamp.get("size") == st.st_size
+            and stamp.get("mtime_ns") == st.st_mtime_ns
+            and (expected is None or stamp.get("sha256") == expected)
+        ):
+            return True
+        if expected is None and not writable:
+            return True                      # baked and unpinned: trust the image
+        digest, _ = sha256_file(path)
+        if expected is None:
+            # unpinned file from before this store (or a changed one): trust on first use
+            self.logger.warning(f"{path} is not pinned in the model manifest; trusting sha256 {digest}")
+        elif digest != expected:
+            self.logger.error(f"Model artifact {path} is corrupt (sha256 {digest}, expected {expected}); ignoring it")
+            return False
+        if writable:
+            self._write_stamp(path, digest)
+        return True
+
+    # ───────────────────── resolution ─────────────────────
+    def path(self, name):
+        """Local path of a verified copy of ``name``, downloading it unless offline."""
+        if self.baked_dir:
+            baked = os.path.join(self.baked_dir, name)
+            if self.verified(name, baked, writable=os.access(self.baked_dir, os.W_OK)):
+                return baked
+        cached = os.path.join(self.cache_dir, name)
+        if self.verified(name, cached):
+            return cached
+        if self.offline:
+            raise ArtifactError(f"{name} not found intact in {self.baked_dir or self.cache_dir} (MODEL_OFFLINE)")
+        if "url" not in self.manifest.get(name, {}):
+            raise ArtifactError(f"{name} is not in the model manifest and not present locally")
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(cached + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)             # another worker may be mid-download
+            if not self.verified(name, cached):
+                self._download(name, cached)
+        return cached
+
+    # ───────────────────── download ─────────────────────
+    def _download(self, name, dest):
+        entry = self.manifest[name]
+        part = dest + ".part"
+        for attempt in range(1, self.retries + 1):
+            try:
+                digest = self._fetch(entry["url"], part)
+                break
+            except (requests.RequestException, OSError) as e:
+                if attempt == self.retries:
+                    raise ArtifactError(f"Downloading {name} failed after {attempt} attempts: {e}") from e
+                delay = min(2 ** attempt, 30)
+                self.logger.warning(f"Downloading {name} interrupted ({e}); resuming in {delay}s")
+                time.sleep(delay)
+
+        expected = entry.get("sha256")
+        if expected and digest != expected:
+            os.remove(part)                          # can't be resumed into something valid
+            raise ArtifactError(f"{name} failed verification: sha256 {digest}, expected {expected}")
+        if not expected:
+            self.logger.warning(f"{name} is not pinned in the manifest; trusting sha256 {digest}")
+        os.replace(part, dest)
+        self._write_stamp(dest, digest)
+        self.logger.info(f"Model artifact {name} ready ({os.path.getsize(dest)} bytes, sha256 {digest})")
+
+    def _fetch(self, url, part):
+        """Stream ``url`` into ``part``, resuming from its current size; returns the hex SHA-256."""
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416 and offset:
+                # Range past the end: the part file is already complete (or garbage); re-check from scratch
+                os.remove(part)
+                return self._fetch(url, part)
+            response.raise_for_status()
+            if offset and response.status_code == 206:
+                _, digest = sha256_file(part)
+                mode = "ab"
+            else:
+                offset, digest, mode = 0, hashlib.sha256(), "wb"      # server ignored the Range
+            total = response.headers.get("Content-Length")
+            expected_size = offset + int(total) if total is not None else None
+
+            with open(part, mode) as f:
+                for chunk in response.iter_content(CHUNK_BYTES):
+                    f.write(chunk)
+                    digest.update(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        if expected_size is not None and os.path.getsize(part) != expected_size:
+            raise requests.ConnectionError(f"short read: {os.path.getsize(part)} of {expected_size} bytes")
+        return digest.hexdigest()
+
+
+def fetch(config, names=(), directory=None):
+    """Download and verify ``names`` (default: every manifest file with a URL).
+
+    With ``directory`` they go there instead of MODEL_CACHE_DIR, ignoring
+    MODEL_BAKED_DIR, e.g. to bake them into an image. Returns ``{name:
+    {"url", "sha256", "path"}}``, ready to pin as a MODEL_MANIFEST_FILE.
+    """
+    config = dict(config, MODEL_OFFLINE=False)
+    if directory:
+        config.update(MODEL_CACHE_DIR=directory, MODEL_BAKED_DIR=None)
+    store = ArtifactStore(config)
+    names = names or [name for name, entry in store.manifest.items() if entry.get("url")]
+    fetched = {}
+    for name in names:
+        path = store.path(name)
+        fetched[name] = {"url": store.manifest.get(name, {}).get("url"), "sha256": store.checksum(path), "path": path}
+    return fetched
+
+
+if __name__ == "__main__":
+    # Without the Flask app (and its secrets), for image builds:
+    #     python -m services.artifacts /opt/models [NAME ...]
+    import sys
+
+    from config import Config
+
+    if len(sys.argv) < 2:
+        sys.exit("usage: python -m services.artifacts DIR [NAME ...]")
+    logging.basicConfig(level=logging.INFO)
+    for name, entry in fetch(vars(Config), sys.argv[2:], sys.argv[1]).items():
+        print(f"{entry['path']}  {entry['sha256']}")
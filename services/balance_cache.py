@@ -0,0 +1,162 @@
+# services/balance_cache.py
+"""Short-TTL cache of `Wallet.to_dict()` keyed by user_id.
+
+Two tiers: a per-process LRU with a few seconds of TTL, and optionally Redis
+so that a deposit handled by one gunicorn worker is visible to the others.
+Every code path that changes `balance_cents` calls `store()` or `invalidate()`
+right after its commit, so the TTL only bounds staleness from writes made
+outside the app.
+
+Entries carry `Wallet.version`, which every balance change bumps, and both
+tiers only replace an entry with a newer one: a `/wallet` miss that read the
+row before a deposit committed, or two deposits finishing out of order, can't
+put an older balance back (compare-and-set in Redis by a Lua script). Writes
+that could not reach Redis are remembered and their keys deleted once it is
+back, so it never serves a balance this worker has superseded.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+
+def wallet_etag(wallet_dict):
+    """Strong ETag for a serialized wallet; changes whenever balance or updated_at does."""
+    raw = f"{wallet_dict['id']}:{wallet_dict['balance_cents']}:{wallet_dict['updated_at']}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+# SET the entry unless the cached one has a higher version; 1 if written.
+STORE_IF_NEWER = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ok, cached = pcall(cjson.decode, current)
+    if ok and tonumber(cached['version'] or 0) > tonumber(ARGV[1]) then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class BalanceCache:
+    """Flask-extension style: create at import, configure with ``init_app``."""
+
+    REDIS_RETRY_SECONDS = 30     # back off this long after a Redis error
+
+    def __init__(self, app=None):
+        self._local = OrderedDict()          # user_id → (expires_at, entry)
+        self._lock = threading.Lock()
+        self._redis = None
+        self._store_if_newer = None
+        self._redis_down_until = 0.0
+        self._unsynced = set()              # user_ids whose last store() missed Redis
+        self.ttl = 5
+        self.redis_ttl = 60
+        self.max_entries = 10000
+        self.enabled = True
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("BALANCE_CACHE_ENABLED", True)
+        self.ttl = app.config.get("BALANCE_CACHE_TTL_SECONDS", self.ttl)
+        self.redis_ttl = app.config.get("BALANCE_CACHE_REDIS_TTL_SECONDS", self.redis_ttl)
+        self.max_entries = app.config.get("BALANCE_CACHE_MAX_ENTRIES", self.max_entries)
+        if app.config.get("BALANCE_CACHE_REDIS"):
+            self._redis = redis.Redis.from_url(
+                app.config["REDIS_URL"], socket_connect_timeout=0.05, socket_timeout=0.05
+            )
+            self._store_if_newer = self._redis.register_script(STORE_IF_NEWER)
+        self.logger = app.logger
+        app.extensions["balance_cache"] = self
+
+    # ───────────────────── tiers ─────────────────────
+    @staticmethod
+    def _key(user_id):
+        return f"wallet:balance:{user_id}"
+
+    def _redis_call(self, fn, *args, **kwargs):
+        if self._redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        try:
+            if self._unsynced:
+                self._drop_unsynced()
+            return fn(*args, **kwargs)
+        except redis.RedisError as e:
+            self._redis_down_until = time.monotonic() + self.REDIS_RETRY_SECONDS
+            self.logger.warning(f"Balance cache Redis tier disabled for {self.REDIS_RETRY_SECONDS}s: {e}")
+            return None
+
+    def _drop_unsynced(self):
+        """Delete the Redis entries of balances stored while Redis was unreachable."""
+        with self._lock:
+            user_ids, self._unsynced = self._unsynced, set()
+        try:
+            self._redis.delete(*(self._key(user_id) for user_id in user_ids))
+        except redis.RedisError:
+            with self._lock:
+                self._unsynced |= user_ids
+            raise
+
+    def _put_local(self, user_id, entry):
+        with self._lock:
+            current = self._local.get(user_id)
+            if current and current[1].get("version", 0) > entry.get("version", 0):
+                return current[1]
+            self._local[user_id] = (time.monotonic() + self.ttl, entry)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+        return entry
+
+    # ───────────────────── public API ─────────────────────
+    def get(self, user_id):
+        """Cached ``{"wallet": {...}, "etag": ..., "version": ...}`` or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            hit = self._local.get(user_id)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+
+        raw = self._redis_call(self._redis.get, self._key(user_id)) if self._redis else None
+        if raw:
+            entry = json.loads(raw)
+            self._put_local(user_id, entry)
+            return entry
+        return None
+
+    def store(self, user_id, wallet_dict, version):
+        """Write-through after a committed balance change (or a cache miss); returns the entry kept.
+
+        ``version`` is the `Wallet.version` read with ``wallet_dict``; an entry
+        with a higher one is left in place and returned instead.
+        """
+        entry = {"wallet": wallet_dict, "etag": wallet_etag(wallet_dict), "version": version}
+        if not self.enabled:
+            return entry
+        kept = self._put_local(user_id, entry)
+        if self._redis:
+            written = self._redis_call(self._store_if_newer, keys=[self._key(user_id)],
+                                       args=[version, json.dumps(entry), self.redis_ttl])
+            if written is None:
+                with self._lock:
+                    self._unsynced.add(user_id)
+        return kept
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._local.pop(user_id, None)
+        if self._redis:
+            self._redis_call(self._redis.delete, self._key(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
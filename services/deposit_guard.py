@@ -0,0 +1,281 @@
+# services/deposit_guard.py
+"""Velocity rules on the deposit stream, checked in process memory.
+
+Each rule counts units, cents and deposits per user or per kiosk device
+(``X-Kiosk-Device-ID``) over a sliding window, kept as a ring of SLOTS
+buckets (window / SLOTS seconds each) in one ``array('q')`` per key.
+`DepositGuard.screen` runs before a deposit is applied. If the deposit would
+push a window past a limit, the rule's action decides: ``flag`` lets it
+through and logs it, ``hold`` refuses it until the window drains. Either way
+it is counted in deposit_anomalies_total. Held deposits are not counted in
+the windows.
+
+With DEPOSIT_GUARD_REDIS, a background thread pushes each worker's new counts
+to Redis every DEPOSIT_GUARD_SYNC_SECONDS and pulls back what the other
+workers added for the keys this one tracks, so limits hold across workers.
+The hot path never waits on Redis; the other workers' share is up to one
+sync interval old.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+import redis
+
+from monitoring.metrics import DEPOSIT_ANOMALIES
+
+SLOTS = 16
+SCOPES = ("user", "kiosk")
+ACTIONS = ("flag", "hold")
+
+Rule = namedtuple("Rule", "name scope window max_units max_cents max_count action")
+Verdict = namedtuple("Verdict", "rule action retry_after")
+
+DEFAULT_RULES = [
+    {"name": "user-minute-units", "scope": "user", "window": 60, "max_units": 3000, "action": "flag"},
+    {"name": "user-hour-cents", "scope": "user", "window": 3600, "max_cents": 50000, "action": "hold"},
+    {"name": "kiosk-minute-deposits", "scope": "kiosk", "window": 60, "max_count": 120, "action": "flag"},
+]
+
+
+def parse_rules(raw):
+    """`Rule`s from DEPOSIT_GUARD_RULES entries (a JSON string or a list of dicts)."""
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    rules = []
+    for entry in raw:
+        rule = Rule(
+            entry["name"],
+            entry.get("scope", "user"),
+            float(entry["window"]),
+            int(entry.get("max_units") or 0),
+            int(entry.get("max_cents") or 0),
+            int(entry.get("max_count") or 0),
+            entry.get("action", "flag"),
+        )
+        if rule.scope not in SCOPES or rule.action not in ACTIONS or rule.window <= 0:
+            raise ValueError(f"Invalid deposit guard rule {entry}: scope {SCOPES}, action {ACTIONS}, window > 0")
+        if not (rule.max_units or rule.max_cents or rule.max_count):
+            raise ValueError(f"Deposit guard rule {rule.name} sets no max_units / max_cents / max_count")
+        rules.append(rule)
+    return tuple(rules)
+
+
+class Window:
+    """One key's counts under one rule: SLOTS buckets of (units, cents, deposits) plus running totals."""
+
+    __slots__ = ("ring", "head", "totals", "others")
+
+    def __init__(self, epoch):
+        self.ring = array("q", bytes(8 * 3 * SLOTS))
+        self.head = epoch                    # bucket number (time // bucket width) of the newest slot
+        self.totals = array("q", (0, 0, 0))
+        self.others = (0, 0, 0)              # other workers' totals, from the last sync
+
+    def advance(self, epoch):
+        """Expire the buckets that fell out of the window by bucket ``epoch``."""
+        ring, totals = self.ring, self.totals
+        for e in range(self.head + 1, min(epoch, self.head + SLOTS) + 1):
+            i = (e % SLOTS) * 3
+            totals[0] -= ring[i]
+            totals[1] -= ring[i + 1]
+            totals[2] -= ring[i + 2]
+            ring[i] = ring[i + 1] = ring[i + 2] = 0
+        self.head = epoch
+
+    def add(self, units, cents, count):
+        i = (self.head % SLOTS) * 3
+        ring, totals = self.ring, self.totals
+        ring[i] += units
+        ring[i + 1] += cents
+        ring[i + 2] += count
+        totals[0] += units
+        totals[1] += cents
+        totals[2] += count
+
+
+class DepositGuard:
+    """Flask-extension style: create at import, configure with ``init_app``."""
+
+    REDIS_RETRY_SECONDS = 5
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.rules = ()
+        self._widths = ()                    # bucket width (s) per rule
+        self.sync_seconds = 1.0
+        self.max_keys = 100000
+        self._windows = {}                   # (rule index, key) → Window
+        self._pending = {}                   # (rule index, key, epoch) → [units, cents, deposits] not yet in Redis
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._syncer = None
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("DEPOSIT_GUARD_ENABLED", True)
+        self.set_rules(parse_rules(app.config.get("DEPOSIT_GUARD_RULES") or DEFAULT_RULES))
+        self.sync_seconds = app.config.get("DEPOSIT_GUARD_SYNC_SECONDS", self.sync_seconds)
+        self.max_keys = app.config.get("DEPOSIT_GUARD_MAX_KEYS", self.max_keys)
+        if app.config.get("DEPOSIT_GUARD_REDIS"):
+            self._redis = redis.Redis.from_url(
+                app.config["REDIS_URL"], socket_connect_timeout=0.05, socket_timeout=0.05
+            )
+        self.logger = app.logger
+        app.extensions["deposit_guard"] = self
+
+    def set_rules(self, rules):
+        with self._lock:
+            self.rules = tuple(rules)
+            self._widths = tuple(rule.window / SLOTS for rule in self.rules)
+            self._windows.clear()                # indexes refer to the old rules
+            self._pending.clear()
+
+    # ───────────────────── hot path ─────────────────────
+    def screen(self, user_id, device, units, cents, now=None):
+        """Check a deposit against every rule and count it unless held.
+
+        Returns the `Verdict` of the strictest rule it breaks (hold over
+        flag), or None.
+        """
+        if not self.enabled:
+            return None
+        now = time.time() if now is None else now    # wall clock: bucket numbers must agree across workers
+        user_key = str(user_id)
+        verdict = None
+        with self._lock:
+            for index, rule in enumerate(self.rules):
+                key = user_key if rule.scope == "user" else device
+                if key is None:
+                    continue
+                epoch = int(now // self._widths[index])
+                window = self._windows.get((index, key))
+                if window is None:
+                    if len(self._windows) >= self.max_keys:
+                        self._prune(now)
+                    window = self._windows[(index, key)] = Window(epoch)
+                elif epoch > window.head:
+                    window.advance(epoch)
+                totals, others = window.totals, window.others
+                if (
+                    (rule.max_units and totals[0] + others[0] + units > rule.max_units)
+                    or (rule.max_cents and totals[1] + others[1] + cents > rule.max_cents)
+                    or (rule.max_count and totals[2] + others[2] + 1 > rule.max_count)
+                ) and (verdict is None or (rule.action == "hold" and verdict.action == "flag")):
+                    verdict = Verdict(rule.name, rule.action, math.ceil(self._widths[index]))
+                window.add(units, cents, 1)
+                if self._redis is not None:
+                    self._note_pending(index, key, epoch, units, cents, 1)
+
+            if verdict is not None and verdict.action == "hold":
+                self._uncount(user_key, device, units, cents)
+
+        if self._redis is not None and (self._syncer is None or not self._syncer.is_alive()):
+            self._ensure_syncer()
+        if verdict is not None:
+            DEPOSIT_ANOMALIES.labels(verdict.rule, verdict.action).inc()
+            self.logger.warning(
+                f"Deposit {verdict.action}: rule {verdict.rule}, user {user_id}, device {device}, "
+                f"{units} units / {cents} cents"
+            )
+        return verdict
+
+    def _note_pending(self, index, key, epoch, units, cents, count):
+        delta = self._pending.get((index, key, epoch))
+        if delta is None:
+            delta = self._pending[(index, key, epoch)] = [0, 0, 0]
+        delta[0] += units
+        delta[1] += cents
+        delta[2] += count
+
+    def _uncount(self, user_key, device, units, cents):
+        """Take back a held deposit, counted optimistically by `screen` (holds are rare)."""
+        for index, rule in enumerate(self.rules):
+            key = user_key if rule.scope == "user" else device
+            window = self._windows.get((index, key))
+            if window is not None:
+                window.add(-units, -cents, -1)
+                if self._redis is not None:
+                    self._note_pending(index, key, window.head, -units, -cents, -1)
+
+    def _prune(self, now):
+        """Drop keys with nothing left in their window; if that's not enough, the oldest half."""
+        for (index, key), window in list(self._windows.items()):
+            if window.head + SLOTS <= int(now // self._widths[index]) and window.others == (0, 0, 0):
+                del self._windows[(index, key)]
+        if len(self._windows) >= self.max_keys:
+            for index_key in list(self._windows)[: len(self._windows) // 2]:
+                del self._windows[index_key]
+
+    # ───────────────────── Redis sync ─────────────────────
+    def _key(self, index, key):
+        return f"deposit_guard:{self.rules[index].name}:{key}"
+
+    def _redis_call(self, fn, *args):
+        if self._redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        try:
+            return fn(*args)
+        except redis.RedisError as e:
+            self._redis_down_until = time.monotonic() + self.REDIS_RETRY_SECONDS
+            self.logger.warning(f"Deposit guard running per-worker for {self.REDIS_RETRY_SECONDS}s: {e}")
+            return None
+
+    def _ensure_syncer(self):
+        with self._lock:
+            if self._syncer is None or not self._syncer.is_alive():     # also after a fork
+                self._syncer = threading.Thread(target=self._sync_loop, name="deposit-guard-sync", daemon=True)
+                self._syncer.start()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_seconds)
+            try:
+                self.sync()
+            except Exception as e:  # noqa: BLE001 – keep syncing
+                self.logger.warning(f"Deposit guard sync failed: {e}")
+
+    def sync(self, now=None):
+        """Push this worker's new counts to Redis and pull the other workers' totals."""
+        now = time.time() if now is None else now
+        epochs = [int(now // width) for width in self._widths]
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            tracked = []
+            for (index, key), window in self._windows.items():
+                if epochs[index] > window.head:
+                    window.advance(epochs[index])        # own totals as of ``now``, like the fleet sums below
+                tracked.append((index, key, window, tuple(window.totals)))
+
+        pipe = self._redis.pipeline(transaction=False)
+        for (index, key, epoch), (units, cents, count) in pending.items():
+            name = self._key(index, key)
+            pipe.hincrby(name, f"{epoch}:u", units)
+            pipe.hincrby(name, f"{epoch}:c", cents)
+            pipe.hincrby(name, f"{epoch}:n", count)
+            pipe.expire(name, math.ceil(self.rules[index].window * 2))
+        for index, key, _, _ in tracked:
+            pipe.hgetall(self._key(index, key))
+        replies = self._redis_call(pipe.execute)
+
+        with self._lock:
+            if replies is None:
+                # Redis unavailable: these counts stay local; stop trusting the old remote view
+                for _, _, window, _ in tracked:
+                    window.others = (0, 0, 0)
+                return
+            for (index, key, window, own), fields in zip(tracked, replies[len(replies) - len(tracked):]):
+                first = epochs[index] - SLOTS + 1
+                fleet = [0, 0, 0]
+                for field, value in fields.items():
+                    epoch, kind = field.split(b":")
+                    if int(epoch) >= first:
+                        fleet[b"ucn".index(kind)] += int(value)
+                window.others = tuple(max(0, total - mine) for total, mine in zip(fleet, own))
@@ -0,0 +1,127 @@
+# services/events.py
+"""Per-user wallet event fan-out for the `/wallet/stream` SSE endpoint.
+
+Writers call `publish()` right after their commit. With WALLET_EVENTS_REDIS on,
+events go through one Redis pub/sub channel and a listener in every worker
+hands them to that worker's local subscribers; otherwise (or while Redis is
+unreachable) they are dispatched in-process only. Subscribers are plain
+queues, so an idle stream is a blocked `queue.get()` – no DB, and under gevent
+no OS thread.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+import redis
+
+from monitoring.metrics import WALLET_STREAM_DROPPED, WALLET_STREAM_SUBSCRIBERS
+
+
+def format_sse(event_type, data):
+    """One Server-Sent Events frame."""
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class EventBroker:
+    """Flask-extension style: create at import, configure with ``init_app``."""
+
+    CHANNEL = "wallet-events"
+    REDIS_RETRY_SECONDS = 5
+
+    def __init__(self, app=None):
+        self._subscribers = {}               # str(user_id) → set of queues
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_url = None
+        self._redis_down_until = 0.0
+        self._listener = None
+        self.queue_size = 100
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.queue_size = app.config.get("WALLET_STREAM_QUEUE_SIZE", self.queue_size)
+        if app.config.get("WALLET_EVENTS_REDIS"):
+            self._redis_url = app.config["REDIS_URL"]
+            self._redis = redis.Redis.from_url(self._redis_url, socket_connect_timeout=0.05, socket_timeout=0.05)
+        self.logger = app.logger
+        app.extensions["event_broker"] = self
+
+    # ───────────────────── subscribers ─────────────────────
+    def subscribe(self, user_id):
+        """Register a queue that receives ``{"type", "data"}`` dicts for ``user_id``."""
+        if self._redis is not None:
+            self._ensure_listener()
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(str(user_id), set()).add(q)
+        WALLET_STREAM_SUBSCRIBERS.inc()
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            queues = self._subscribers.get(str(user_id))
+            if queues is not None:
+                queues.discard(q)
+                if not queues:
+                    del self._subscribers[str(user_id)]
+        WALLET_STREAM_SUBSCRIBERS.dec()
+
+    def _dispatch(self, message):
+        with self._lock:
+            queues = list(self._subscribers.get(message["user_id"], ()))
+        event = {"type": message["type"], "data": message["data"]}
+        for q in queues:
+            try:
+                q.put_nowait(event)
+            except queue.Full:               # slow client: drop its oldest event
+                try:
+                    q.get_nowait()
+                    WALLET_STREAM_DROPPED.inc()
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait(event)
+                except queue.Full:           # refilled by a concurrent publisher: drop this one
+                    WALLET_STREAM_DROPPED.inc()
+
+    # ───────────────────── publishing ─────────────────────
+    def publish(self, user_id, event_type, data):
+        message = {"user_id": str(user_id), "type": event_type, "data": data}
+        if self._redis is not None and time.monotonic() >= self._redis_down_until:
+            try:
+                self._redis.publish(self.CHANNEL, json.dumps(message, default=str))
+                return
+            except redis.RedisError as e:
+                self._redis_down_until = time.monotonic() + self.REDIS_RETRY_SECONDS
+                self.logger.warning(f"Wallet events falling back to in-process delivery: {e}")
+        self._dispatch(message)
+
+    def publish_wallet_update(self, user_id, wallet_dict, event_type=None, payload=None):
+        """Publish the change itself (transaction / withdrawal) followed by the new balance."""
+        if event_type is not None:
+            self.publish(user_id, event_type, payload)
+        self.publish(user_id, "balance", wallet_dict)
+
+    # ───────────────────── Redis listener ─────────────────────
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name="wallet-events", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        # Separate connection without a read timeout: it blocks in listen().
+        client = redis.Redis.from_url(self._redis_url, health_check_interval=30)
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CHANNEL)
+                for item in pubsub.listen():
+                    self._dispatch(json.loads(item["data"]))
+            except redis.RedisError as e:
+                self.logger.warning(f"Wallet events listener reconnecting: {e}")
+                time.sleep(self.REDIS_RETRY_SECONDS)
@@ -0,0 +1,184 @@
+# services/idempotency.py
+"""`Idempotency-Key` support for the mutating endpoints (/deposit, /deposit/kiosk, /withdraw).
+
+A client that may retry sends a unique key per logical request. The first
+request with a key claims it by inserting a row in `idempotency_keys`
+(INSERT … ON CONFLICT DO NOTHING, committed before the handler runs), runs
+the handler and stores its response on the row. A retry finds the row and
+gets the stored response back, with ``Idempotent-Replayed: true``, without
+the handler running again: no wallet update, no insert, no Stripe call. A
+duplicate that arrives while the first is still in flight polls the row for up
+to IDEMPOTENCY_WAIT_SECONDS and then replays, or gets 409 if it is still
+running. The claim lives in the database, not Redis, because it is what
+stops a double-apply and must survive a cache outage or eviction.
+
+Keys are scoped to the authenticated user and expire after
+IDEMPOTENCY_TTL_SECONDS (`flask idempotency purge` deletes expired rows).
+Reusing a key for a different method, path or body is a 422. Responses that
+say nothing was applied are not stored and the key is released, so the retry
+runs for real: 5xx, 409 and 429 (rate limited, held). Once a handler has
+committed its ledger write it calls ``mark_committed()`` with the committed
+row; from then on the response is stored whatever its status, and post-commit
+side effects go through ``best_effort()`` so a cache or stream outage can't
+turn the applied change into an error. Should the handler still raise, the
+request and its retries get 200 with ``applied: true`` and that row instead of
+the handler's 201/202. A claim left in flight by a crashed worker answers 409
+until it expires, since it cannot tell whether the change was applied.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Response, current_app, g, request
+from sqlalchemy import delete, update
+
+from auth.principal import insert_ignore
+from extensions import db
+from models import IdempotencyKey
+from monitoring.metrics import IDEMPOTENCY_REQUESTS
+from services.wire import respond
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+RETRYABLE = {409, 429}                   # plus every 5xx
+
+
+def mark_committed(**committed):
+    """Record that the current request's ledger write has committed; its key is kept from here on.
+
+    ``committed`` (the new row, as JSON-ready values) is what the client is
+    told if the handler fails after this point.
+    """
+    g.idempotency_committed = committed
+
+
+def best_effort(*effects):
+    """Run post-commit side effects (zero-argument callables), logging instead of raising."""
+    for effect in effects:
+        try:
+            effect()
+        except Exception as e:  # noqa: BLE001 – the change itself is already committed
+            name = getattr(getattr(effect, "func", effect), "__qualname__", repr(effect))
+            current_app.logger.warning(f"Post-commit {name} failed: {e}")
+
+
+def request_hash():
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _claim(user_id, key, fingerprint, now):
+    claimed = insert_ignore(
+        IdempotencyKey,
+        ("user_id", "key"),
+        user_id=user_id,
+        key=key,
+        request_hash=fingerprint,
+        created_at=now,
+        expires_at=now + timedelta(seconds=current_app.config["IDEMPOTENCY_TTL_SECONDS"]),
+    )
+    db.session.commit()
+    return bool(claimed)
+
+
+def _release(user_id, key):
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key))
+    db.session.commit()
+
+
+def _store(user_id, key, response):
+    db.session.rollback()                # whatever the handler left uncommitted is not part of its response
+    db.session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        .values(status_code=response.status_code, content_type=response.content_type,
+                response_body=response.get_data())
+    )
+    db.session.commit()
+
+
+def _applied(committed):
+    """Stand-in response for a change that committed but whose handler then failed."""
+    IDEMPOTENCY_REQUESTS.labels("applied_fallback").inc()
+    return respond({"applied": True, "error": "Applied, but the full response was lost", **committed}, 200)
+
+
+def _replay(row):
+    response = Response(row.response_body, status=row.status_code, content_type=row.content_type)
+    response.headers["Idempotent-Replayed"] = "true"
+    response.vary.add("Accept")
+    return response
+
+
+def idempotent(view):
+    """Honour `Idempotency-Key` on a mutating view; place directly above the view, below auth."""
+
+    @wraps(view)
+    def wrapped(current_user, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(current_user, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return respond({"error": f"{HEADER} must be 1-{MAX_KEY_LENGTH} characters"}, 400)
+
+        user_id, fingerprint = current_user.id, request_hash()
+        deadline = time.monotonic() + current_app.config["IDEMPOTENCY_WAIT_SECONDS"]
+        pause = 0.01
+        while not _claim(user_id, key, fingerprint, datetime.utcnow()):
+            row = db.session.get(IdempotencyKey, (user_id, key), populate_existing=True)
+            db.session.commit()              # don't hold a snapshot while waiting
+            if row is None:
+                continue                         # released since our insert: claim again
+            if row.expires_at <= datetime.utcnow():
+                _release(user_id, key)
+                continue
+            if row.request_hash != fingerprint:
+                IDEMPOTENCY_REQUESTS.labels("mismatch").inc()
+                return respond({"error": f"{HEADER} was already used for a different request"}, 422)
+            if row.status_code is not None:
+                IDEMPOTENCY_REQUESTS.labels("replayed").inc()
+                return _replay(row)
+            if time.monotonic() >= deadline:
+                IDEMPOTENCY_REQUESTS.labels("in_flight").inc()
+                response = respond({"error": f"A request with this {HEADER} is still in progress"}, 409)
+                response.headers["Retry-After"] = "1"
+                return response
+            time.sleep(pause)
+            pause = min(pause * 2, 0.25)
+
+        g.pop("idempotency_committed", None)
+        try:
+            response = current_app.make_response(view(current_user, *args, **kwargs))
+        except Exception:
+            committed = g.pop("idempotency_committed", None)
+            if committed is None:
+                _release(user_id, key)
+                raise
+            current_app.logger.exception(f"{HEADER} {key!r}: handler failed after committing")
+            response = _applied(committed)
+        else:
+            committed = g.pop("idempotency_committed", None)
+            if committed is not None and response.status_code >= 500:
+                current_app.logger.error(f"{HEADER} {key!r}: handler answered {response.status_code} after committing")
+                response = _applied(committed)
+        if committed is None and (response.status_code >= 500 or response.status_code in RETRYABLE):
+            _release(user_id, key)
+            IDEMPOTENCY_REQUESTS.labels("released").inc()
+        else:
+            _store(user_id, key, response)
+            IDEMPOTENCY_REQUESTS.labels("stored").inc()
+        return response
+
+    return wrapped
+
+
+def purge_expired(now=None):
+    """Delete expired keys; returns how many."""
+    deleted = db.session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.expires_at <= (now or datetime.utcnow()))
+    ).rowcount
+    db.session.commit()
+    return deleted
@@ -0,0 +1,203 @@
+# services/inference.py
+"""Inference backends for bottle detection: OpenCV DNN or ONNX Runtime.
+
+Both take an NCHW blob from ``cv2.dnn.blobFromImage`` (one image or a batch
+of tiles) and return one array of YOLO region rows per image (cx, cy, w, h,
+objectness, class scores…, normalised to the input), so
+routes/bottle_detection.py post-processes either the same way. ``input_size``
+is the default square input; backends with ``dynamic_input`` accept other
+multiples of 32 (services/preprocessing.py profiles).
+
+Every gunicorn worker runs its own copy of the model. The intra-op thread
+pool of each is sized to the CPUs available divided by the number of workers
+(DETECTION_THREADS overrides), so N workers no longer start N pools as wide as
+the machine and fight over the cores.
+"""
+import os
+
+import cv2
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:  # optional: only needed for DETECTION_BACKEND=onnxruntime
+    onnxruntime = None
+
+OPENCV_BACKENDS = {
+    "default": cv2.dnn.DNN_BACKEND_DEFAULT,
+    "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+    "openvino": cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+    "cuda": cv2.dnn.DNN_BACKEND_CUDA,
+}
+OPENCV_TARGETS = {
+    "cpu": cv2.dnn.DNN_TARGET_CPU,
+    "cpu_fp16": cv2.dnn.DNN_TARGET_CPU_FP16,
+    "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+    "opencl_fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+    "cuda": cv2.dnn.DNN_TARGET_CUDA,
+    "cuda_fp16": cv2.dnn.DNN_TARGET_CUDA_FP16,
+}
+
+
+# ───────────────────────── thread sizing ──────────────────────────────
+def available_cpus():
+    """CPUs this process may run on (respects cgroup / taskset affinity)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+
+def worker_count():
+    """Processes sharing the machine: set by gunicorn.conf.py, else WEB_CONCURRENCY."""
+    return max(1, int(os.environ.get("GUNICORN_WORKERS") or os.environ.get("WEB_CONCURRENCY") or 1))
+
+
+def intra_op_threads(config):
+    """DETECTION_THREADS if set, else this worker's share of the CPUs."""
+    configured = int(config.get("DETECTION_THREADS") or 0)
+    if configured > 0:
+        return configured
+    return max(1, available_cpus() // worker_count())
+
+
+# ───────────────────────── backends ───────────────────────────────────
+def split_batch(outputs, n):
+    """Raw model outputs for an ``n``-image batch → one ``(rows, 5 + classes)`` array per image."""
+    per_image = [output.reshape(n, -1, output.shape[-1]) for output in outputs]
+    return [np.concatenate([output[i] for output in per_image]) for i in range(n)]
+
+
+class OpenCVBackend:
+    """Darknet weights through ``cv2.dnn`` with an explicit backend and target."""
+
+    name = "opencv"
+
+    def __init__(self, weights_path, config_path, backend="opencv", target="cpu", threads=1, input_size=608):
+        if backend not in OPENCV_BACKENDS or target not in OPENCV_TARGETS:
+            raise ValueError(
+                f"Unknown OpenCV backend/target {backend}/{target}; "
+                f"backends: {', '.join(OPENCV_BACKENDS)}, targets: {', '.join(OPENCV_TARGETS)}"
+            )
+        cv2.setNumThreads(threads)
+        self.threads = threads
+        self.input_size = input_size
+        self.dynamic_input = True            # darknet graphs accept any multiple of 32
+        self.net = cv2.dnn.readNet(weights_path, config_path)
+        self.net.setPreferableBackend(OPENCV_BACKENDS[backend])
+        self.net.setPreferableTarget(OPENCV_TARGETS[target])
+        layer_names = self.net.getLayerNames()
+        self.output_layers = [layer_names[i - 1] for i in self.net.getUnconnectedOutLayers().flatten()]
+        self.description = f"opencv/{backend}/{target}"
+
+    def forward(self, blob):
+        self.net.setInput(blob)
+        return split_batch(self.net.forward(self.output_layers), len(blob))
+
+
+class OnnxRuntimeBackend:
+    """An ONNX export of the model (e.g. the INT8 one from `flask detection quantize`) on the CPU provider.
+
+    The export must output the same region rows as the darknet model; any
+    anchor/grid dimensions between batch and row are flattened away. Models
+    exported with a fixed batch of 1 run tiles one at a time.
+    """
+
+    name = "onnxruntime"
+
+    def __init__(self, model_path, threads=1):
+        if onnxruntime is None:
+            raise RuntimeError("DETECTION_BACKEND=onnxruntime requires the onnxruntime package")
+        # cv2 still decodes and resizes the image; keep its pool to the same share
+        cv2.setNumThreads(threads)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        size = model_input.shape[-1]
+        self.dynamic_input = not isinstance(size, int)
+        self.input_size = 608 if self.dynamic_input else size
+        self.batched = not isinstance(model_input.shape[0], int) or model_input.shape[0] != 1
+        self.threads = threads
+        self.description = f"onnxruntime/{os.path.basename(model_path)}"
+
+    def forward(self, blob):
+        if not self.batched and len(blob) > 1:
+            return [rows for i in range(len(blob)) for rows in self.forward(blob[i:i + 1])]
+        return split_batch(self.session.run(None, {self.input_name: blob}), len(blob))
+
+
+def create_backend(config, model_dir="yolo_files", resolve=None):
+    """Backend selected by DETECTION_BACKEND, with this worker's thread count.
+
+    ``resolve`` maps a model file name to a local path (e.g.
+    ``services.artifacts.ArtifactStore.path``); by default files are taken
+    from ``model_dir`` as they are. A DETECTION_ONNX_MODEL with a directory
+    in it is used as given.
+    """
+    resolve = resolve or (lambda name: os.path.join(model_dir, name))
+    threads = intra_op_threads(config)
+    kind = config.get("DETECTION_BACKEND", "opencv")
+    if kind == "opencv":
+        return OpenCVBackend(
+            resolve("yolov4.weights"),
+            resolve("yolov4.cfg"),
+            backend=config.get("DETECTION_OPENCV_BACKEND", "opencv"),
+            target=config.get("DETECTION_OPENCV_TARGET", "cpu"),
+            threads=threads,
+        )
+    if kind == "onnxruntime":
+        model = config.get("DETECTION_ONNX_MODEL") or "yolov4.int8.onnx"
+        return OnnxRuntimeBackend(model if os.path.dirname(model) else resolve(model), threads)
+    raise ValueError(f"Unknown DETECTION_BACKEND {kind!r}; use opencv or onnxruntime")
+
+
+# ───────────────────────── INT8 export ────────────────────────────────
+def _calibration_blobs(image_paths, input_size):
+    for path in image_paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            yield cv2.dnn.blobFromImage(img, 0.00392, (input_size, input_size), (0, 0, 0), True, crop=False)
+
+
+def quantize_model(src, dst, calibration_images=()):
+    """Write an INT8 copy of the ONNX model ``src`` to ``dst``.
+
+    With calibration images, activations are quantized too (static, QDQ,
+    per-channel weights) – the fast path on CPU. Without, only weights are
+    (dynamic), which shrinks the file but speeds convolutions up far less.
+    """
+    if onnxruntime is None:
+        raise RuntimeError("Quantization requires the onnxruntime package")
+    from onnxruntime import quantization
+
+    if not calibration_images:
+        quantization.quantize_dynamic(src, dst, weight_type=quantization.QuantType.QInt8)
+        return "dynamic"
+
+    session = onnxruntime.InferenceSession(src, providers=["CPUExecutionProvider"])
+    model_input = session.get_inputs()[0]
+    size = model_input.shape[-1] if isinstance(model_input.shape[-1], int) else 608
+
+    class Reader(quantization.CalibrationDataReader):
+        def __init__(self):
+            self._blobs = _calibration_blobs(calibration_images, size)
+
+        def get_next(self):
+            blob = next(self._blobs, None)
+            return None if blob is None else {model_input.name: blob}
+
+    quantization.quantize_static(
+        src,
+        dst,
+        Reader(),
+        quant_format=quantization.QuantFormat.QDQ,
+        activation_type=quantization.QuantType.QUInt8,
+        weight_type=quantization.QuantType.QInt8,
+        per_channel=True,
+    )
+    return "static"
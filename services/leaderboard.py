@@ -0,0 +1,396 @@
+# services/leaderboard.py
+"""Top recyclers by units deposited: all-time and per ISO week.
+
+Each board is a Redis sorted set (``leaderboard:all``, ``leaderboard:2025-W38``)
+of user_id → units. The deposit path adds to the all-time board and the
+deposit's week with one pipelined ZINCRBY pair after its commit, so reads
+never aggregate `transactions`: top-N is ZREVRANGE and the caller's rank is
+ZREVRANK, O(log n) each, in one round trip.
+
+A board is rebuilt from the ledger in bulk (one GROUP BY user_id, written to a
+scratch key and RENAMEd over the live one) when it has no ``built`` marker,
+i.e. on first use, after Redis lost it, or after this worker saw Redis fail and
+may have dropped increments; `flask leaderboard rebuild` forces it.
+Increments landing between the rebuild's read and the rename are lost
+until the next rebuild. Weekly boards expire LEADERBOARD_WEEKS_KEPT weeks after
+the week ends.
+
+With LEADERBOARD_REDIS off (local runs), or while Redis is unreachable, each
+worker keeps its own boards in memory in a `RankedSet`, the same indexable skip
+list Redis uses, rebuilt from the ledger every LEADERBOARD_MEMORY_REFRESH_SECONDS
+and incremented by the deposits that worker handles.
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+import redis
+from sqlalchemy import text
+
+WINDOWS = ("all", "week")
+REBUILD_CHUNK = 1000
+
+
+def period_of(window, at=None):
+    """Board name for ``window`` at ``at``: ``all`` or the ISO week, e.g. ``2025-W38``."""
+    if window == "all":
+        return "all"
+    year, week, _ = (at or datetime.utcnow()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def week_bounds(period):
+    """``[start, end)`` datetimes of an ISO week period such as ``2025-W38``."""
+    year, week = period.split("-W")
+    start = datetime.combine(date.fromisocalendar(int(year), int(week), 1), datetime.min.time())
+    return start, start + timedelta(days=7)
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [0] * level                 # nodes skipped by next[i], counting next[i] itself
+
+
+class RankedSet:
+    """Member → score with rank queries: an indexable skip list, like a Redis sorted set.
+
+    Ordered by score descending, then member; `rank` and updates are O(log n),
+    `top(n)` is O(log n + n).
+    """
+
+    MAX_LEVEL = 32
+
+    def __init__(self, items=()):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._level = 1
+        self._length = 0                         # nodes in the list
+        self._scores = {}
+        self._random = random.Random()
+        self._bulk_load(items)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def score(self, member):
+        return self._scores.get(member)
+
+    def add(self, member, score):
+        old = self._scores.get(member)
+        if old is not None:
+            self._delete((-old, member))
+        self._scores[member] = score
+        self._insert((-score, member))
+
+    def incr(self, member, delta):
+        score = self._scores.get(member, 0) + delta
+        self.add(member, score)
+        return score
+
+    def rank(self, member):
+        """1-based position of ``member`` (1 = highest score), or None."""
+        score = self._scores.get(member)
+        if score is None:
+            return None
+        key, node, rank = (-score, member), self._head, 0
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key <= key:
+                rank += node.width[i]
+                node = node.next[i]
+        return rank
+
+    def top(self, n):
+        """``[(member, score)]`` for the ``n`` highest scores."""
+        out, node = [], self._head.next[0]
+        while node is not None and len(out) < n:
+            out.append((node.key[1], -node.key[0]))
+            node = node.next[0]
+        return out
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and self._random.random() < 0.25:
+            level += 1
+        return level
+
+    def _bulk_load(self, items):
+        """Link ``items`` in sorted order in one pass: O(n log n) for the sort, instead of n inserts."""
+        self._scores = dict(items)
+        last, last_rank = [self._head] * self.MAX_LEVEL, [0] * self.MAX_LEVEL
+        for rank, key in enumerate(sorted((-score, member) for member, score in self._scores.items()), 1):
+            level = self._random_level()
+            node = _Node(key, level)
+            for i in range(level):
+                last[i].next[i] = node
+                last[i].width[i] = rank - last_rank[i]
+                last[i], last_rank[i] = node, rank
+            self._level = max(self._level, level)
+        self._length = len(self._scores)
+        for i in range(self._level):
+            last[i].width[i] = self._length - last_rank[i]
+
+    def _insert(self, key):
+        update, rank = [None] * self.MAX_LEVEL, [0] * self.MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self._level)):
+            rank[i] = rank[i + 1] if i + 1 < self._level else 0
+            while node.next[i] is not None and node.next[i].key < key:
+                rank[i] += node.width[i]
+                node = node.next[i]
+            update[i] = node
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i], update[i] = 0, self._head
+                self._head.width[i] = self._length
+            self._level = level
+        new = _Node(key, level)
+        for i in range(level):
+            new.next[i] = update[i].next[i]
+            update[i].next[i] = new
+            new.width[i] = update[i].width[i] - (rank[0] - rank[i])
+            update[i].width[i] = rank[0] - rank[i] + 1
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._length += 1
+
+    def _delete(self, key):
+        update, node = [None] * self._level, self._head
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+        target = node.next[0]
+        for i in range(self._level):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._length -= 1
+
+
+def ledger_totals(period):
+    """``[(user_id str, units)]`` for a board, aggregated from the ledger in one query."""
+    from extensions import db
+
+    where, params = "", {}
+    if period != "all":
+        where = "AND created_at >= :start AND created_at < :end"
+        params["start"], params["end"] = week_bounds(period)
+    sql = f"""
+        SELECT user_id, SUM(units) AS units FROM transactions
+        WHERE transaction_type = 'deposit' AND units > 0 {where}
+        GROUP BY user_id
+    """
+    if period == "all" and db.session.get_bind().dialect.name == "postgresql" and db.session.execute(
+        text("SELECT to_regclass('transactions_archive') IS NOT NULL")
+    ).scalar():
+        # months folded away by `flask partitions maintain` still count all-time
+        sql = f"""
+            SELECT user_id, SUM(units) FROM (
+                {sql}
+                UNION ALL
+                SELECT a.user_id, SUM((e->>'units')::bigint)
+                FROM transactions_archive a, jsonb_array_elements(a.entries) e
+                WHERE e->>'transaction_type' = 'deposit'
+                GROUP BY a.user_id
+            ) totals GROUP BY user_id
+        """
+    rows = db.session.execute(text(sql), params).all()
+    return [(str(uuid.UUID(str(user_id))), int(units)) for user_id, units in rows if units]
+
+
+class Leaderboard:
+    """Flask-extension style: create at import, configure with ``init_app``."""
+
+    REDIS_RETRY_SECONDS = 5
+    REBUILD_LOCK_SECONDS = 120
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.weeks_kept = 12
+        self.memory_refresh = 300.0
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._redis_dirty = False                # increments may have been dropped since the last success
+        self._boards = {}                        # period → (built_at, RankedSet), in-memory mode / fallback
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("LEADERBOARD_ENABLED", True)
+        self.weeks_kept = app.config.get("LEADERBOARD_WEEKS_KEPT", self.weeks_kept)
+        self.memory_refresh = app.config.get("LEADERBOARD_MEMORY_REFRESH_SECONDS", self.memory_refresh)
+        if app.config.get("LEADERBOARD_REDIS"):
+            self._redis = redis.Redis.from_url(
+                app.config["REDIS_URL"], socket_connect_timeout=0.05, socket_timeout=0.05
+            )
+        self.logger = app.logger
+        app.extensions["leaderboard"] = self
+
+    # ───────────────────── Redis ─────────────────────
+    @staticmethod
+    def _key(period):
+        return f"leaderboard:{period}"
+
+    def _expire_at(self, period):
+        """Unix time a weekly board expires, LEADERBOARD_WEEKS_KEPT weeks after the week ends."""
+        if period == "all":
+            return None
+        return int((week_bounds(period)[1] + timedelta(weeks=self.weeks_kept) - datetime(1970, 1, 1)).total_seconds())
+
+    def _redis_call(self, fn, *args):
+        if self._redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        try:
+            if self._redis_dirty:
+                self._invalidate_redis()
+            return fn(*args)
+        except redis.RedisError as e:
+            self._redis_down_until = time.monotonic() + self.REDIS_RETRY_SECONDS
+            self._redis_dirty = True
+            self.logger.warning(f"Leaderboard serving per-worker boards for {self.REDIS_RETRY_SECONDS}s: {e}")
+            return None
+
+    def _invalidate_redis(self):
+        """After an outage: drop the live boards' built markers so they are rebuilt, with this worker's lost increments."""
+        self._redis.delete(*(self._key(p) + ":built" for p in ("all", period_of("week"))))
+        self._redis_dirty = False
+        with self._lock:
+            self._boards.clear()
+
+    def _rebuild_redis(self, period, totals):
+        key = self._key(period)
+        scratch = f"{key}:rebuild:{uuid.uuid4().hex}"
+        fill = self._redis.pipeline(transaction=False)
+        for i in range(0, len(totals), REBUILD_CHUNK):
+            fill.zadd(scratch, dict(totals[i:i + REBUILD_CHUNK]))
+        swap = self._redis.pipeline(transaction=True)
+        if totals:
+            swap.rename(scratch, key)
+        else:
+            swap.delete(key)
+        swap.set(key + ":built", 1)
+        expire_at = self._expire_at(period)
+        if expire_at is not None:
+            swap.expireat(key, expire_at)
+            swap.expireat(key + ":built", expire_at)
+        return self._redis_call(lambda: (fill.execute(), swap.execute())) is not None
+
+    def _read_redis(self, period, member, limit):
+        pipe = self._redis.pipeline(transaction=False)
+        key = self._key(period)
+        pipe.exists(key + ":built")
+        pipe.zrevrange(key, 0, limit - 1, withscores=True)
+        pipe.zcard(key)
+        pipe.zrevrank(key, member or "")
+        pipe.zscore(key, member or "")
+        return self._redis_call(pipe.execute)
+
+    def _standings_redis(self, period, member, limit):
+        replies = self._read_redis(period, member, limit)
+        if replies is not None and not replies[0]:
+            lock = self._key(period) + ":lock"
+            if self._redis_call(lambda: self._redis.set(lock, 1, nx=True, ex=self.REBUILD_LOCK_SECONDS)):
+                try:
+                    self._rebuild_redis(period, ledger_totals(period))
+                finally:
+                    self._redis_call(self._redis.delete, lock)
+                replies = self._read_redis(period, member, limit)
+            # else another worker is rebuilding it: serve what's there
+        if replies is None:
+            return None
+        _, leaders, total, rank, units = replies
+        return {
+            "period": period,
+            "total": total,
+            "leaders": [(m.decode(), int(score)) for m, score in leaders],
+            "rank": rank + 1 if member and rank is not None else None,
+            "units": int(units or 0) if member else 0,
+        }
+
+    # ───────────────────── in-memory boards ─────────────────────
+    def _store_memory(self, period, totals):
+        with self._lock:
+            self._boards[period] = (time.monotonic(), RankedSet(totals))
+            for stale in [p for p in self._boards if not self.kept(p)]:
+                del self._boards[stale]
+
+    def _standings_memory(self, period, member, limit):
+        with self._lock:
+            built = self._boards.get(period)
+        if built is None or time.monotonic() - built[0] > self.memory_refresh:
+            self._store_memory(period, ledger_totals(period))
+        with self._lock:
+            board = self._boards[period][1]
+            return {
+                "period": period,
+                "total": len(board),
+                "leaders": board.top(limit),
+                "rank": board.rank(member) if member else None,
+                "units": (board.score(member) or 0) if member else 0,
+            }
+
+    # ───────────────────── public API ─────────────────────
+    def kept(self, period, now=None):
+        """False for weekly boards past LEADERBOARD_WEEKS_KEPT (expired in Redis, never rebuilt) or in the future.
+
+        Future weeks have nothing to show, and building one would leave a Redis
+        board that outlives the week by LEADERBOARD_WEEKS_KEPT.
+        """
+        if period == "all":
+            return True
+        now = now or datetime.utcnow()
+        return period_of("week", now - timedelta(weeks=self.weeks_kept)) <= period <= period_of("week", now)
+
+    def record(self, user_id, units, at=None):
+        """Count a committed deposit on the all-time board and its week's."""
+        if not self.enabled or not units:
+            return
+        member, week = str(user_id), period_of("week", at)
+        if self._redis is not None:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.zincrby(self._key("all"), units, member)
+            pipe.zincrby(self._key(week), units, member)
+            pipe.expireat(self._key(week), self._expire_at(week))
+            if self._redis_call(pipe.execute) is not None:
+                return
+        with self._lock:
+            for period in ("all", week):
+                built = self._boards.get(period)
+                if built is not None:            # not built yet: its rebuild will include this deposit
+                    built[1].incr(member, units)
+
+    def standings(self, window, user_id=None, limit=10, period=None):
+        """Top ``limit`` of a board and the caller's place on it.
+
+        Returns ``{"period", "total", "leaders": [(user_id, units)], "rank",
+        "units"}``; rank is 1-based, None if the caller isn't on the board.
+        """
+        period = period or period_of(window)
+        member = str(user_id) if user_id is not None else None
+        if self._redis is not None:
+            result = self._standings_redis(period, member, limit)
+            if result is not None:
+                return result
+        return self._standings_memory(period, member, limit)
+
+    def rebuild(self, period):
+        """Recompute one board from the ledger now; returns the number of users on it."""
+        if not self.kept(period):
+            return 0
+        totals = ledger_totals(period)
+        if self._redis is None or not self._rebuild_redis(period, totals):
+            self._store_memory(period, totals)
+        return len(totals)
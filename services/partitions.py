@@ -0,0 +1,183 @@
+# services/partitions.py
+"""Monthly range partitions of `transactions` on `created_at` (Postgres only).
+
+Migration c41d8e2a6f93 turns the table into a partitioned parent with one
+partition per calendar month (``transactions_YYYY_MM``) plus
+``transactions_default`` for anything outside them. `maintain()` – run daily
+via ``flask partitions maintain`` – keeps partitions created ahead of time and,
+when asked to, rolls months past retention into `transactions_archive`: one
+row per user and month holding that month's transactions as a TOAST-compressed
+jsonb array.
+"""
+import re
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import NotSupportedError
+
+from extensions import db
+
+PARENT = "transactions"
+DEFAULT_PARTITION = "transactions_default"
+ARCHIVE_TABLE = "transactions_archive"
+_PARTITION_RE = re.compile(r"^transactions_(\d{4})_(\d{2})$")
+
+
+# ────────────────────────── month arithmetic ──────────────────────────
+def month_start(value):
+    """First day of ``value``'s month, as a date."""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_{month.year:04d}_{month.month:02d}"
+
+
+def history_window_start(now=None):
+    """Lower `created_at` bound that confines history reads to the newest partitions."""
+    months = current_app.config.get("TRANSACTION_HISTORY_WINDOW_MONTHS", 3)
+    return datetime.combine(add_months(month_start(now or datetime.utcnow()), 1 - months), datetime.min.time())
+
+
+# ────────────────────────── catalog ───────────────────────────────────
+def is_partitioned():
+    if db.session.get_bind().dialect.name != "postgresql":
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": PARENT}).first() is not None
+
+
+def monthly_partitions():
+    """Months that currently have their own partition, oldest first."""
+    names = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :name AND pg_table_is_visible(p.oid)"
+    ), {"name": PARENT}).scalars()
+    months = []
+    for name in names:
+        match = _PARTITION_RE.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+# ────────────────────────── maintenance ───────────────────────────────
+def create_partition(month):
+    """Add ``month``'s partition, moving any of its rows out of the default partition."""
+    lo, hi = month.isoformat(), add_months(month, 1).isoformat()
+    name = partition_name(month)
+    bounds = {"lo": lo, "hi": hi}
+    stray = db.session.execute(text(
+        f"SELECT count(*) FROM {DEFAULT_PARTITION} WHERE created_at >= :lo AND created_at < :hi"
+    ), bounds).scalar()
+
+    if not stray:
+        db.session.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {PARENT} FOR VALUES FROM ('{lo}') TO ('{hi}')"
+        ))
+    else:
+        # Postgres refuses to add a partition whose range still has rows in the
+        # default partition, so move them into a detached table and attach it.
+        db.session.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        db.session.execute(text(
+            f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE created_at >= :lo AND created_at < :hi"
+        ), bounds)
+        db.session.execute(text(
+            f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :lo AND created_at < :hi"
+        ), bounds)
+        db.session.execute(text(
+            f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM ('{lo}') TO ('{hi}')"
+        ))
+    db.session.commit()
+    return stray
+
+
+def ensure_partitions(months_ahead=None, now=None):
+    """Create partitions from the current month through ``months_ahead`` months out."""
+    if months_ahead is None:
+        months_ahead = current_app.config["TRANSACTION_PARTITION_MONTHS_AHEAD"]
+    existing = set(monthly_partitions())
+    current = month_start(now or datetime.utcnow())
+    created = []
+    for n in range(months_ahead + 1):
+        month = add_months(current, n)
+        if month not in existing:
+            moved = create_partition(month)
+            created.append((partition_name(month), moved))
+    return created
+
+
+def _ensure_archive_table():
+    db.session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+            user_id      uuid    NOT NULL,
+            month        date    NOT NULL,
+            row_count    integer NOT NULL,
+            amount_cents bigint  NOT NULL,
+            entries      jsonb   NOT NULL,
+            PRIMARY KEY (user_id, month)
+        )
+    """))
+    if int(db.session.execute(text("SHOW server_version_num")).scalar()) >= 140000:
+        # lz4 is faster than the default pglz for the (large) entries arrays,
+        # but only if the server was built with it.
+        try:
+            with db.session.begin_nested():
+                db.session.execute(text(f"ALTER TABLE {ARCHIVE_TABLE} ALTER COLUMN entries SET COMPRESSION lz4"))
+        except NotSupportedError:
+            pass
+
+
+def archive_exists():
+    """Whether `transactions_archive` has been created (by the first archived month)."""
+    return db.session.get_bind().dialect.name == "postgresql" and db.session.execute(
+        text(f"SELECT to_regclass('{ARCHIVE_TABLE}') IS NOT NULL")
+    ).scalar()
+
+
+def archive_partition(month):
+    """Fold one month into `transactions_archive` and drop its partition; returns rows moved."""
+    name = partition_name(month)
+    _ensure_archive_table()
+    db.session.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+    moved = db.session.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+    db.session.execute(text(f"""
+        INSERT INTO {ARCHIVE_TABLE} (user_id, month, row_count, amount_cents, entries)
+        SELECT user_id, :month, count(*), sum(amount_cents),
+               jsonb_agg(to_jsonb(t) - 'user_id' ORDER BY created_at)
+        FROM {name} t
+        GROUP BY user_id
+        ON CONFLICT (user_id, month) DO UPDATE SET
+            row_count    = {ARCHIVE_TABLE}.row_count + excluded.row_count,
+            amount_cents = {ARCHIVE_TABLE}.amount_cents + excluded.amount_cents,
+            entries      = {ARCHIVE_TABLE}.entries || excluded.entries
+    """), {"month": month})
+    db.session.execute(text(f"DROP TABLE {name}"))
+    db.session.commit()
+    return moved
+
+
+def archive_partitions(after_months, now=None):
+    """Archive every monthly partition that ended more than ``after_months`` months ago."""
+    cutoff = add_months(month_start(now or datetime.utcnow()), -after_months)
+    return [(partition_name(m), archive_partition(m)) for m in monthly_partitions() if m < cutoff]
+
+
+def maintain(months_ahead=None, archive_after_months=None, now=None):
+    """Daily job: premake partitions, then archive expired months when configured."""
+    if not is_partitioned():
+        raise RuntimeError(f"{PARENT} is not a partitioned table; run `flask db upgrade` on Postgres first")
+    if archive_after_months is None:
+        archive_after_months = current_app.config["TRANSACTION_ARCHIVE_AFTER_MONTHS"]
+    created = ensure_partitions(months_ahead, now)
+    archived = archive_partitions(archive_after_months, now) if archive_after_months else []
+    return created, archived
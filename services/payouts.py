@@ -0,0 +1,549 @@
+# services/payouts.py
+"""Withdrawal outbox: background workers that pay out committed `pending` rows.
+
+`/withdraw` only debits the wallet and inserts a `pending` Withdrawal in one
+commit. Workers here claim those rows with ``FOR UPDATE SKIP LOCKED``, call
+Stripe with the ``wd-{id}`` idempotency key outside any DB transaction, and
+record the outcome. A claimed row whose worker died is re-claimed once its
+lease expires; the idempotency key makes the retried payout safe.
+
+With PAYOUT_AGGREGATE on, workers instead group due withdrawals by bank token
+into a PayoutBatch and send one payout per batch (key ``batch-{id}``); each
+withdrawal keeps its ``batch_id``, and a failed batch refunds every member.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import stripe
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from extensions import db, balance_cache, event_broker
+from models import PayoutBatch, Wallet, Withdrawal
+from monitoring import tracing
+
+stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+
+# Errors worth retrying. Connection errors/timeouts and Stripe 5xx leave the
+# outcome unknown: the payout may exist, so they are retried with the same
+# idempotency key and never refunded automatically.
+TRANSIENT_STRIPE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.RateLimitError,
+    stripe.error.APIError,
+)
+AMBIGUOUS_STRIPE_ERRORS = (stripe.error.APIConnectionError, stripe.error.APIError)
+# Stripe rejected the request, so nothing was paid: fail and refund. Any other
+# error leaves the withdrawal `unknown` for review.
+DEFINITIVE_STRIPE_ERRORS = (
+    stripe.error.CardError,
+    stripe.error.InvalidRequestError,
+    stripe.error.AuthenticationError,
+    stripe.error.PermissionError,
+    stripe.error.IdempotencyError,
+)
+
+
+class TransientPayoutError(Exception):
+    """Payout could not be sent right now; the withdrawal goes back to `pending`.
+
+    ``ambiguous`` means Stripe may have created the payout anyway.
+    """
+
+    def __init__(self, message, ambiguous=False):
+        super().__init__(message)
+        self.ambiguous = ambiguous
+
+
+# ────────────────────────── payout backends ───────────────────────────
+def _stripe_payout(amount_cents, idempotency_key, metadata=None, destination=None):
+    extra = {"destination": destination} if destination else {}
+    payout = stripe.Payout.create(
+        amount      = amount_cents,
+        currency    = "usd",
+        method      = "standard",
+        **extra,
+        statement_descriptor = "RECYCLETEK",
+        metadata    = metadata or {},
+        idempotency_key      = idempotency_key,
+    )
+    return payout.id
+
+
+def _stub_payout(amount_cents, idempotency_key, metadata=None, destination=None):
+    delay_ms = current_app.config.get("PAYOUT_STUB_DELAY_MS", 0)
+    if delay_ms:
+        time.sleep(delay_ms / 1000)
+    return f"stub_payout_{idempotency_key}"
+
+
+def payout_backend():
+    """`stripe` with a live/test secret key, otherwise the local stub."""
+    configured = current_app.config.get("PAYOUT_BACKEND")
+    if configured:
+        return configured
+    return "stripe" if stripe.api_key and stripe.api_key.startswith("sk_") else "stub"
+
+
+def send_payout(amount_cents, idempotency_key, metadata=None, destination=None):
+    """Send one payout to the ``destination`` bank token and return its reference id."""
+    backend = payout_backend()
+    with tracing.span("stripe.payout", backend=backend, amount_cents=amount_cents):
+        if backend == "stripe":
+            try:
+                return _stripe_payout(amount_cents, idempotency_key, metadata, destination)
+            except TRANSIENT_STRIPE_ERRORS as e:
+                raise TransientPayoutError(str(e), ambiguous=isinstance(e, AMBIGUOUS_STRIPE_ERRORS)) from e
+        return _stub_payout(amount_cents, idempotency_key, metadata, destination)
+
+
+# ────────────────────────── outbox processing ─────────────────────────
+def _lease_expired(model, now):
+    """Rows of ``model`` claimed by a worker that died (or hung) mid-payout."""
+    lease_expired = now - timedelta(seconds=current_app.config["PAYOUT_CLAIM_LEASE_SECONDS"])
+    return and_(model.status == "processing", model.claimed_at < lease_expired)
+
+
+def _due(model, now):
+    """Rows of ``model`` ready for a worker: pending and past backoff, or with an expired lease."""
+    return or_(
+        and_(
+            model.status == "pending",
+            or_(model.next_attempt_at.is_(None), model.next_attempt_at <= now),
+        ),
+        _lease_expired(model, now),
+    )
+
+
+def _sent_before():
+    """Withdrawals that may already have reached Stripe under their own ``wd-{id}`` key."""
+    return or_(Withdrawal.attempts > 0, Withdrawal.payout_uncertain.is_(True))
+
+
+def claim_withdrawals(limit, sent_only=False):
+    """Lock up to ``limit`` due rows, mark them `processing` and return their ids.
+
+    ``sent_only`` claims just the rows already tried on their own (retries and
+    expired leases), for aggregate mode: they are finished one by one with
+    their ``wd-{id}`` key instead of being batched.
+    """
+    now = datetime.utcnow()
+    due = and_(_due(Withdrawal, now), _sent_before()) if sent_only else _due(Withdrawal, now)
+    rows = (
+        Withdrawal.query
+        .filter(due, Withdrawal.batch_id.is_(None))
+        .order_by(Withdrawal.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for withdrawal in rows:
+        withdrawal.status = "processing"
+        withdrawal.claimed_at = now
+        withdrawal.attempts = (withdrawal.attempts or 0) + 1
+    db.session.commit()
+    return [w.id for w in rows]
+
+
+def fail_withdrawal(withdrawal, reason):
+    """Mark failed and credit the amount back to the wallet (caller commits)."""
+    wallet = Wallet.query.filter_by(id=withdrawal.wallet_id).with_for_update().first()
+    wallet.balance_cents += withdrawal.amount_cents
+    withdrawal.status = "failed"
+    withdrawal.processed_at = datetime.utcnow()
+    withdrawal.last_error = reason[:255]
+
+
+def hold_withdrawal(withdrawal, reason):
+    """Mark `unknown`: the payout may have been sent, so no refund until reviewed (caller commits)."""
+    withdrawal.status = "unknown"
+    withdrawal.payout_uncertain = True
+    withdrawal.last_error = reason[:255]
+    current_app.logger.error(f"Withdrawal {withdrawal.id} needs review, payout outcome unknown: {reason}")
+
+
+def _refunded(withdrawal):
+    """Post-commit notifications for a failed (and credited back) withdrawal."""
+    wallet = db.session.get(Wallet, withdrawal.wallet_id)
+    wallet_dict = wallet.to_dict()
+    balance_cache.store(withdrawal.user_id, wallet_dict, wallet.version)
+    event_broker.publish_wallet_update(withdrawal.user_id, wallet_dict, "withdrawal", withdrawal.to_dict())
+
+
+def _locked_if_processing(withdrawal_id):
+    withdrawal = Withdrawal.query.filter_by(id=withdrawal_id).with_for_update().first()
+    if withdrawal is None or withdrawal.status != "processing":
+        db.session.rollback()           # finished by another worker meanwhile
+        return None
+    return withdrawal
+
+
+def process_withdrawal(withdrawal_id):
+    """Pay out one claimed withdrawal; returns its final or retry status."""
+    withdrawal = db.session.get(Withdrawal, withdrawal_id)
+    amount_cents, bank_token = withdrawal.amount_cents, withdrawal.bank_token
+    db.session.commit()                 # don't hold a transaction open across the Stripe call
+
+    try:
+        reference = send_payout(amount_cents, f"wd-{withdrawal_id}", destination=bank_token)
+    except TransientPayoutError as e:
+        current_app.logger.warning(f"Payout {withdrawal_id} deferred: {e}")
+        withdrawal = _locked_if_processing(withdrawal_id)
+        if withdrawal is None:
+            return None
+        withdrawal.payout_uncertain = withdrawal.payout_uncertain or e.ambiguous
+        if withdrawal.attempts < current_app.config["PAYOUT_MAX_ATTEMPTS"]:
+            backoff = current_app.config["PAYOUT_RETRY_BACKOFF_SECONDS"] * 2 ** (withdrawal.attempts - 1)
+            withdrawal.status = "pending"
+            withdrawal.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+            withdrawal.last_error = str(e)[:255]
+        elif withdrawal.payout_uncertain:
+            hold_withdrawal(withdrawal, f"gave up after {withdrawal.attempts} attempts: {e}")
+        else:
+            fail_withdrawal(withdrawal, f"gave up after {withdrawal.attempts} attempts: {e}")
+        db.session.commit()
+        if withdrawal.status == "failed":
+            _refunded(withdrawal)
+        return withdrawal.status
+    except DEFINITIVE_STRIPE_ERRORS as e:
+        current_app.logger.error(f"Stripe payout error for {withdrawal_id}: {e}")
+        withdrawal = _locked_if_processing(withdrawal_id)
+        if withdrawal is None:
+            return None
+        if withdrawal.payout_uncertain:     # an earlier attempt may still have paid it
+            hold_withdrawal(withdrawal, str(e))
+            db.session.commit()
+            return withdrawal.status
+        fail_withdrawal(withdrawal, str(e))
+        db.session.commit()
+        _refunded(withdrawal)
+        return withdrawal.status
+    except Exception as e:  # noqa: BLE001 – can't tell whether the payout went out
+        withdrawal = _locked_if_processing(withdrawal_id)
+        if withdrawal is None:
+            return None
+        hold_withdrawal(withdrawal, f"{type(e).__name__}: {e}")
+        db.session.commit()
+        return withdrawal.status
+
+    withdrawal = _locked_if_processing(withdrawal_id)
+    if withdrawal is None:
+        return None
+    withdrawal.status = "completed"
+    withdrawal.processed_at = datetime.utcnow()
+    withdrawal.stripe_payment_intent_id = reference
+    withdrawal.last_error = None
+    db.session.commit()
+    event_broker.publish(withdrawal.user_id, "withdrawal", withdrawal.to_dict())
+    return withdrawal.status
+
+
+def resolve_withdrawal(withdrawal_id, action, reference=None):
+    """Settle an `unknown` withdrawal after checking Stripe; returns its new status, or None.
+
+    ``paid`` records ``reference`` as its payout, ``refund`` fails it and
+    credits the wallet, ``retry`` sends it again with the same ``wd-{id}`` key
+    (only safe while Stripe still remembers the key, 24 hours). Members of a
+    batch are settled through ``resolve_batch``.
+    """
+    withdrawal = Withdrawal.query.filter_by(id=withdrawal_id).with_for_update().first()
+    if withdrawal is None or withdrawal.status != "unknown" or withdrawal.batch_id:
+        db.session.rollback()
+        return None
+    if action == "paid":
+        withdrawal.status = "completed"
+        withdrawal.processed_at = datetime.utcnow()
+        withdrawal.stripe_payment_intent_id = reference
+    elif action == "refund":
+        fail_withdrawal(withdrawal, f"refunded after review: {withdrawal.last_error}")
+    else:
+        withdrawal.status = "pending"
+        withdrawal.attempts = 0
+        withdrawal.next_attempt_at = None
+        withdrawal.payout_uncertain = True      # keeps it on its wd-{id} key, out of batches
+    db.session.commit()
+    if withdrawal.status == "failed":
+        _refunded(withdrawal)
+    else:
+        event_broker.publish(withdrawal.user_id, "withdrawal", withdrawal.to_dict())
+    return withdrawal.status
+
+
+# ────────────────────────── aggregated payouts ────────────────────────
+def form_batches(now=None):
+    """Group due pending withdrawals by bank token into new batches; returns how many.
+
+    A token is due once its oldest pending withdrawal is older than
+    PAYOUT_AGGREGATE_WINDOW_SECONDS; all of its pending withdrawals then go
+    into the batch. Withdrawals already tried on their own are left to
+    ``claim_withdrawals``: paying them under a batch key could pay them twice.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=current_app.config["PAYOUT_AGGREGATE_WINDOW_SECONDS"])
+    unbatched = and_(
+        Withdrawal.status == "pending",
+        Withdrawal.batch_id.is_(None),
+        ~_sent_before(),
+        or_(Withdrawal.next_attempt_at.is_(None), Withdrawal.next_attempt_at <= now),
+    )
+    due_tokens = (
+        db.session.query(Withdrawal.bank_token)
+        .filter(unbatched, Withdrawal.created_at <= cutoff)
+        .distinct()
+    )
+    rows = (
+        Withdrawal.query
+        .filter(unbatched, Withdrawal.bank_token.in_(due_tokens.scalar_subquery()))
+        .order_by(Withdrawal.created_at)
+        .limit(current_app.config["PAYOUT_AGGREGATE_MAX_WITHDRAWALS"])
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    groups = defaultdict(list)
+    for withdrawal in rows:
+        groups[withdrawal.bank_token].append(withdrawal)
+
+    for bank_token, members in groups.items():
+        batch = PayoutBatch(
+            id=uuid.uuid4(),
+            bank_token=bank_token,
+            amount_cents=sum(w.amount_cents for w in members),
+            withdrawal_count=len(members),
+            status="pending",
+        )
+        db.session.add(batch)
+        for withdrawal in members:
+            withdrawal.batch_id = batch.id
+            withdrawal.status = "processing"
+            withdrawal.claimed_at = now
+    db.session.commit()
+    return len(groups)
+
+
+def claim_batches(limit):
+    """`claim_withdrawals` for PayoutBatch rows."""
+    now = datetime.utcnow()
+    rows = (
+        PayoutBatch.query
+        .filter(_due(PayoutBatch, now))
+        .order_by(PayoutBatch.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for batch in rows:
+        batch.status = "processing"
+        batch.claimed_at = now
+        batch.attempts = (batch.attempts or 0) + 1
+    db.session.commit()
+    return [b.id for b in rows]
+
+
+def _locked_batch_if_processing(batch_id):
+    batch = PayoutBatch.query.filter_by(id=batch_id).with_for_update().first()
+    if batch is None or batch.status != "processing":
+        db.session.rollback()
+        return None
+    return batch
+
+
+def _fail_batch(batch, reason):
+    """Mark the batch and every member failed, refunding each wallet (caller commits)."""
+    batch.status = "failed"
+    batch.processed_at = datetime.utcnow()
+    batch.last_error = reason[:255]
+    members = batch.withdrawals.order_by(Withdrawal.wallet_id).all()   # stable lock order
+    for withdrawal in members:
+        fail_withdrawal(withdrawal, reason)
+    return members
+
+
+def _hold_batch(batch, reason):
+    """`hold_withdrawal` for a batch and every member: no refund until reviewed (caller commits)."""
+    batch.status = "unknown"
+    batch.payout_uncertain = True
+    batch.last_error = reason[:255]
+    current_app.logger.error(f"Payout batch {batch.id} needs review, payout outcome unknown: {reason}")
+    members = batch.withdrawals.all()
+    for withdrawal in members:
+        withdrawal.status = "unknown"
+        withdrawal.last_error = reason[:255]
+    return members
+
+
+def process_batch(batch_id):
+    """Pay out one claimed batch; returns its final or retry status."""
+    batch = db.session.get(PayoutBatch, batch_id)
+    amount_cents, bank_token = batch.amount_cents, batch.bank_token
+    metadata = {"payout_batch_id": str(batch_id), "withdrawals": batch.withdrawal_count}
+    db.session.commit()                 # don't hold a transaction open across the Stripe call
+
+    try:
+        reference = send_payout(amount_cents, f"batch-{batch_id}", metadata, destination=bank_token)
+    except TransientPayoutError as e:
+        current_app.logger.warning(f"Payout batch {batch_id} deferred: {e}")
+        batch = _locked_batch_if_processing(batch_id)
+        if batch is None:
+            return None
+        batch.payout_uncertain = batch.payout_uncertain or e.ambiguous
+        if batch.attempts < current_app.config["PAYOUT_MAX_ATTEMPTS"]:
+            backoff = current_app.config["PAYOUT_RETRY_BACKOFF_SECONDS"] * 2 ** (batch.attempts - 1)
+            batch.status = "pending"
+            batch.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+            batch.last_error = str(e)[:255]
+            db.session.commit()
+            return batch.status
+        if batch.payout_uncertain:
+            _hold_batch(batch, f"gave up after {batch.attempts} attempts: {e}")
+            db.session.commit()
+            return batch.status
+        members = _fail_batch(batch, f"gave up after {batch.attempts} attempts: {e}")
+    except DEFINITIVE_STRIPE_ERRORS as e:
+        current_app.logger.error(f"Stripe payout error for batch {batch_id}: {e}")
+        batch = _locked_batch_if_processing(batch_id)
+        if batch is None:
+            return None
+        if batch.payout_uncertain:          # an earlier attempt may still have paid it
+            _hold_batch(batch, str(e))
+            db.session.commit()
+            return batch.status
+        members = _fail_batch(batch, str(e))
+    except Exception as e:  # noqa: BLE001 – can't tell whether the payout went out
+        batch = _locked_batch_if_processing(batch_id)
+        if batch is None:
+            return None
+        _hold_batch(batch, f"{type(e).__name__}: {e}")
+        db.session.commit()
+        return batch.status
+    else:
+        batch = _locked_batch_if_processing(batch_id)
+        if batch is None:
+            return None
+        now = datetime.utcnow()
+        batch.status = "completed"
+        batch.processed_at = now
+        batch.stripe_payout_id = reference
+        batch.last_error = None
+        members = batch.withdrawals.all()
+        for withdrawal in members:
+            withdrawal.status = "completed"
+            withdrawal.processed_at = now
+            withdrawal.stripe_payment_intent_id = reference
+        db.session.commit()
+        for withdrawal in members:
+            event_broker.publish(withdrawal.user_id, "withdrawal", withdrawal.to_dict())
+        return batch.status
+
+    db.session.commit()
+    for withdrawal in members:
+        _refunded(withdrawal)
+    return batch.status
+
+
+def resolve_batch(batch_id, action, reference=None):
+    """`resolve_withdrawal` for an `unknown` batch; settles every member with it."""
+    batch = PayoutBatch.query.filter_by(id=batch_id).with_for_update().first()
+    if batch is None or batch.status != "unknown":
+        db.session.rollback()
+        return None
+    if action == "refund":
+        members = _fail_batch(batch, f"refunded after review: {batch.last_error}")
+        db.session.commit()
+        for withdrawal in members:
+            _refunded(withdrawal)
+        return batch.status
+    members = batch.withdrawals.all()
+    if action == "paid":
+        now = datetime.utcnow()
+        batch.status = "completed"
+        batch.processed_at = now
+        batch.stripe_payout_id = reference
+        for withdrawal in members:
+            withdrawal.status = "completed"
+            withdrawal.processed_at = now
+            withdrawal.stripe_payment_intent_id = reference
+    else:
+        batch.status = "pending"
+        batch.attempts = 0
+        batch.next_attempt_at = None
+        for withdrawal in members:
+            withdrawal.status = "processing"
+    db.session.commit()
+    for withdrawal in members:
+        event_broker.publish(withdrawal.user_id, "withdrawal", withdrawal.to_dict())
+    return batch.status
+
+
+def _process_each(ids, process, label):
+    for item_id in ids:
+        try:
+            with tracing.job(f"{label} {item_id}"):
+                process(item_id)
+        except Exception as e:  # noqa: BLE001 – leave the row for lease expiry
+            db.session.rollback()
+            current_app.logger.error(f"{label} {item_id} processing error: {e}")
+    return len(ids)
+
+
+def process_pending(batch_size=None):
+    """One claim-and-pay pass; returns how many withdrawals and batches were handled."""
+    limit = batch_size or current_app.config["PAYOUT_BATCH_SIZE"]
+    aggregate = current_app.config.get("PAYOUT_AGGREGATE")
+    if aggregate:
+        form_batches()
+    # Batches are drained even with aggregation switched off, so none are stranded,
+    # and withdrawals already tried on their own (retries, dead workers' leases)
+    # keep their wd-{id} key in both modes.
+    handled = _process_each(claim_batches(limit), process_batch, "Payout batch")
+    handled += _process_each(claim_withdrawals(limit, sent_only=aggregate), process_withdrawal, "Withdrawal")
+    return handled
+
+
+# ────────────────────────── worker pool ───────────────────────────────
+class PayoutWorkerPool:
+    """N threads, each looping claim → pay → record until stopped."""
+
+    def __init__(self, app, threads=None, poll_interval=None):
+        self.app = app
+        self.threads = threads or app.config["PAYOUT_WORKER_THREADS"] or 1
+        self.poll_interval = poll_interval or app.config["PAYOUT_POLL_INTERVAL_SECONDS"]
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            handled = 0
+            with self.app.app_context():
+                try:
+                    handled = process_pending()
+                except Exception as e:  # noqa: BLE001 – e.g. DB briefly unavailable
+                    db.session.rollback()
+                    self.app.logger.error(f"Payout worker error: {e}")
+                finally:
+                    db.session.remove()
+            if not handled:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        for i in range(self.threads):
+            t = threading.Thread(target=self._run, name=f"payout-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    def wait(self):
+        """Block until interrupted (used by the CLI)."""
+        try:
+            while any(t.is_alive() for t in self._threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stop()
@@ -0,0 +1,209 @@
+# services/preprocessing.py
+"""Per-kiosk camera profiles: crop to the bin, then letterbox into the model input.
+
+Kiosk cameras are fixed, so each device (``X-Kiosk-Device-ID``) or whole
+fleet (``X-Kiosk-Fleet``) can have a profile in the JSON file named by
+DETECTION_PROFILES_FILE:
+
+    {
+      "default": {"input_size": 608},
+      "fleets":  {"acme": {"roi": [0.25, 0.30, 0.50, 0.60], "input_size": 416}},
+      "devices": {"KSK-0042": {"roi": [0.10, 0.40, 0.45, 0.55], "input_size": 320, "letterbox": true}}
+    }
+
+``roi`` is ``[x, y, w, h]`` as fractions of the frame; ``input_size`` is the
+square network input (a multiple of 32; ignored by fixed-shape ONNX models);
+``letterbox`` (default true when there is a roi) keeps the aspect ratio and
+pads instead of stretching. Boxes come back in original-frame pixels.
+"""
+import json
+import math
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from flask import request
+
+Profile = namedtuple("Profile", "roi input_size letterbox")
+# tile_size / overlap: square tiles in source pixels and the fraction neighbours share;
+# only regions over min_megapixels are tiled, into at most max_tiles, batch tiles per forward pass
+Tiling = namedtuple("Tiling", "tile_size overlap min_megapixels max_tiles batch")
+
+DEFAULT_PROFILE = Profile(roi=None, input_size=608, letterbox=False)   # whole frame, stretched: the old behaviour
+PAD_VALUE = 114
+
+
+def kiosk_device():
+    """Camera a kiosk request comes from, from its `X-Kiosk-Device-ID` header."""
+    device = request.headers.get("X-Kiosk-Device-ID", "").strip()
+    return device or None
+
+
+def parse_profile(raw, base):
+    """`Profile` from one JSON entry; unset fields come from ``base``."""
+    roi = raw.get("roi", base.roi)
+    if roi is not None:
+        roi = tuple(float(v) for v in roi)
+        if len(roi) != 4:
+            raise ValueError(f"roi must be [x, y, w, h], got {list(roi)}")
+        x, y, w, h = roi
+        if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > 1.0001 or y + h > 1.0001:
+            raise ValueError(f"roi must be [x, y, w, h] fractions inside the frame, got {list(roi)}")
+    size = int(raw.get("input_size", base.input_size))
+    if size <= 0 or size % 32:
+        raise ValueError(f"input_size must be a positive multiple of 32, got {size}")
+    return Profile(roi, size, bool(raw.get("letterbox", True if roi is not None else base.letterbox)))
+
+
+@lru_cache(maxsize=4)
+def load_profiles(path, mtime=None):
+    """``(default, {fleet: profile}, {device: profile})`` from ``path``; ``mtime`` keys the cache."""
+    if not path or not os.path.exists(path):
+        return DEFAULT_PROFILE, {}, {}
+    with open(path) as f:
+        raw = json.load(f)
+    default = parse_profile(raw.get("default", {}), DEFAULT_PROFILE)
+    fleets = {k.lower(): parse_profile(v, default) for k, v in raw.get("fleets", {}).items()}
+    devices = {k: parse_profile(v, default) for k, v in raw.get("devices", {}).items()}
+    return default, fleets, devices
+
+
+def profile_for(config, device=None, fleet=None):
+    """Device profile, else fleet profile, else the file's default."""
+    path = config.get("DETECTION_PROFILES_FILE")
+    mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+    default, fleets, devices = load_profiles(path, mtime)
+    if device and device in devices:
+        return devices[device]
+    if fleet and fleet in fleets:
+        return fleets[fleet]
+    return default
+
+
+def tiling_from_config(config):
+    """`Tiling` from DETECTION_TILE_*, or None when DETECTION_TILE_SIZE is 0."""
+    tile_size = int(config.get("DETECTION_TILE_SIZE") or 0)
+    if tile_size <= 0:
+        return None
+    return Tiling(
+        tile_size,
+        float(config.get("DETECTION_TILE_OVERLAP", 0.2)),
+        float(config.get("DETECTION_TILE_MIN_MEGAPIXELS", 4)),
+        int(config.get("DETECTION_TILE_MAX", 48)),
+        max(1, int(config.get("DETECTION_TILE_BATCH", 4))),
+    )
+
+
+def roi_region(img, profile):
+    """The profile's ROI as pixel bounds ``(x0, y0, x1, y1)`` of ``img``."""
+    height, width = img.shape[:2]
+    if profile.roi is None:
+        return 0, 0, width, height
+    rx, ry, rw, rh = profile.roi
+    return int(rx * width), int(ry * height), min(width, int((rx + rw) * width)), min(height, int((ry + rh) * height))
+
+
+def _starts(length, tile, step):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, step))
+    return starts + [length - tile]                 # last tile flush with the edge
+
+
+def tile_frames(img, profile, input_size, tiling=None):
+    """Frames to run for ``img``: the whole ROI, plus overlapping tiles of it when it is large.
+
+    The whole-ROI frame still finds bottles bigger than a tile; tiles find the
+    small ones a single downscaled pass misses. Results are merged by one NMS.
+    """
+    region = roi_region(img, profile)
+    frames = [Frame(img, profile, input_size, region)]
+    x0, y0, x1, y1 = region
+    width, height = x1 - x0, y1 - y0
+    if tiling is None or width * height <= tiling.min_megapixels * 1e6:
+        return frames
+
+    tile = tiling.tile_size
+    while True:
+        tile_w, tile_h = min(tile, width), min(tile, height)
+        xs = _starts(width, tile_w, max(1, int(tile_w * (1 - tiling.overlap))))
+        ys = _starts(height, tile_h, max(1, int(tile_h * (1 - tiling.overlap))))
+        if len(xs) * len(ys) <= tiling.max_tiles:
+            break
+        tile = int(tile * math.sqrt(len(xs) * len(ys) / tiling.max_tiles)) + 1   # bound the tile count
+    tile_profile = profile._replace(letterbox=True)
+    for ty in ys:
+        for tx in xs:
+            bounds = (x0 + tx, y0 + ty, x0 + tx + tile_w, y0 + ty + tile_h)
+            frames.append(Frame(img, tile_profile, input_size, bounds, region))
+    return frames
+
+
+class Frame:
+    """A camera frame (or tile of one), its model input and the transform back to frame pixels.
+
+    The blob is built on access, so a large photo's tiles only hold a view of
+    the image until their batch runs.
+    """
+
+    EDGE_MARGIN = 2      # px; boxes this close to an inner tile edge are cut off by it
+
+    def __init__(self, img, profile, input_size, region=None, parent=None):
+        height, width = img.shape[:2]
+        self.width, self.height = width, height
+        x0, y0, x1, y1 = region or roi_region(img, profile)
+        self.off_x, self.off_y = x0, y0
+        self.end_x, self.end_y = x1, y1
+        img = img[y0:y1, x0:x1]
+        # Tile edges inside the ROI: a box touching one is a partial bottle that a
+        # neighbouring tile (or the whole-ROI frame) sees whole
+        self.inner_edges = None
+        if parent is not None:
+            px0, py0, px1, py1 = parent
+            self.inner_edges = (x0 > px0, y0 > py0, x1 < px1, y1 < py1)
+        crop_h, crop_w = img.shape[:2]
+
+        self.letterbox = profile.letterbox
+        if self.letterbox:
+            scale = min(input_size / crop_w, input_size / crop_h)
+            self.scale_x = self.scale_y = scale
+            self.new_w, self.new_h = max(1, round(crop_w * scale)), max(1, round(crop_h * scale))
+            self.pad_x, self.pad_y = (input_size - self.new_w) // 2, (input_size - self.new_h) // 2
+        else:
+            self.scale_x, self.scale_y = input_size / crop_w, input_size / crop_h
+            self.pad_x = self.pad_y = 0
+        self.crop = img
+        self.input_size = input_size
+
+    @property
+    def blob(self):
+        size = self.input_size
+        if not self.letterbox:
+            return cv2.dnn.blobFromImage(self.crop, 0.00392, (size, size), (0, 0, 0), True, crop=False)
+        canvas = np.full((size, size, 3), PAD_VALUE, np.uint8)
+        canvas[self.pad_y:self.pad_y + self.new_h, self.pad_x:self.pad_x + self.new_w] = cv2.resize(
+            self.crop, (self.new_w, self.new_h), interpolation=cv2.INTER_AREA if self.scale_x < 1 else cv2.INTER_LINEAR
+        )
+        return cv2.dnn.blobFromImage(canvas, 0.00392, swapRB=True, crop=False)
+
+    def to_frame(self, cx, cy, w, h):
+        """Normalised network box (centre, size) → ``[x, y, w, h]`` in original-frame pixels."""
+        s = self.input_size
+        box_w, box_h = w * s / self.scale_x, h * s / self.scale_y
+        center_x = (cx * s - self.pad_x) / self.scale_x + self.off_x
+        center_y = (cy * s - self.pad_y) / self.scale_y + self.off_y
+        return [int(center_x - box_w / 2), int(center_y - box_h / 2), int(box_w), int(box_h)]
+
+    def cut_by_tile_edge(self, x, y, w, h):
+        if self.inner_edges is None:
+            return False
+        left, top, right, bottom = self.inner_edges
+        m = self.EDGE_MARGIN
+        return (
+            (left and x <= self.off_x + m)
+            or (top and y <= self.off_y + m)
+            or (right and x + w >= self.end_x - m)
+            or (bottom and y + h >= self.end_y - m)
+        )
@@ -0,0 +1,150 @@
+# services/pricing.py
+"""Material rates from the `material_rates` table, served from memory.
+
+Rates exist at three levels – default, region, kiosk fleet – each with an
+effective window; the most specific level with a rate in effect wins. The
+whole table is loaded into an immutable `PricingTable` snapshot that a
+background thread swaps out every PRICING_REFRESH_SECONDS, so a deposit
+prices itself with a dict lookup and no query. Rate rows are never edited in
+place (a price change is a new row with a later ``effective_from``), so a
+row's id identifies exactly what was charged; it is stored on the
+Transaction as ``rate_version``.
+
+Until the table has been read once, deposits are priced from DEFAULT_RATES
+with no ``rate_version``; that state is logged as an error, exported as the
+``pricing_fallback_active`` gauge and fails ``/health``.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from flask import request
+
+# Used only until the table has been read once (e.g. before `flask db upgrade`).
+DEFAULT_RATES = {"plastic": 5, "aluminum": 10}
+
+Rate = namedtuple("Rate", "id material region kiosk_fleet rate_cents effective_from effective_to")
+Quote = namedtuple("Quote", "material rate_cents rate_version")
+
+
+def kiosk_region():
+    """Region a kiosk device is installed in, from its `X-Kiosk-Region` header."""
+    region = request.headers.get("X-Kiosk-Region", "").strip().lower()
+    return region or None
+
+
+class PricingTable:
+    """One immutable snapshot of `material_rates`."""
+
+    def __init__(self, rates=(), version=None):
+        self._rates = defaultdict(list)      # (material, region, fleet) → rates, newest effective_from first
+        for rate in sorted(rates, key=lambda r: r.effective_from, reverse=True):
+            self._rates[(rate.material, rate.region, rate.kiosk_fleet)].append(rate)
+        self.materials = sorted({r.material for r in rates})
+        self.version = version
+
+    def _in_effect(self, key, at):
+        for rate in self._rates.get(key, ()):
+            if rate.effective_from <= at and (rate.effective_to is None or at < rate.effective_to):
+                return rate
+        return None
+
+    def quote(self, material, region=None, fleet=None, at=None):
+        """Rate for ``material`` at ``at`` (default now), or None if it isn't priced."""
+        at = at or datetime.utcnow()
+        for key in (
+            (material, region, fleet),
+            (material, None, fleet),
+            (material, region, None),
+            (material, None, None),
+        ):
+            rate = self._in_effect(key, at)
+            if rate is not None:
+                return Quote(material, rate.rate_cents, rate.id)
+        return None
+
+
+FALLBACK_TABLE = PricingTable([Rate(None, m, None, None, c, datetime.min, None) for m, c in DEFAULT_RATES.items()])
+
+
+class PricingEngine:
+    """Flask-extension style: create at import, configure with ``init_app``."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.refresh_seconds = 30
+        self.table = FALLBACK_TABLE
+        self.loaded = False
+        self._pid = None                     # process the refresher was started in
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.refresh_seconds = app.config.get("PRICING_REFRESH_SECONDS", self.refresh_seconds)
+        self.logger = app.logger
+        app.extensions["pricing"] = self
+
+    @property
+    def fallback(self):
+        """True while pricing from DEFAULT_RATES because the table never loaded."""
+        return self.table is FALLBACK_TABLE
+
+    # ───────────────────── loading ─────────────────────
+    def load(self):
+        """Read the whole table into a new snapshot and swap it in (needs an app context)."""
+        from models import MaterialRate
+
+        rates = [Rate(*(getattr(row, f) for f in Rate._fields)) for row in MaterialRate.query.all()]
+        if not rates:
+            raise LookupError("material_rates is empty")
+        self.table = PricingTable(rates, version=max(r.id for r in rates))   # readers keep the old one
+        self.loaded = True
+        return self.table
+
+    def refresh(self):
+        """`load()` under its own app context; on error the current snapshot stays."""
+        from extensions import db
+        from monitoring.metrics import PRICING_FALLBACK
+
+        with self.app.app_context():
+            try:
+                self.load()
+            except Exception as e:  # noqa: BLE001 – e.g. DB restarting; try again next tick
+                if self.fallback:
+                    self.logger.error(f"Pricing from built-in DEFAULT_RATES, material_rates not loaded: {e}")
+                else:
+                    self.logger.warning(f"Pricing refresh failed, keeping version {self.table.version}: {e}")
+            finally:
+                db.session.remove()
+        PRICING_FALLBACK.set(1 if self.fallback else 0)
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+
+    def _ensure_started(self):
+        # Started lazily so every (forked) worker process gets its own thread.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if not self.loaded:
+                self.refresh()
+            if self.refresh_seconds > 0:
+                threading.Thread(target=self._refresh_loop, name="pricing-refresh", daemon=True).start()
+
+    # ───────────────────── lookups ─────────────────────
+    def snapshot(self):
+        """Current table; hold on to it to price several items consistently."""
+        if self.app is not None and self._pid != os.getpid():
+            self._ensure_started()
+        return self.table
+
+    def quote(self, material, region=None, fleet=None, at=None):
+        return self.snapshot().quote(material, region, fleet, at)
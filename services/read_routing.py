@@ -0,0 +1,172 @@
+# services/read_routing.py
+"""Send read-only endpoints to a replica when DATABASE_REPLICA_URL is set.
+
+Views wrapped in `replica_reads` run with ``g.db_bind = "replica"``, which
+`RoutingSession` turns into the replica engine for their SELECTs; the first
+write sends the rest of the view to the primary.
+A user who just deposited or withdrew is kept on the primary for
+REPLICA_STICKY_SECONDS (`ReadRouter.note_write`), so they always see their own
+write; the marker lives in Redis, so it holds across workers. If the replica
+errors, the view is re-run on the primary and the replica is skipped for
+REPLICA_RETRY_SECONDS.
+"""
+import logging
+import time
+from functools import wraps
+
+import redis
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.sql.elements import TextClause
+
+from monitoring.metrics import DB_READ_ROUTING
+
+REPLICA_BIND = "replica"
+
+
+class RoutingSession(Session):
+    """`db.session` class: SELECTs go to the replica bind while ``g.db_bind`` says so.
+
+    Anything else (INSERT/UPDATE/DELETE, SELECT … FOR UPDATE, flushes) goes to
+    the primary and keeps the rest of the view there, so it reads its own write.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get("db_bind") == REPLICA_BIND:
+            if self._flushing or (clause is not None and not _read_only(clause)):
+                g.pop("db_bind")
+            elif clause is not None:
+                return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _read_only(clause):
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == "SELECT"
+    return getattr(clause, "is_select", False) and getattr(clause, "_for_update_arg", None) is None
+
+
+class ReadRouter:
+    """Flask-extension style: create at import, configure with ``init_app`` (before ``db.init_app``)."""
+
+    REDIS_RETRY_SECONDS = 5
+    MAX_LOCAL_STICKY = 10000
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.sticky_seconds = 5
+        self.retry_seconds = 30
+        self._replica_down_until = 0.0
+        self._sticky = {}                    # str(user_id) → monotonic expiry
+        self._redis = None
+        self._redis_down_until = 0.0
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        url = app.config.get("DATABASE_REPLICA_URL")
+        self.enabled = bool(url)
+        self.sticky_seconds = app.config.get("REPLICA_STICKY_SECONDS", self.sticky_seconds)
+        self.retry_seconds = app.config.get("REPLICA_RETRY_SECONDS", self.retry_seconds)
+        self.logger = app.logger
+        if self.enabled:
+            bind = {"url": url}
+            if url.startswith("postgresql"):
+                # Fail over in seconds, not after the OS TCP timeout.
+                bind["connect_args"] = {"connect_timeout": app.config.get("REPLICA_CONNECT_TIMEOUT_SECONDS", 2)}
+            app.config.setdefault("SQLALCHEMY_BINDS", {})
+            app.config["SQLALCHEMY_BINDS"] = {**app.config["SQLALCHEMY_BINDS"], REPLICA_BIND: bind}
+            if app.config.get("REPLICA_STICKY_REDIS"):
+                self._redis = redis.Redis.from_url(
+                    app.config["REDIS_URL"], socket_connect_timeout=0.05, socket_timeout=0.05
+                )
+        app.extensions["read_router"] = self
+
+    # ───────────────────── read-your-writes ─────────────────────
+    @staticmethod
+    def _key(user_id):
+        return f"db:sticky:{user_id}"
+
+    def _redis_call(self, fn, *args):
+        if self._redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        try:
+            return fn(*args)
+        except redis.RedisError as e:
+            self._redis_down_until = time.monotonic() + self.REDIS_RETRY_SECONDS
+            self.logger.warning(f"Replica stickiness falling back to in-process markers: {e}")
+            return None
+
+    def note_write(self, user_id):
+        """Keep ``user_id``'s reads on the primary for the next REPLICA_STICKY_SECONDS."""
+        if not self.enabled or self.sticky_seconds <= 0:
+            return
+        now = time.monotonic()
+        if len(self._sticky) >= self.MAX_LOCAL_STICKY:
+            self._sticky = {k: v for k, v in self._sticky.items() if v > now}
+        self._sticky[str(user_id)] = now + self.sticky_seconds
+        if self._redis:
+            self._redis_call(self._redis.psetex, self._key(user_id), int(self.sticky_seconds * 1000), 1)
+
+    def is_sticky(self, user_id):
+        if self._sticky.get(str(user_id), 0) > time.monotonic():
+            return True
+        if self._redis:
+            return bool(self._redis_call(self._redis.exists, self._key(user_id)))
+        return False
+
+    # ───────────────────── replica health ─────────────────────
+    def replica_available(self):
+        return self.enabled and time.monotonic() >= self._replica_down_until
+
+    def mark_replica_down(self, error):
+        self._replica_down_until = time.monotonic() + self.retry_seconds
+        self.logger.warning(f"Read replica unavailable, using the primary for {self.retry_seconds}s: {getattr(error, 'orig', error)}")
+
+    def target_for(self, user_id=None):
+        """`replica`, or why the primary is used instead."""
+        if not self.enabled:
+            return None
+        if not self.replica_available():
+            return "primary_replica_down"
+        if user_id is not None and self.is_sticky(user_id):
+            return "primary_sticky"
+        return REPLICA_BIND
+
+
+def replica_reads(view):
+    """Run a read-only view on the replica; place below `firebase_required`.
+
+    A connection error while the view is still on the replica marks it down
+    and re-runs the view on the primary; once the view has moved to the
+    primary (its first write) errors propagate, so it never runs twice.
+    """
+    from extensions import db, read_router
+
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        current_user = args[0] if args else None
+        target = read_router.target_for(getattr(current_user, "id", None))
+        if target is None:
+            return view(*args, **kwargs)
+        DB_READ_ROUTING.labels(target).inc()
+        if target != REPLICA_BIND:
+            return view(*args, **kwargs)
+
+        g.db_bind = REPLICA_BIND
+        try:
+            return view(*args, **kwargs)
+        except (OperationalError, InterfaceError) as e:
+            if g.get("db_bind") != REPLICA_BIND:
+                raise                   # failed on the primary after a write: not the replica's fault
+            db.session.rollback()
+            read_router.mark_replica_down(e)
+            DB_READ_ROUTING.labels("primary_fallback").inc()
+            g.pop("db_bind", None)
+            return view(*args, **kwargs)
+        finally:
+            g.pop("db_bind", None)
+
+    return wrapped
@@ -0,0 +1,171 @@
+# services/reconciliation.py
+"""Ledger reconciliation: wallets.balance_cents vs. what the rows say it should be.
+
+A wallet's balance must equal its transactions minus its withdrawals, with
+failed withdrawals credited back. Each run folds only the ledger events since
+the stored high-water mark into `wallet_ledger.expected_cents`, with
+set-based SQL over three event streams:
+
+    transactions          +amount at created_at
+    withdrawals           −amount at created_at
+    failed withdrawals    +amount at processed_at
+
+Months archived by `flask partitions maintain` are read back out of
+`transactions_archive`'s jsonb entries as transactions, so archiving doesn't
+look like drift.
+
+The mark trails ``now`` by RECONCILE_LAG_SECONDS so rows still being committed
+are picked up by the next run. Events newer than the mark are subtracted from
+the live balance before comparing, so in-flight deposits don't show as drift.
+Only wallets with new events are checked; `full=True` rebuilds every wallet.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from extensions import db, balance_cache, event_broker
+from models import LedgerCheckpoint, Wallet, WalletLedger
+from services.partitions import ARCHIVE_TABLE, archive_exists
+
+CHECKPOINT = "wallet-ledger"
+
+
+def _events_sql(since, archived=False):
+    """Per-event union; ``since`` restricts to events after the previous mark.
+
+    ``archived`` adds the transactions folded into `transactions_archive`.
+    """
+    after = lambda col: f"AND {col} > :since" if since else ""
+    archive = f"""
+        UNION ALL
+        SELECT CAST(e->>'wallet_id' AS uuid), CAST(e->>'amount_cents' AS bigint), CAST(e->>'created_at' AS timestamp)
+        FROM {ARCHIVE_TABLE} a, jsonb_array_elements(a.entries) e
+        WHERE 1 = 1 {"AND a.month >= date_trunc('month', CAST(:since AS timestamp))" if since else ""}
+            {after("CAST(e->>'created_at' AS timestamp)")}
+    """ if archived else ""
+    return f"""
+        SELECT wallet_id, amount_cents AS delta, created_at AS at
+        FROM transactions WHERE 1 = 1 {after('created_at')}
+        {archive}
+        UNION ALL
+        SELECT wallet_id, -amount_cents, created_at
+        FROM withdrawals WHERE 1 = 1 {after('created_at')}
+        UNION ALL
+        SELECT wallet_id, amount_cents, COALESCE(processed_at, created_at)
+        FROM withdrawals WHERE status = 'failed'
+            {"AND (processed_at > :since OR (processed_at IS NULL AND created_at > :since))" if since else ""}
+    """
+
+
+def _begin_snapshot():
+    # Balances and event sums must come from the same snapshot, or a deposit
+    # committing between the two reads would look like drift.
+    if db.session.get_bind().dialect.name == "postgresql":
+        db.session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+
+def reconcile(full=False, repair=False, now=None):
+    """One reconciliation pass; returns a summary dict with the discrepancies found."""
+    _begin_snapshot()
+    checkpoint = db.session.get(LedgerCheckpoint, CHECKPOINT)
+    full = full or checkpoint is None
+    since = None if full else checkpoint.high_water_mark
+    until = (now or datetime.utcnow()) - timedelta(seconds=current_app.config["RECONCILE_LAG_SECONDS"])
+    if since is not None and until <= since:
+        db.session.rollback()
+        return {"full": False, "since": since, "until": since, "wallets_checked": 0, "discrepancies": [], "repaired": 0}
+    params = {"since": since, "until": until}
+
+    # ① per-wallet deltas: up to the new mark, and after it (still in flight)
+    db.session.execute(text("DROP TABLE IF EXISTS ledger_deltas"))
+    db.session.execute(text(f"""
+        CREATE TEMPORARY TABLE ledger_deltas AS
+        SELECT wallet_id,
+               SUM(CASE WHEN at <= :until THEN delta ELSE 0 END) AS window_delta,
+               SUM(CASE WHEN at >  :until THEN delta ELSE 0 END) AS after_delta
+        FROM ({_events_sql(since, archive_exists())}) events
+        GROUP BY wallet_id
+    """), params)
+    if full:
+        db.session.execute(text("""
+            INSERT INTO ledger_deltas (wallet_id, window_delta, after_delta)
+            SELECT id, 0, 0 FROM wallets
+            WHERE id NOT IN (SELECT wallet_id FROM ledger_deltas)
+        """))
+
+    # ② fold the window into the stored expectation (replace on a full run)
+    expected = "excluded.expected_cents" if full else "wallet_ledger.expected_cents + excluded.expected_cents"
+    db.session.execute(text(f"""
+        INSERT INTO wallet_ledger (wallet_id, expected_cents, reconciled_at)
+        SELECT wallet_id, window_delta, :until FROM ledger_deltas WHERE true
+        ON CONFLICT (wallet_id) DO UPDATE SET
+            expected_cents = {expected},
+            reconciled_at  = excluded.reconciled_at
+    """), params)
+
+    # ③ compare against the live balance minus in-flight events
+    rows = db.session.execute(text("""
+        SELECT w.id AS wallet_id, w.user_id, w.balance_cents, l.expected_cents, d.after_delta,
+               w.balance_cents - d.after_delta - l.expected_cents AS drift_cents
+        FROM ledger_deltas d
+        JOIN wallet_ledger l ON l.wallet_id = d.wallet_id
+        JOIN wallets w       ON w.id = d.wallet_id
+        WHERE w.balance_cents - d.after_delta <> l.expected_cents
+    """)).mappings().all()
+    discrepancies = [
+        {**row, "wallet_id": uuid.UUID(str(row["wallet_id"])), "user_id": uuid.UUID(str(row["user_id"]))}
+        for row in rows
+    ]
+    checked = db.session.execute(text("SELECT count(*) FROM ledger_deltas")).scalar()
+    db.session.execute(text("DROP TABLE ledger_deltas"))
+
+    if checkpoint is None:
+        checkpoint = LedgerCheckpoint(name=CHECKPOINT, high_water_mark=until)
+        db.session.add(checkpoint)
+    checkpoint.high_water_mark = until
+    db.session.commit()
+
+    for d in discrepancies:
+        current_app.logger.warning(
+            f"Ledger drift on wallet {d['wallet_id']}: balance {d['balance_cents']}, "
+            f"expected {d['expected_cents'] + d['after_delta']} ({d['drift_cents']:+d} cents)"
+        )
+    repaired = sum(1 for d in discrepancies if repair and repair_wallet(d["wallet_id"], d["user_id"], until))
+    return {
+        "full": full,
+        "since": since,
+        "until": until,
+        "wallets_checked": checked,
+        "discrepancies": discrepancies,
+        "repaired": repaired,
+    }
+
+
+def repair_wallet(wallet_id, user_id, until):
+    """Set one wallet's balance to its ledger expectation; returns True if it changed.
+
+    Runs under the wallet's row lock, so writers to that wallet wait and the
+    in-flight delta read here is consistent with the balance being fixed.
+    """
+    wallet = Wallet.query.filter_by(id=wallet_id).with_for_update().first()
+    expected = db.session.get(WalletLedger, wallet_id).expected_cents
+    after = db.session.execute(
+        text(f"SELECT COALESCE(SUM(delta), 0) FROM ({_events_sql(True, archive_exists())}) events "
+             "WHERE wallet_id = :wallet_id")
+        .bindparams(bindparam("wallet_id", type_=Wallet.id.type)),
+        {"wallet_id": wallet_id, "since": until},
+    ).scalar()
+    fix = expected + after - wallet.balance_cents
+    if not fix:
+        db.session.rollback()
+        return False
+    wallet.balance_cents += fix
+    db.session.commit()
+    current_app.logger.warning(f"Ledger repair on wallet {wallet_id}: {fix:+d} cents")
+
+    wallet_dict = wallet.to_dict()
+    balance_cache.store(user_id, wallet_dict, wallet.version)
+    event_broker.publish_wallet_update(user_id, wallet_dict)
+    return True
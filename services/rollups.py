@@ -0,0 +1,86 @@
+# services/rollups.py
+"""Daily per-kiosk deposit rollups: what dashboards read instead of `transactions`.
+
+`kiosk_daily_rollups` holds one row per (day, device_id, region, material)
+with the deposit count, units and cents. Each run folds only the deposits
+since the stored high-water mark into it with a single set-based
+INSERT … SELECT … GROUP BY … ON CONFLICT DO UPDATE (adding to the existing
+counts), and moves the mark in the same database transaction, so every
+deposit is counted exactly once. The mark trails ``now`` by ROLLUP_LAG_SECONDS
+so rows still being committed are picked up by the next run. `full=True`
+rebuilds every day that still has rows in `transactions` (days already
+archived by `flask partitions maintain` are kept as they are).
+
+Deposits without a device or region (app deposits, rows from before
+transactions recorded them) roll up under ``''``.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import Date, bindparam, text
+
+from extensions import db
+from models import LedgerCheckpoint
+
+CHECKPOINT = "kiosk-daily-rollups"
+TABLE = "kiosk_daily_rollups"
+COLUMNS = ("day", "device_id", "region", "material", "deposits", "units", "amount_cents")
+
+
+def roll_up(full=False, now=None):
+    """One rollup pass; returns a summary dict."""
+    # FOR UPDATE serialises concurrent runs on the mark; a second first run fails on its insert
+    checkpoint = db.session.get(LedgerCheckpoint, CHECKPOINT, with_for_update=True, populate_existing=True)
+    full = full or checkpoint is None
+    since = None if full else checkpoint.high_water_mark
+    until = (now or datetime.utcnow()) - timedelta(seconds=current_app.config["ROLLUP_LAG_SECONDS"])
+    if since is not None and until <= since:
+        db.session.rollback()
+        return {"full": False, "since": since, "until": since, "groups": 0}
+    params = {"since": since, "until": until}
+
+    if full:
+        db.session.execute(text(f"""
+            DELETE FROM {TABLE}
+            WHERE day >= (SELECT date(min(created_at)) FROM transactions WHERE transaction_type = 'deposit')
+        """))
+    groups = db.session.execute(text(f"""
+        INSERT INTO {TABLE} (day, device_id, region, material, deposits, units, amount_cents, updated_at)
+        SELECT date(created_at), COALESCE(device_id, ''), COALESCE(region, ''), COALESCE(material, ''),
+               count(*), COALESCE(sum(units), 0), sum(amount_cents), :until
+        FROM transactions
+        WHERE transaction_type = 'deposit' AND created_at <= :until {"AND created_at > :since" if since else ""}
+        GROUP BY date(created_at), COALESCE(device_id, ''), COALESCE(region, ''), COALESCE(material, '')
+        ON CONFLICT (day, device_id, region, material) DO UPDATE SET
+            deposits     = {TABLE}.deposits + excluded.deposits,
+            units        = {TABLE}.units + excluded.units,
+            amount_cents = {TABLE}.amount_cents + excluded.amount_cents,
+            updated_at   = excluded.updated_at
+    """), params).rowcount
+
+    if checkpoint is None:
+        checkpoint = LedgerCheckpoint(name=CHECKPOINT, high_water_mark=until)
+        db.session.add(checkpoint)
+    checkpoint.high_water_mark = until
+    db.session.commit()
+    return {"full": full, "since": since, "until": until, "groups": groups}
+
+
+def rollup_query(start=None, end=None, device_id=None, region=None, material=None):
+    """SELECT over the rollups for an export, ordered by day; ``end`` is inclusive."""
+    clauses, params = [], []
+    for column, value in (("device_id", device_id), ("region", region), ("material", material)):
+        if value is not None:
+            clauses.append(f"{column} = :{column}")
+            params.append(bindparam(column, value))
+    if start is not None:
+        clauses.append("day >= :start")
+        params.append(bindparam("start", start, type_=Date))
+    if end is not None:
+        clauses.append("day <= :end")
+        params.append(bindparam("end", end, type_=Date))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return text(f"""
+        SELECT {', '.join(COLUMNS)} FROM {TABLE} {where}
+        ORDER BY day, device_id, region, material
+    """).bindparams(*params)
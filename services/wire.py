@@ -0,0 +1,89 @@
+# services/wire.py
+"""Content negotiation for the kiosk endpoints: JSON, MessagePack or CBOR.
+
+A kiosk picks the encoding with ``Accept`` (``application/msgpack``,
+``application/cbor``; anything else gets JSON) and asks for the minimal
+field set with a ``profile=compact`` parameter on it, e.g.
+``Accept: application/msgpack; profile=compact``. Request bodies may be sent
+in the same encodings. CBOR needs the optional ``cbor2`` package and is only
+offered when it is installed.
+"""
+from flask import jsonify, request, Response
+import msgpack
+
+try:
+    import cbor2
+except ImportError:  # optional
+    cbor2 = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+_ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+
+def _encoders():
+    encoders = {MSGPACK: lambda payload: msgpack.packb(payload, use_bin_type=True)}
+    if cbor2 is not None:
+        encoders[CBOR] = cbor2.dumps
+    return encoders
+
+
+ENCODERS = _encoders()
+
+
+def _decode(mimetype, data):
+    if mimetype == MSGPACK:
+        return msgpack.unpackb(data, raw=False)
+    return cbor2.loads(data)
+
+
+def negotiate():
+    """``(mimetype, compact)`` for this request from its Accept header."""
+    for value, quality in request.accept_mimetypes:          # highest quality first
+        if quality <= 0:
+            continue
+        mimetype, _, params = value.partition(";")
+        mimetype = mimetype.strip().lower()
+        mimetype = _ALIASES.get(mimetype, mimetype)
+        if mimetype in ENCODERS or mimetype == JSON:
+            compact = "profile=compact" in params.replace(" ", "").lower()
+            return mimetype, compact
+    return JSON, False
+
+
+def wants_compact():
+    return negotiate()[1]
+
+
+def encode(mimetype, payload):
+    """Body bytes for ``payload`` (plain dicts / lists / str / numbers) in a binary ``mimetype``."""
+    return ENCODERS[mimetype](payload)
+
+
+def respond(payload, status=200):
+    """``payload`` as a response in the negotiated encoding (JSON by default)."""
+    mimetype, _ = negotiate()
+    if mimetype == JSON:
+        response = jsonify(payload)
+    else:
+        response = Response(encode(mimetype, payload), mimetype=mimetype)
+    response.status_code = status
+    response.vary.add("Accept")
+    return response
+
+
+def request_payload():
+    """The request body as a dict, decoded per its Content-Type; None if missing or malformed."""
+    mimetype = _ALIASES.get(request.mimetype, request.mimetype)
+    if mimetype not in ENCODERS:
+        return request.get_json()
+    try:
+        payload = _decode(mimetype, request.get_data())
+    except Exception:  # noqa: BLE001 – any decoder error is a bad request body
+        return None
+    return payload if isinstance(payload, dict) else None
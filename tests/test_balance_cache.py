@@ -0,0 +1,41 @@
+# tests/test_balance_cache.py
+from conftest import AUTH, TEST_EMAIL
+
+
+def wallet(balance_cents, updated_at):
+    return {"id": "w1", "balance_cents": balance_cents, "balance_dollars": balance_cents / 100,
+            "updated_at": updated_at}
+
+
+def test_older_version_never_replaces_newer():
+    """A miss fill that read the row before a deposit committed lands after it."""
+    from services.balance_cache import BalanceCache
+
+    cache = BalanceCache()
+    deposit = cache.store("u1", wallet(900, "t2"), 2)
+    assert cache.store("u1", wallet(400, "t1"), 1) == deposit
+    assert cache.get("u1")["wallet"]["balance_cents"] == 900
+    assert cache.store("u1", wallet(300, "t3"), 3)["wallet"]["balance_cents"] == 300
+
+
+def test_balance_changes_bump_the_cached_version(app, client):
+    from models import User, Wallet
+
+    from extensions import balance_cache
+
+    client.get("/user/kiosk-id", headers=AUTH)                       # provisions the test user
+    with app.app_context():
+        user_id = User.query.filter_by(email=TEST_EMAIL).one().id
+        start = Wallet.query.filter_by(user_id=user_id).one().version
+
+    assert client.post("/deposit", json={"material": "aluminum", "units": 40}, headers=AUTH).status_code == 201
+    assert balance_cache.get(user_id)["version"] == start + 1
+    assert client.post("/withdraw", json={"amount_cents": 100, "bank_token": "ba_cache"},
+                       headers=AUTH).status_code == 202
+    assert balance_cache.get(user_id)["version"] == start + 2
+
+    balance_cache.clear()
+    body = client.get("/wallet", headers=AUTH).get_json()
+    with app.app_context():
+        row = Wallet.query.filter_by(user_id=user_id).one()
+        assert (row.version, row.balance_cents) == (start + 2, body["balance_cents"])
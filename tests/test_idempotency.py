@@ -0,0 +1,59 @@
+# tests/test_idempotency.py
+from conftest import AUTH, TEST_EMAIL
+
+
+def test_deposit_survives_post_commit_failure(app, client, monkeypatch):
+    """A stream outage after the credit commits still answers 201, and the retry replays it."""
+    from extensions import event_broker
+    from models import User, Wallet
+
+    def broken(*args, **kwargs):
+        raise ConnectionError("stream down")
+
+    monkeypatch.setattr(event_broker, "publish_wallet_update", broken)
+    headers = {**AUTH, "Idempotency-Key": "post-commit-failure"}
+    body = {"material": "aluminum", "units": 3}
+
+    def balance():
+        with app.app_context():
+            user = User.query.filter_by(email=TEST_EMAIL).one()
+            return Wallet.query.filter_by(user_id=user.id).one().balance_cents
+
+    client.get("/user/kiosk-id", headers=AUTH)                       # provisions the test user
+    before = balance()
+    first = client.post("/deposit", json=body, headers=headers)
+    assert first.status_code == 201, first.get_json()
+    retry = client.post("/deposit", json=body, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+    assert balance() - before == first.get_json()["transaction"]["amount_cents"]
+
+
+def test_failure_after_commit_is_answered_as_applied(app, client, monkeypatch):
+    """The handler raises after the credit commits: 200 `applied` now and on every retry, never 409."""
+    from models import User, Wallet
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("serializer bug")
+
+    monkeypatch.setattr(Wallet, "serialize", staticmethod(broken))
+    headers = {**AUTH, "Idempotency-Key": "raised-after-commit"}
+    body = {"material": "aluminum", "units": 2}
+
+    client.get("/user/kiosk-id", headers=AUTH)                       # provisions the test user
+    with app.app_context():
+        user_id = User.query.filter_by(email=TEST_EMAIL).one().id
+        before = Wallet.query.filter_by(user_id=user_id).one().balance_cents
+
+    first = client.post("/deposit", json=body, headers=headers)
+    assert first.status_code == 200
+    assert first.get_json()["applied"] is True
+    retry = client.post("/deposit", json=body, headers=headers)
+    assert (retry.status_code, retry.headers["Idempotent-Replayed"]) == (200, "true")
+    assert retry.get_json() == first.get_json()
+
+    amount_cents = first.get_json()["transaction"]["amount_cents"]
+    with app.app_context():
+        assert Wallet.query.filter_by(user_id=user_id).one().balance_cents == before + amount_cents
+    assert first.get_json()["new_balance_cents"] == before + amount_cents
@@ -0,0 +1,33 @@
+# tests/test_leaderboard.py
+from datetime import datetime
+
+import pytest
+
+from conftest import AUTH
+
+NOW = datetime(2025, 9, 17, 12)          # 2025-W38
+
+
+@pytest.mark.parametrize("period, kept", [
+    ("all", True),
+    ("2025-W38", True),
+    ("2025-W26", True),                  # LEADERBOARD_WEEKS_KEPT back
+    ("2025-W25", False),
+    ("2025-W39", False),                 # next week: nothing recorded yet
+    ("2099-W01", False),
+])
+def test_kept_weeks(period, kept):
+    from services.leaderboard import Leaderboard
+
+    assert Leaderboard().kept(period, now=NOW) is kept
+
+
+def test_future_week_is_refused_before_building(app, client, monkeypatch):
+    from extensions import leaderboard
+
+    def build(*args, **kwargs):
+        raise AssertionError("standings built for a future week")
+
+    monkeypatch.setattr(leaderboard, "standings", build)
+    response = client.get("/leaderboard?week=2099-W01", headers=AUTH)
+    assert response.status_code == 404
@@ -0,0 +1,438 @@
+# tests/test_payouts.py
+"""The withdrawal outbox (services/payouts.py) against the stub backend.
+
+``stripe`` stands in for ``_stub_payout``: it records every idempotency key it
+is sent and raises the errors queued on it, in order.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import stripe as stripe_sdk
+
+EMAIL = "payouts-tests@example.com"
+
+
+class FakeStripe:
+    def __init__(self):
+        self.keys = []
+        self.errors = []
+
+    def __call__(self, amount_cents, idempotency_key, metadata=None, destination=None):
+        self.keys.append(idempotency_key)
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"po_{idempotency_key}"
+
+
+def ambiguous():
+    from services.payouts import TransientPayoutError
+
+    return TransientPayoutError("Request timed out", ambiguous=True)
+
+
+def rate_limited():
+    from services.payouts import TransientPayoutError
+
+    return TransientPayoutError("Too many requests")
+
+
+def declined():
+    return stripe_sdk.error.CardError("Your card was declined", None, "card_declined")
+
+
+@pytest.fixture
+def stripe(app, monkeypatch):
+    from extensions import db
+    from models import PayoutBatch, User, Wallet, Withdrawal
+    from services import payouts
+
+    for key, value in {
+        "PAYOUT_BACKEND": "stub",
+        "PAYOUT_AGGREGATE": False,
+        "PAYOUT_AGGREGATE_WINDOW_SECONDS": 0,
+        "PAYOUT_MAX_ATTEMPTS": 3,
+        "PAYOUT_RETRY_BACKOFF_SECONDS": 0,
+        "PAYOUT_CLAIM_LEASE_SECONDS": 300,
+    }.items():
+        monkeypatch.setitem(app.config, key, value)
+    fake = FakeStripe()
+    monkeypatch.setattr(payouts, "_stub_payout", fake)
+    with app.app_context():
+        # Withdrawals queued by other tests stay out of these tests' claims and batches
+        Withdrawal.query.filter(Withdrawal.status.in_(("pending", "processing"))).update(
+            {"status": "completed"}, synchronize_session=False)
+        db.session.commit()
+        yield fake
+        db.session.rollback()
+        users = db.session.query(User.id).filter(User.email == EMAIL)
+        Withdrawal.query.filter(Withdrawal.user_id.in_(users)).delete(synchronize_session=False)
+        PayoutBatch.query.delete()
+        Wallet.query.filter(Wallet.user_id.in_(users)).delete(synchronize_session=False)
+        User.query.filter(User.email == EMAIL).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def make_wallet(balance_cents=10_000):
+    from extensions import db
+    from models import User, Wallet
+
+    user = User(id=uuid.uuid4(), firebase_uid=f"payouts-{uuid.uuid4()}", email=EMAIL)
+    wallet = Wallet(id=uuid.uuid4(), user_id=user.id, balance_cents=balance_cents)
+    db.session.add_all([user, wallet])
+    db.session.commit()
+    return wallet
+
+
+def make_withdrawal(wallet, amount_cents=500, bank_token="ba_one", **columns):
+    """A committed /withdraw: the wallet is debited and the row is `pending` unless overridden."""
+    from extensions import db
+    from models import Withdrawal
+
+    withdrawal = Withdrawal(id=uuid.uuid4(), user_id=wallet.user_id, wallet_id=wallet.id,
+                            amount_cents=amount_cents, bank_token=bank_token, status="pending")
+    for name, value in columns.items():
+        setattr(withdrawal, name, value)
+    wallet.balance_cents -= amount_cents
+    db.session.add(withdrawal)
+    db.session.commit()
+    return withdrawal.id
+
+
+def fetch(model, row_id):
+    from extensions import db
+
+    return db.session.get(model, row_id, populate_existing=True)
+
+
+def stale_lease(wallet, **columns):
+    """A withdrawal whose worker died mid-payout, after sending it once with its own key."""
+    columns = {"status": "processing", "attempts": 1, "claimed_at": datetime.utcnow() - timedelta(hours=1),
+               **columns}
+    return make_withdrawal(wallet, **columns)
+
+
+# ────────────────────────── aggregate mode keeps wd-{id} keys ─────────
+def test_ambiguous_stale_lease_is_not_batched(app, stripe):
+    """Ambiguous stale lease, then aggregate passes: only ever sent with its wd-{id} key."""
+    from models import PayoutBatch, Withdrawal
+    from services.payouts import process_pending
+
+    app.config["PAYOUT_AGGREGATE"] = True
+    withdrawal_id = stale_lease(make_wallet())
+    stripe.errors.append(ambiguous())
+
+    process_pending()
+    row = fetch(Withdrawal, withdrawal_id)
+    assert (row.status, row.payout_uncertain) == ("pending", True)
+    assert stripe.keys == [f"wd-{withdrawal_id}"]
+
+    stripe.keys.clear()
+    process_pending()
+    assert stripe.keys == [f"wd-{withdrawal_id}"]
+    row = fetch(Withdrawal, withdrawal_id)
+    assert (row.status, row.batch_id) == ("completed", None)
+    assert PayoutBatch.query.count() == 0
+
+
+def test_resolved_retry_is_not_batched(app, stripe):
+    from models import PayoutBatch, Withdrawal
+    from services.payouts import process_pending, resolve_withdrawal
+
+    app.config["PAYOUT_AGGREGATE"] = True
+    withdrawal_id = stale_lease(make_wallet(), status="unknown")
+    assert resolve_withdrawal(withdrawal_id, "retry") == "pending"
+
+    process_pending()
+    assert stripe.keys == [f"wd-{withdrawal_id}"]
+    assert fetch(Withdrawal, withdrawal_id).status == "completed"
+    assert PayoutBatch.query.count() == 0
+
+
+# ────────────────────────── claiming ──────────────────────────────────
+def test_claim_skips_rows_locked_by_another_worker(stripe):
+    from sqlalchemy import text
+
+    from extensions import db
+    from models import Withdrawal
+    from services.payouts import claim_withdrawals
+
+    wallet = make_wallet()
+    locked_id, free_id = make_withdrawal(wallet), make_withdrawal(wallet)
+    with db.engine.connect() as other_worker:
+        other_worker.execute(text("SELECT id FROM withdrawals WHERE id = :id FOR UPDATE"), {"id": locked_id})
+        assert claim_withdrawals(10) == [free_id]
+        other_worker.rollback()
+
+    assert fetch(Withdrawal, locked_id).status == "pending"
+    row = fetch(Withdrawal, free_id)
+    assert (row.status, row.attempts) == ("processing", 1)
+    assert row.claimed_at is not None
+
+
+def test_claim_takes_expired_leases_only(stripe):
+    from models import Withdrawal
+    from services.payouts import claim_withdrawals
+
+    wallet = make_wallet()
+    expired_id = stale_lease(wallet)
+    live_id = make_withdrawal(wallet, status="processing", attempts=1, claimed_at=datetime.utcnow())
+    assert claim_withdrawals(10) == [expired_id]
+    assert claim_withdrawals(10) == []
+    assert fetch(Withdrawal, expired_id).attempts == 2
+    assert fetch(Withdrawal, live_id).attempts == 1
+
+
+def test_claim_waits_for_backoff(stripe):
+    from models import Withdrawal
+    from services.payouts import claim_withdrawals
+
+    wallet = make_wallet()
+    withdrawal_id = make_withdrawal(wallet, attempts=1, next_attempt_at=datetime.utcnow() + timedelta(minutes=5))
+    assert claim_withdrawals(10) == []
+
+    fetch(Withdrawal, withdrawal_id).next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    assert claim_withdrawals(10) == [withdrawal_id]
+
+
+# ────────────────────────── outcomes ──────────────────────────────────
+def test_payout_completes(stripe):
+    from models import Withdrawal
+    from services.payouts import process_pending
+
+    withdrawal_id = make_withdrawal(make_wallet(), bank_token="ba_dest")
+    assert process_pending() == 1
+    row = fetch(Withdrawal, withdrawal_id)
+    assert (row.status, row.stripe_payment_intent_id) == ("completed", f"po_wd-{withdrawal_id}")
+    assert stripe.keys == [f"wd-{withdrawal_id}"]
+
+
+def test_transient_error_backs_off_then_refunds(app, stripe):
+    """Rate limiting is not ambiguous: retried with backoff, then failed and credited back."""
+    from models import Wallet, Withdrawal
+    from services.payouts import claim_withdrawals, process_withdrawal
+
+    app.config["PAYOUT_RETRY_BACKOFF_SECONDS"] = 60
+    wallet = make_wallet(10_000)
+    withdrawal_id = make_withdrawal(wallet, amount_cents=700)
+    stripe.errors.extend(rate_limited() for _ in range(3))
+
+    assert claim_withdrawals(10) == [withdrawal_id]
+    assert process_withdrawal(withdrawal_id) == "pending"
+    row = fetch(Withdrawal, withdrawal_id)
+    assert row.next_attempt_at > datetime.utcnow() + timedelta(seconds=50)
+    assert claim_withdrawals(10) == []
+
+    for attempt in (2, 3):
+        fetch(Withdrawal, withdrawal_id).next_attempt_at = datetime.utcnow()
+        assert claim_withdrawals(10) == [withdrawal_id]
+        status = process_withdrawal(withdrawal_id)
+    assert status == "failed"
+    assert stripe.keys == [f"wd-{withdrawal_id}"] * 3
+    assert fetch(Wallet, wallet.id).balance_cents == 10_000
+
+
+def test_definitive_error_refunds(stripe):
+    from models import Wallet, Withdrawal
+    from services.payouts import process_pending
+
+    wallet = make_wallet(10_000)
+    withdrawal_id = make_withdrawal(wallet, amount_cents=700)
+    stripe.errors.append(declined())
+
+    process_pending()
+    row = fetch(Withdrawal, withdrawal_id)
+    assert row.status == "failed"
+    assert "declined" in row.last_error
+    assert fetch(Wallet, wallet.id).balance_cents == 10_000
+
+
+def test_ambiguous_errors_hold_without_refund(stripe):
+    from models import Wallet, Withdrawal
+    from services.payouts import claim_withdrawals, process_withdrawal
+
+    wallet = make_wallet(10_000)
+    withdrawal_id = make_withdrawal(wallet, amount_cents=700)
+    stripe.errors.extend(ambiguous() for _ in range(3))
+
+    for attempt in range(3):
+        assert claim_withdrawals(10) == [withdrawal_id]
+        status = process_withdrawal(withdrawal_id)
+    assert status == "unknown"
+    assert stripe.keys == [f"wd-{withdrawal_id}"] * 3
+    assert fetch(Wallet, wallet.id).balance_cents == 9_300
+
+
+def test_decline_after_ambiguous_attempt_holds(stripe):
+    """An earlier timeout may have paid it, so a later decline is no proof nothing went out."""
+    from models import Wallet, Withdrawal
+    from services.payouts import claim_withdrawals, process_withdrawal
+
+    wallet = make_wallet(10_000)
+    withdrawal_id = make_withdrawal(wallet, amount_cents=700)
+    stripe.errors.extend([ambiguous(), declined()])
+
+    for expected in ("pending", "unknown"):
+        assert claim_withdrawals(10) == [withdrawal_id]
+        assert process_withdrawal(withdrawal_id) == expected
+    assert fetch(Withdrawal, withdrawal_id).status == "unknown"
+    assert fetch(Wallet, wallet.id).balance_cents == 9_300
+
+
+def test_unexpected_error_holds(stripe):
+    from models import Wallet, Withdrawal
+    from services.payouts import process_pending
+
+    wallet = make_wallet(10_000)
+    withdrawal_id = make_withdrawal(wallet, amount_cents=700)
+    stripe.errors.append(ValueError("unexpected response"))
+
+    process_pending()
+    row = fetch(Withdrawal, withdrawal_id)
+    assert (row.status, row.payout_uncertain) == ("unknown", True)
+    assert fetch(Wallet, wallet.id).balance_cents == 9_300
+
+
+@pytest.mark.parametrize("action, status, balance", [
+    ("paid", "completed", 9_300),
+    ("refund", "failed", 10_000),
+    ("retry", "pending", 9_300),
+])
+def test_resolve_withdrawal(stripe, action, status, balance):
+    from models import Wallet, Withdrawal
+    from services.payouts import resolve_withdrawal
+
+    wallet = make_wallet(10_000)
+    withdrawal_id = stale_lease(wallet, amount_cents=700, status="unknown", payout_uncertain=True)
+    assert resolve_withdrawal(withdrawal_id, action, "po_manual") == status
+    assert resolve_withdrawal(withdrawal_id, action, "po_manual") is None     # only `unknown` rows
+    row = fetch(Withdrawal, withdrawal_id)
+    assert row.status == status
+    assert fetch(Wallet, wallet.id).balance_cents == balance
+    if action == "paid":
+        assert row.stripe_payment_intent_id == "po_manual"
+    assert stripe.keys == []
+
+
+# ────────────────────────── aggregated payouts ────────────────────────
+def batch_of(withdrawal_id):
+    from models import PayoutBatch, Withdrawal
+
+    return fetch(PayoutBatch, fetch(Withdrawal, withdrawal_id).batch_id)
+
+
+def test_batches_group_by_bank_token(app, stripe):
+    from models import PayoutBatch, Withdrawal
+    from services.payouts import process_pending
+
+    app.config["PAYOUT_AGGREGATE"] = True
+    first, second = make_wallet(), make_wallet()
+    a1 = make_withdrawal(first, 100, bank_token="ba_a")
+    a2 = make_withdrawal(second, 250, bank_token="ba_a")
+    b1 = make_withdrawal(first, 400, bank_token="ba_b")
+
+    process_pending()
+    batch_a, batch_b = batch_of(a1), batch_of(b1)
+    assert batch_of(a2).id == batch_a.id != batch_b.id
+    assert (batch_a.bank_token, batch_a.amount_cents, batch_a.withdrawal_count) == ("ba_a", 350, 2)
+    assert (batch_b.bank_token, batch_b.amount_cents, batch_b.withdrawal_count) == ("ba_b", 400, 1)
+    assert sorted(stripe.keys) == sorted([f"batch-{batch_a.id}", f"batch-{batch_b.id}"])
+    assert PayoutBatch.query.filter_by(status="completed").count() == 2
+    for withdrawal_id, batch in ((a1, batch_a), (a2, batch_a), (b1, batch_b)):
+        row = fetch(Withdrawal, withdrawal_id)
+        assert (row.status, row.stripe_payment_intent_id) == ("completed", f"po_batch-{batch.id}")
+
+
+def test_batches_wait_for_the_window(app, stripe):
+    from models import PayoutBatch
+    from services.payouts import form_batches
+
+    app.config.update(PAYOUT_AGGREGATE=True, PAYOUT_AGGREGATE_WINDOW_SECONDS=300)
+    withdrawal_id = make_withdrawal(make_wallet(), bank_token="ba_a")
+    assert form_batches() == 0
+    assert form_batches(now=datetime.utcnow() + timedelta(seconds=301)) == 1
+    assert batch_of(withdrawal_id).withdrawal_count == 1
+    assert PayoutBatch.query.count() == 1
+
+
+def test_batch_failure_refunds_every_member(app, stripe):
+    from models import Wallet, Withdrawal
+    from services.payouts import process_pending
+
+    app.config["PAYOUT_AGGREGATE"] = True
+    first, second = make_wallet(10_000), make_wallet(10_000)
+    ids = [make_withdrawal(first, 300), make_withdrawal(first, 200), make_withdrawal(second, 600)]
+    stripe.errors.append(declined())
+
+    process_pending()
+    assert batch_of(ids[0]).status == "failed"
+    assert {fetch(Withdrawal, i).status for i in ids} == {"failed"}
+    assert fetch(Wallet, first.id).balance_cents == 10_000
+    assert fetch(Wallet, second.id).balance_cents == 10_000
+
+
+def test_ambiguous_batch_is_held(app, stripe):
+    from models import Wallet, Withdrawal
+    from services.payouts import claim_batches, process_batch, process_pending
+
+    app.config.update(PAYOUT_AGGREGATE=True, PAYOUT_MAX_ATTEMPTS=2)
+    wallet = make_wallet(10_000)
+    ids = [make_withdrawal(wallet, 300), make_withdrawal(wallet, 200)]
+    stripe.errors.extend([ambiguous(), ambiguous()])
+
+    process_pending()
+    batch = batch_of(ids[0])
+    assert (batch.status, batch.payout_uncertain) == ("pending", True)
+    assert claim_batches(10) == [batch.id]
+    assert process_batch(batch.id) == "unknown"
+    assert stripe.keys == [f"batch-{batch.id}"] * 2
+    assert {fetch(Withdrawal, i).status for i in ids} == {"unknown"}
+    assert fetch(Wallet, wallet.id).balance_cents == 9_500
+
+
+def held_batch(app, stripe):
+    """Two withdrawals from one wallet in a batch left `unknown` by a timeout."""
+    from services.payouts import process_pending
+
+    app.config.update(PAYOUT_AGGREGATE=True, PAYOUT_MAX_ATTEMPTS=1)
+    wallet = make_wallet(10_000)
+    ids = [make_withdrawal(wallet, 300), make_withdrawal(wallet, 200)]
+    stripe.errors.append(ambiguous())
+    process_pending()
+    batch = batch_of(ids[0])
+    assert batch.status == "unknown"
+    stripe.keys.clear()
+    return wallet, batch.id, ids
+
+
+@pytest.mark.parametrize("action, status, members, balance", [
+    ("paid", "completed", "completed", 9_500),
+    ("refund", "failed", "failed", 10_000),
+    ("retry", "pending", "processing", 9_500),
+])
+def test_resolve_batch(app, stripe, action, status, members, balance):
+    from models import PayoutBatch, Wallet, Withdrawal
+    from services.payouts import resolve_batch, resolve_withdrawal
+
+    wallet, batch_id, ids = held_batch(app, stripe)
+    assert resolve_withdrawal(ids[0], "refund") is None                 # members go through their batch
+    assert resolve_batch(batch_id, action, "po_manual") == status
+    assert resolve_batch(batch_id, action, "po_manual") is None         # only `unknown` batches
+    assert {fetch(Withdrawal, i).status for i in ids} == {members}
+    assert fetch(Wallet, wallet.id).balance_cents == balance
+    if action == "paid":
+        assert fetch(PayoutBatch, batch_id).stripe_payout_id == "po_manual"
+        assert {fetch(Withdrawal, i).stripe_payment_intent_id for i in ids} == {"po_manual"}
+    assert stripe.keys == []
+
+
+def test_retried_batch_pays_with_its_own_key(app, stripe):
+    from models import Withdrawal
+    from services.payouts import process_pending, resolve_batch
+
+    wallet, batch_id, ids = held_batch(app, stripe)
+    resolve_batch(batch_id, "retry")
+    process_pending()
+    assert stripe.keys == [f"batch-{batch_id}"]
+    assert batch_of(ids[0]).status == "completed"
+    assert {fetch(Withdrawal, i).status for i in ids} == {"completed"}
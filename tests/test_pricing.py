@@ -0,0 +1,25 @@
+# tests/test_pricing.py
+from prometheus_client import REGISTRY
+
+
+def test_fallback_pricing_fails_health(app, client, monkeypatch):
+    """Without a loaded material_rates table /health is 503 and the fallback gauge is 1."""
+    from extensions import pricing
+    from services.pricing import FALLBACK_TABLE
+
+    def empty():
+        raise LookupError("material_rates is empty")
+
+    monkeypatch.setattr(pricing, "table", FALLBACK_TABLE)
+    monkeypatch.setattr(pricing, "load", empty)
+    pricing.refresh()
+
+    response = client.get("/health")
+    assert response.status_code == 503
+    assert response.get_json()["pricing"] == "fallback"
+    assert REGISTRY.get_sample_value("pricing_fallback_active") == 1
+
+    monkeypatch.undo()
+    pricing.refresh()
+    assert client.get("/health").status_code == 200
+    assert REGISTRY.get_sample_value("pricing_fallback_active") == 0
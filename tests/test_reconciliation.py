@@ -0,0 +1,40 @@
+# tests/test_reconciliation.py
+from datetime import date, datetime, timedelta
+
+from conftest import AUTH, TEST_EMAIL
+
+
+def test_archived_month_still_reconciles(app, client):
+    from extensions import db
+    from models import Transaction, User, Wallet
+    from services.partitions import archive_exists, archive_partition, create_partition
+    from services.reconciliation import reconcile
+
+    client.get("/wallet", headers=AUTH)                  # provisions user + wallet
+    with app.app_context():
+        user = User.query.filter_by(email=TEST_EMAIL).one()
+        wallet = Wallet.query.filter_by(user_id=user.id).one()
+        month = date(2020, 1, 1)
+        create_partition(month)
+        for day, cents in ((3, 150), (17, 275)):
+            db.session.add(Transaction(
+                user_id=user.id, wallet_id=wallet.id, transaction_type="deposit", material="plastic",
+                units=cents // 5, amount_cents=cents, created_at=datetime(2020, 1, day, 12),
+            ))
+        wallet.balance_cents += 425
+        db.session.commit()
+        balance = wallet.balance_cents
+        db.session.commit()
+        assert reconcile(full=True)["discrepancies"] == []
+
+        archive_partition(month)
+        assert archive_exists()
+        assert Transaction.query.filter(Transaction.created_at < datetime(2020, 2, 1)).count() == 0
+        db.session.commit()
+
+        result = reconcile(full=True, repair=True)
+        assert result["discrepancies"] == []
+        assert result["repaired"] == 0
+        assert db.session.get(Wallet, wallet.id, populate_existing=True).balance_cents == balance
+        db.session.commit()
+        assert reconcile(now=datetime.utcnow() + timedelta(minutes=5))["discrepancies"] == []    # incremental